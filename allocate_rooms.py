@@ -1,12 +1,29 @@
 import psycopg2
+import argparse
+import cProfile
 import json
 import os
+import pstats
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import pytz
-import random
-from itertools import combinations
+from allocation_engine import (DEFAULT_OASIS_CAPACITY, OASIS_SOLVERS, PROJECT_SOLVERS, AllocationDiff, build_allocation_plan,
+                               build_best_of_n_plan, build_multi_week_plans, diff_allocation_rows, history_rollup_rows,
+                               plan_digest,
+                               site_names, site_rooms_config, split_existing_rows, split_rooms_config)
 
 OFFICE_TIMEZONE = pytz.timezone("Europe/Amsterdam")  # Or your specific office timezone
+ROOMS_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rooms.json")
+# Advisory lock class ids are ALLOCATION_LOCK_CLASS + index into ALLOCATION_SCOPES, the second key is the week
+ALLOCATION_LOCK_CLASS = 72010
+ALLOCATION_SCOPES = ("project", "oasis")
+DEFAULT_LOCK_TIMEOUT = 300
+LOCK_POLL_INTERVAL = 0.5
 
 def get_day_mapping(base_monday_date=None):
     """
@@ -30,341 +47,654 @@ def get_day_mapping(base_monday_date=None):
         "Friday": this_monday + timedelta(days=4),
     }
 
-def run_allocation(database_url, only=None, base_monday_date=None):
+@contextmanager
+def timed_phase(timings, phase):
+    """Add the wall-clock time spent inside the block to timings[phase]."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start_time
+
+def load_rooms_config(rooms_file_path=ROOMS_FILE_PATH):
+    """Read the room definitions from rooms.json."""
+    with open(rooms_file_path, "r") as f:
+        return json.load(f)
+
+def site_clause(site=None, keyword="AND"):
+    """
+    SQL filter restricting a query to one office site, and its parameters.
+
+    site None means no filter, which keeps single-site databases working unchanged.
+    """
+    if site is None:
+        return "", ()
+    return f" {keyword} site = %s", (site,)
+
+def load_allocation_inputs(cur, only=None, site=None):
+    """
+    Fetch the preference rows the allocation engine needs.
+
+    Returns:
+        tuple: (team_preferences_raw: list, oasis_preferences_raw: list)
+    """
+    team_preferences_raw = []
+    oasis_preferences_raw = []
+    clause, params = site_clause(site, "WHERE")
+    if only in [None, "project"]:
+        cur.execute("SELECT team_name, team_size, preferred_days FROM weekly_preferences" + clause + " ORDER BY team_name",
+                    params)
+        team_preferences_raw = cur.fetchall()
+    if only in [None, "oasis"]:
+        cur.execute("SELECT person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5 FROM oasis_preferences"
+                    + clause + " ORDER BY person_name", params)
+        oasis_preferences_raw = cur.fetchall()
+    return team_preferences_raw, oasis_preferences_raw
+
+def allocation_scope_clause(only=None):
+    """SQL filter restricting weekly_allocations to the rows an `only` run owns."""
+    if only == "project":
+        return " AND room_name != 'Oasis'"
+    if only == "oasis":
+        return " AND room_name = 'Oasis'"
+    return ""
+
+def load_existing_week(cur, base_monday_date, only=None, site=None):
+    """
+    Fetch the allocation rows already stored for the week.
+
+    Returns:
+        list of (team_name, room_name, date, allocated_at, id) tuples
+    """
+    clause, params = site_clause(site)
+    cur.execute(
+        "SELECT team_name, room_name, date, allocated_at, id FROM weekly_allocations WHERE date >= %s AND date <= %s"
+        + allocation_scope_clause(only) + clause,
+        (base_monday_date, base_monday_date + timedelta(days=6), *params),
+    )
+    return cur.fetchall()
+
+def load_existing_weeks(cur, mondays, only=None, site=None):
+    """
+    Fetch the stored allocation rows for several weeks in one query.
+
+    Returns:
+        dict: Monday date -> list of (team_name, room_name, date, allocated_at, id) tuples
+    """
+    rows_by_week = {monday: [] for monday in mondays}
+    clause, params = site_clause(site)
+    cur.execute(
+        "SELECT team_name, room_name, date, allocated_at, id FROM weekly_allocations WHERE date >= %s AND date <= %s"
+        + allocation_scope_clause(only) + clause,
+        (min(mondays), max(mondays) + timedelta(days=6), *params),
+    )
+    for row in cur.fetchall():
+        monday = row[2] - timedelta(days=row[2].weekday())
+        if monday in rows_by_week:
+            rows_by_week[monday].append(row)
+    return rows_by_week
+
+def load_unsited_rows(cur, mondays, only=None):
+    """
+    Fetch the allocation rows without a site for several weeks.
+
+    The app's own writes (ad-hoc adds, the Oasis matrix, the admin editors) do
+    not set a site. A site run treats these rows as occupied: they are neither
+    placed again nor deleted by it.
+
+    Returns:
+        dict: Monday date -> list of (team_name, room_name, date) tuples
+    """
+    rows_by_week = {monday: [] for monday in mondays}
+    cur.execute(
+        "SELECT team_name, room_name, date FROM weekly_allocations WHERE date >= %s AND date <= %s AND site IS NULL"
+        + allocation_scope_clause(only),
+        (min(mondays), max(mondays) + timedelta(days=6)),
+    )
+    for row in cur.fetchall():
+        monday = row[2] - timedelta(days=row[2].weekday())
+        if monday in rows_by_week:
+            rows_by_week[monday].append(row)
+    return rows_by_week
+
+def load_submission_times(cur, only=None, site=None):
+    """
+    Fetch when each team and Oasis person last submitted preferences.
+
+    Returns:
+        tuple: (team_name -> submission_time, person_name -> submission_time)
+    """
+    team_submitted_at = {}
+    person_submitted_at = {}
+    clause, params = site_clause(site, "WHERE")
+    if only in [None, "project"]:
+        cur.execute("SELECT team_name, submission_time FROM weekly_preferences" + clause, params)
+        team_submitted_at = dict(cur.fetchall())
+    if only in [None, "oasis"]:
+        cur.execute("SELECT person_name, submission_time FROM oasis_preferences" + clause, params)
+        person_submitted_at = dict(cur.fetchall())
+    return team_submitted_at, person_submitted_at
+
+def apply_allocation_diff(cur, diff, site=None):
+    """
+    Apply an AllocationDiff to weekly_allocations as one statement batch.
+
+    Deletes, room updates and inserts are rendered into a single multi-statement
+    string and sent in one round trip. Deletes and updates target stored rows by
+    id. Rows the diff leaves alone keep their confirmed/confirmed_at values;
+    moved rows are reset to unconfirmed. With a site, inserted rows are tagged
+    with it.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start_time = time.perf_counter()
+    statements = []
+    if diff.to_delete:
+        statements.append(cur.mogrify("DELETE FROM weekly_allocations WHERE id = ANY(%s)",
+                                      ([row[0] for row in diff.to_delete],)))
+    if diff.to_update:
+        values = b",".join(cur.mogrify("(%s, %s)", (row[0], row[4])) for row in diff.to_update)
+        statements.append(
+            b"UPDATE weekly_allocations w SET room_name = d.new_room_name, confirmed = FALSE, confirmed_at = NULL "
+            b"FROM (VALUES " + values + b") AS d(id, new_room_name) WHERE w.id = d.id"
+        )
+    if diff.to_insert and site is not None:
+        values = b",".join(cur.mogrify("(%s, %s, %s, %s)", (*row, site)) for row in diff.to_insert)
+        statements.append(b"INSERT INTO weekly_allocations (team_name, room_name, date, site) VALUES " + values)
+    elif diff.to_insert:
+        values = b",".join(cur.mogrify("(%s, %s, %s)", row) for row in diff.to_insert)
+        statements.append(b"INSERT INTO weekly_allocations (team_name, room_name, date) VALUES " + values)
+    if statements:
+        cur.execute(b";\n".join(statements))
+    return time.perf_counter() - start_time
+
+def save_run_snapshot(snapshot_dir, base_monday_date, only, solver, plan, all_rooms_config,
+                      team_preferences_raw, oasis_preferences_raw, existing_rows=None, team_shortfall=None,
+                      person_shortfall=None, oasis_solver="heap"):
+    """
+    Store everything needed to re-execute a run's solve step: the inputs exactly as
+    loaded, the seed of the committed plan and a digest of its rows.
+
+    Returns:
+        str: path of the written JSON snapshot
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    created_at = datetime.now(OFFICE_TIMEZONE)
+    snapshot = {
+        "week": base_monday_date.isoformat(),
+        "only": only,
+        "solver": solver,
+        "oasis_solver": oasis_solver,
+        "seed": plan.seed,
+        "created_at": created_at.isoformat(),
+        "rooms": all_rooms_config,
+        "team_preferences": [list(row) for row in team_preferences_raw],
+        "oasis_preferences": [list(row) for row in oasis_preferences_raw],
+        "existing_rows": [[team_name, room_name, date_obj.isoformat()] for team_name, room_name, date_obj in existing_rows]
+                         if existing_rows is not None else None,
+        "team_shortfall": team_shortfall,
+        "person_shortfall": person_shortfall,
+        "improve_steps": plan.improvement["steps"] if plan.improvement else None,
+        "row_count": len(plan.rows),
+        "plan_digest": plan_digest(plan),
+    }
+    snapshot_path = os.path.join(
+        snapshot_dir, f"allocation_{base_monday_date.isoformat()}_{only or 'all'}_{created_at.strftime('%Y%m%dT%H%M%S')}_seed{plan.seed}.json"
+    )
+    with open(snapshot_path, "w") as f:
+        json.dump(snapshot, f, indent=2)
+    return snapshot_path
+
+def replay_run_snapshot(snapshot_path, solver=None):
+    """
+    Re-run the solve step of a stored snapshot with its recorded seed. No database is used.
+
+    Args:
+        snapshot_path: JSON file written by save_run_snapshot
+        solver: Optional solver override, to compare solver changes on identical inputs
+
+    Returns:
+        tuple: (plan: AllocationPlan, matches_recorded_plan: bool)
+    """
+    with open(snapshot_path, "r") as f:
+        snapshot = json.load(f)
+    base_monday_date = datetime.strptime(snapshot["week"], "%Y-%m-%d").date()
+    existing_rows = snapshot.get("existing_rows")
+    if existing_rows is not None:
+        existing_rows = [(team_name, room_name, datetime.strptime(date_str, "%Y-%m-%d").date())
+                         for team_name, room_name, date_str in existing_rows]
+    plan = build_allocation_plan(
+        snapshot["rooms"],
+        [tuple(row) for row in snapshot["team_preferences"]],
+        [tuple(row) for row in snapshot["oasis_preferences"]],
+        get_day_mapping(base_monday_date),
+        only=snapshot["only"],
+        solver=solver or snapshot["solver"],
+        existing_rows=existing_rows,
+        seed=snapshot["seed"],
+        team_shortfall=snapshot.get("team_shortfall"),
+        person_shortfall=snapshot.get("person_shortfall"),
+        improve_steps=snapshot.get("improve_steps"),
+        oasis_solver=snapshot.get("oasis_solver", "heap"),
+        verbose=False,
+    )
+    return plan, plan_digest(plan) == snapshot["plan_digest"]
+
+def write_history_rollup(cur, base_monday_date, rollup_rows, only=None, site=None):
+    """
+    Replace the week's allocation_history_rollup rows for the run's scope.
+
+    Called inside the allocation transaction, so the rollup records what the
+    committed run allocated. Later edits made in the app (ad-hoc adds, the Oasis
+    matrix, the admin editors) are not reflected until the week is allocated again.
+    Without the table (migrate_allocation_schema.sql not applied) the write is
+    skipped and the allocation still commits.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start_time = time.perf_counter()
+    owner_kinds = {"project": ("team",), "oasis": ("oasis",)}.get(only, ("team", "oasis"))
+    statements = [b"SAVEPOINT history_rollup", cur.mogrify(
+        "DELETE FROM allocation_history_rollup WHERE week = %s AND owner_kind IN %s AND site IS NOT DISTINCT FROM %s",
+        (base_monday_date, owner_kinds, site),
+    )]
+    if rollup_rows:
+        values = b",".join(cur.mogrify("(%s, %s, %s, %s, %s, %s)", (base_monday_date, site, *row)) for row in rollup_rows)
+        statements.append(
+            b"INSERT INTO allocation_history_rollup (week, site, owner_kind, owner_name, requested_days, allocated_days) "
+            b"VALUES " + values
+        )
+    statements.append(b"RELEASE SAVEPOINT history_rollup")
+    try:
+        cur.execute(b";\n".join(statements))
+    except psycopg2.errors.UndefinedTable:
+        cur.execute("ROLLBACK TO SAVEPOINT history_rollup")
+        print("allocation_history_rollup does not exist; not recording fairness history for this run")
+    return time.perf_counter() - start_time
+
+def load_history_shortfall(cur, base_monday_date, weeks, only=None, site=None):
+    """
+    Days each team and Oasis person missed over the `weeks` weeks before this one.
+
+    Reads the pre-aggregated allocation_history_rollup, never weekly_allocations.
+    Without the table (migrate_allocation_schema.sql not applied) nobody has missed
+    any days, and the allocation transaction carries on.
+
+    Returns:
+        tuple: (team_name -> missed days, person_name -> missed days), only owners who missed any
+    """
+    owner_kinds = {"project": ("team",), "oasis": ("oasis",)}.get(only, ("team", "oasis"))
+    cur.execute("SAVEPOINT history_shortfall")
+    try:
+        cur.execute(
+            "SELECT owner_kind, owner_name, SUM(GREATEST(requested_days - allocated_days, 0)) "
+            "FROM allocation_history_rollup WHERE week >= %s AND week < %s AND owner_kind IN %s "
+            "AND site IS NOT DISTINCT FROM %s GROUP BY owner_kind, owner_name "
+            "HAVING SUM(GREATEST(requested_days - allocated_days, 0)) > 0",
+            (base_monday_date - timedelta(weeks=weeks), base_monday_date, owner_kinds, site),
+        )
+    except psycopg2.errors.UndefinedTable:
+        cur.execute("ROLLBACK TO SAVEPOINT history_shortfall")
+        print("allocation_history_rollup does not exist; allocating without fairness history")
+        return {}, {}
+    rows = cur.fetchall()
+    cur.execute("RELEASE SAVEPOINT history_shortfall")
+    shortfall = {"team": {}, "oasis": {}}
+    for owner_kind, owner_name, missed_days in rows:
+        shortfall[owner_kind][owner_name] = int(missed_days)
+    return shortfall["team"], shortfall["oasis"]
+
+def allocation_lock_keys(base_monday_date, only=None, site=None):
+    """
+    Advisory locks (class, key, shared) guarding the rows a run owns.
+
+    Project and Oasis rows of a week have separate locks, so the two phases of a
+    concurrent run do not block each other; a full run takes both. A run without
+    a site touches every site's rows and takes the week key exclusively. A site
+    run takes the week key shared, so sites run side by side but never next to a
+    whole-database run, plus an exclusive key folding in the site name, so two
+    runs of the same site exclude each other (a CRC collision only costs a wait).
+    """
+    week_key = base_monday_date.toordinal()
+    scopes = [only] if only else list(ALLOCATION_SCOPES)
+    lock_classes = [ALLOCATION_LOCK_CLASS + ALLOCATION_SCOPES.index(scope) for scope in scopes]
+    if site is None:
+        return [(lock_class, week_key, False) for lock_class in lock_classes]
+    site_key = zlib.crc32(f"{site}:{week_key}".encode()) - (1 << 31)
+    return ([(lock_class, week_key, True) for lock_class in lock_classes]
+            + [(lock_class, site_key, False) for lock_class in lock_classes])
+
+def release_allocation_locks(cur, lock_keys):
+    for lock_class, key, shared in lock_keys:
+        cur.execute("SELECT pg_advisory_unlock_shared(%s, %s)" if shared else "SELECT pg_advisory_unlock(%s, %s)",
+                    (lock_class, key))
+
+def acquire_allocation_locks(cur, base_monday_date, only=None, timeout=0, site=None):
+    """
+    Take the week's session-level advisory locks, polling until timeout seconds have passed.
+
+    Returns:
+        bool: True when every lock is held, False on timeout (nothing is held then)
+    """
+    lock_keys = allocation_lock_keys(base_monday_date, only, site)
+    deadline = time.monotonic() + timeout
+    while True:
+        held = []
+        for lock_class, key, shared in lock_keys:
+            cur.execute("SELECT pg_try_advisory_lock_shared(%s, %s)" if shared else "SELECT pg_try_advisory_lock(%s, %s)",
+                        (lock_class, key))
+            if not cur.fetchone()[0]:
+                break
+            held.append((lock_class, key, shared))
+        else:
+            return True
+        release_allocation_locks(cur, held)
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(LOCK_POLL_INTERVAL)
+
+def overlapping_run_scopes(only=None):
+    """allocation_runs.scope values whose rows overlap a run with this `only`."""
+    return ("all", *ALLOCATION_SCOPES) if only is None else ("all", only)
+
+def find_running_run(cur, base_monday_date, only=None, site=None):
+    """Id of the newest in-progress allocation_runs row overlapping this run, or None."""
+    cur.execute(
+        "SELECT id FROM allocation_runs WHERE week = %s AND scope IN %s AND status = 'running' "
+        "AND site IS NOT DISTINCT FROM %s ORDER BY started_at DESC LIMIT 1",
+        (base_monday_date, overlapping_run_scopes(only), site),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def start_run_record(cur, base_monday_date, only, solver, site=None):
+    """
+    Register a run in allocation_runs. Must be called while holding the week's locks.
+
+    Overlapping rows still marked 'running' belong to runs that died without
+    finishing (their locks went away with their connection) and are marked
+    'abandoned'.
+
+    Returns:
+        int: the new allocation_runs id
+    """
+    cur.execute(
+        "UPDATE allocation_runs SET status = 'abandoned', finished_at = NOW() AT TIME ZONE 'UTC' "
+        "WHERE week = %s AND scope IN %s AND status = 'running' AND site IS NOT DISTINCT FROM %s",
+        (base_monday_date, overlapping_run_scopes(only), site),
+    )
+    cur.execute(
+        "INSERT INTO allocation_runs (week, scope, site, solver, status, started_at) "
+        "VALUES (%s, %s, %s, %s, 'running', NOW() AT TIME ZONE 'UTC') RETURNING id",
+        (base_monday_date, only or "all", site, solver),
+    )
+    return cur.fetchone()[0]
+
+def finish_run_record(cur, run_id, status, stats, messages):
+    """Store a run's final status, seed, timings, row counts and messages."""
+    cur.execute(
+        "UPDATE allocation_runs SET status = %s, finished_at = NOW() AT TIME ZONE 'UTC', seed = %s, "
+        "timings = %s::jsonb, rows_written = %s, rows_deleted = %s, rows_unchanged = %s, messages = %s::jsonb "
+        "WHERE id = %s",
+        (
+            status,
+            stats.get("seed"),
+            json.dumps({phase: round(seconds, 6) for phase, seconds in stats.get("timings", {}).items()}),
+            stats.get("rows_written", 0),
+            stats.get("rows_deleted", 0),
+            stats.get("rows_unchanged", 0),
+            json.dumps(messages),
+            run_id,
+        ),
+    )
+
+def load_run_result(cur, run_id):
+    """
+    Read a finished run's outcome from allocation_runs.
+
+    Returns:
+        tuple: (status: str, messages: list)
+    """
+    cur.execute("SELECT status, messages FROM allocation_runs WHERE id = %s", (run_id,))
+    status, messages = cur.fetchone()
+    return status, messages or []
+
+def record_failed_run(conn, cur, run_id, stats, messages):
+    """Mark a run failed after its allocation transaction was rolled back."""
+    if run_id is None:
+        return
+    try:
+        finish_run_record(cur, run_id, "failed", stats, messages)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Could not record failed allocation run {run_id}: {e}")
+        conn.rollback()
+
+def allocate_week(cur, base_monday_date, day_mapping, only, solver, seed, incremental, candidates, time_budget,
+                  snapshot_dir, stats, site=None, fairness_weeks=0, improve_budget=None, oasis_solver="heap"):
+    """
+    Load, plan and write one week's allocation inside the caller's transaction.
+
+    Returns:
+        tuple: (success: bool, messages: list)
+    """
+    timings = stats["timings"]
+    with timed_phase(timings, "load"):
+        if only == "oasis":
+            clause, params = site_clause(site, "WHERE")
+            cur.execute("SELECT COUNT(*) FROM oasis_preferences" + clause, params)
+            if cur.fetchone()[0] == 0:
+                print("No oasis preferences submitted. Skipping Oasis allocation.")
+                return True, ["No oasis preferences to allocate, so no changes made."]
+
+        try:
+            all_rooms_config = site_rooms_config(load_rooms_config(), site)
+        except FileNotFoundError:
+            return False, [f"CRITICAL ERROR: rooms.json not found at {ROOMS_FILE_PATH}"]
+        except json.JSONDecodeError:
+            return False, [f"CRITICAL ERROR: rooms.json at {ROOMS_FILE_PATH} is not valid JSON."]
+        except ValueError as e:
+            return False, [f"CRITICAL ERROR: {e}"]
+
+        team_preferences_raw, oasis_preferences_raw = load_allocation_inputs(cur, only, site)
+        print(f"Found {len(team_preferences_raw)} team preferences and {len(oasis_preferences_raw)} Oasis preferences")
+
+        # Only rows owned by this run's scope (project rooms, Oasis or both) are compared and rewritten
+        existing_week_rows = load_existing_week(cur, base_monday_date, only, site)
+        kept_rows = None
+        if incremental:
+            team_submitted_at, person_submitted_at = load_submission_times(cur, only, site)
+            kept_rows, baseline_rows = split_existing_rows(existing_week_rows, team_submitted_at, person_submitted_at)
+            print(f"Incremental run: keeping {len(kept_rows)} existing rows, re-placing {len(baseline_rows)} stale rows for week of {base_monday_date}")
+        else:
+            baseline_rows = [(*row[:3], row[4]) for row in existing_week_rows]
+        if site is not None:
+            unsited_rows = load_unsited_rows(cur, [base_monday_date], only)[base_monday_date]
+            if unsited_rows:
+                print(f"Site {site}: keeping {len(unsited_rows)} rows without a site as occupied")
+                kept_rows = (kept_rows or []) + unsited_rows
+
+        team_shortfall = person_shortfall = None
+        if fairness_weeks:
+            team_shortfall, person_shortfall = load_history_shortfall(cur, base_monday_date, fairness_weeks, only, site)
+            print(f"Fairness weighting over {fairness_weeks} weeks: {len(team_shortfall)} teams and "
+                  f"{len(person_shortfall)} Oasis people missed days")
+
+    fairness = dict(team_shortfall=team_shortfall, person_shortfall=person_shortfall)
+    if candidates > 1:
+        plan = build_best_of_n_plan(all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mapping,
+                                    candidates=candidates, time_budget=time_budget, base_seed=seed,
+                                    only=only, solver=solver, existing_rows=kept_rows,
+                                    improve_budget=improve_budget, oasis_solver=oasis_solver, **fairness)
+        stats["candidates_evaluated"] = plan.candidates_evaluated
+    else:
+        plan = build_allocation_plan(all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mapping,
+                                     only=only, solver=solver, existing_rows=kept_rows, seed=seed,
+                                     improve_budget=improve_budget, oasis_solver=oasis_solver, **fairness)
+    stats["seed"] = plan.seed
+    print(f"Allocation seed: {plan.seed}")
+    if plan.improvement:
+        stats["improvement"] = plan.improvement
+        print(f"Local search: {plan.improvement['placed_gain']:+d} teams placed, "
+              f"{plan.improvement['honoured_gain']:+d} preferences honoured in {plan.improvement['elapsed_ms']:.1f} ms "
+              f"({plan.improvement['steps']} steps, {plan.improvement['improvement_per_ms']:.4f} improvements/ms, "
+              f"stopped by {plan.improvement['stopped_by']})")
+    if snapshot_dir:
+        stats["snapshot_path"] = save_run_snapshot(
+            snapshot_dir, base_monday_date, only, solver, plan, all_rooms_config,
+            team_preferences_raw, oasis_preferences_raw, kept_rows, oasis_solver=oasis_solver, **fairness,
+        )
+        print(f"Run snapshot written to {stats['snapshot_path']}")
+    timings.update(plan.timings)
+
+    unplaced_project_team_messages = plan.unplaced_messages()
+    if only in [None, "project"]:
+        if unplaced_project_team_messages:
+            print(f"--- Project Allocation: {len(unplaced_project_team_messages)} teams could not be placed. ---")
+            for msg in unplaced_project_team_messages:
+                print(f"  {msg}")
+        else:
+            print("--- Project Allocation: All project teams were successfully placed. ---")
+
+    stats["unplaced_teams"] = [team_name for team_name, _, _ in plan.unplaced_teams]
+
+    diff = diff_allocation_rows(baseline_rows, plan.rows)
+    timings["write"] = apply_allocation_diff(cur, diff, site)
+    stats["rows_written"] = len(diff.to_insert) + len(diff.to_update)
+    stats["rows_deleted"] = len(diff.to_delete)
+    stats["rows_unchanged"] = diff.unchanged
+    print(f"Applied allocation diff in {timings['write'] * 1000:.1f} ms: {len(diff.to_insert)} inserted, "
+          f"{len(diff.to_update)} updated, {len(diff.to_delete)} deleted, {diff.unchanged} unchanged")
+
+    rollup_rows = history_rollup_rows(team_preferences_raw, oasis_preferences_raw, (kept_rows or []) + plan.rows,
+                                      day_mapping, only)
+    timings["rollup"] = write_history_rollup(cur, base_monday_date, rollup_rows, only, site)
+    return True, unplaced_project_team_messages
+
+def run_allocation(database_url, only=None, base_monday_date=None, solver="greedy",
+                   seed=None, dry_run=False, incremental=False, candidates=1, time_budget=None,
+                   snapshot_dir=None, stats=None, on_conflict="wait", lock_timeout=DEFAULT_LOCK_TIMEOUT, site=None,
+                   fairness_weeks=0, improve_budget=None, oasis_solver="heap"):
     """
     Run room allocation for a specific week.
-    
+
+    Each run holds the week's advisory locks while it works and is recorded in
+    allocation_runs, so the scheduled workflow and an admin click cannot
+    rewrite the same week at the same time.
+
     Args:
         database_url: Database connection string
         only: "project" or "oasis" to run only that allocation, None for both
         base_monday_date: REQUIRED - Static Monday date to use (date object). No automatic date calculation.
-    
+        solver: "greedy" (default) or "optimal" (min-cost flow) for the project-room pass
+        seed: Optional seed for the allocation lottery. A fresh seed is drawn and recorded when None.
+        dry_run: Compute and write the plan, then roll back instead of committing
+        incremental: Keep this week's existing rows and only place new or changed preferences
+        candidates: Build this many independently seeded plans in parallel and commit the best one
+        time_budget: Optional wall-clock limit in seconds for the candidate search
+        snapshot_dir: Optional directory to store this run's inputs, seed and plan digest for replay
+        stats: Optional dict, filled with per-phase "timings" (seconds), the "seed", the
+            "rows_written" / "rows_deleted" / "rows_unchanged" counts of the applied diff and the "run_id"
+        on_conflict: When another run holds the week: "wait" for it and then run,
+            or "join" to wait for it and return its result instead of running again
+        lock_timeout: Seconds to wait for another run of the same week before giving up
+        site: Office site to allocate (a key of "sites" in rooms.json). None allocates
+            the whole database against a single-site rooms.json.
+        fairness_weeks: Weight the lotteries by the days each team and person missed over
+            this many previous weeks (from allocation_history_rollup); 0 disables it
+        improve_budget: Optional seconds of local search after the project solver, trying
+            to place leftover teams and honour more preferences; its report lands in stats["improvement"]
+        oasis_solver: "heap" (default) or "vectorised" (NumPy lottery rounds) for the Oasis pass
+
     Returns:
         tuple: (success: bool, messages: list)
     """
+    if stats is None:
+        stats = {}
+    timings = stats.setdefault("timings", {})
+    stats["seed"] = seed
+    stats["rows_written"] = 0
+    stats["rows_deleted"] = 0
+    stats["rows_unchanged"] = 0
+
     if base_monday_date is None:
         error_msg = "CRITICAL ERROR: base_monday_date is required. No automatic date calculation allowed to prevent unexpected week resets."
         print(error_msg)
         return False, [error_msg]
-    
+    if on_conflict not in ("wait", "join"):
+        raise ValueError(f"Unknown on_conflict '{on_conflict}'. Expected 'wait' or 'join'.")
+
     try:
         day_mapping = get_day_mapping(base_monday_date)
-        print(f"Running allocation for week of {base_monday_date.strftime('%Y-%m-%d')} (Monday)")
+        print(f"Running allocation for week of {base_monday_date.strftime('%Y-%m-%d')} (Monday)"
+              + (f" at site {site}" if site is not None else ""))
         print(f"Day mapping: {day_mapping}")
     except ValueError as e:
         error_msg = f"Date validation error: {e}"
         print(error_msg)
         return False, [error_msg]
+
     
     conn = None
     cur = None
-    unplaced_project_team_messages = []
+    locked = False
+    run_id = None
 
     try:
-        conn = psycopg2.connect(database_url)
-        cur = conn.cursor()
-
-        if only == "project":
-            # Only delete project allocations for the specific week
-            cur.execute("DELETE FROM weekly_allocations WHERE room_name != 'Oasis' AND date >= %s AND date <= %s", 
-                       (base_monday_date, base_monday_date + timedelta(days=6)))
-            print(f"Cleared project room allocations for week of {base_monday_date}")
-        elif only == "oasis":
-            cur.execute("SELECT COUNT(*) FROM oasis_preferences")
-            if cur.fetchone()[0] == 0:
-                print("No oasis preferences submitted. Skipping Oasis allocation.")
-                return True, ["No oasis preferences to allocate, so no changes made."]
-            # Only delete Oasis allocations for the specific week
-            cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND date >= %s AND date <= %s", 
-                       (base_monday_date, base_monday_date + timedelta(days=6)))
-            print(f"Cleared Oasis allocations for week of {base_monday_date}")
-        else:
-            # Delete all allocations for the specific week only
-            cur.execute("DELETE FROM weekly_allocations WHERE date >= %s AND date <= %s", 
-                       (base_monday_date, base_monday_date + timedelta(days=6)))
-            print(f"Cleared all allocations for week of {base_monday_date}")
-
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        rooms_file_path = os.path.join(base_dir, "rooms.json")
-        try:
-            with open(rooms_file_path, "r") as f:
-                all_rooms_config = json.load(f)
-        except FileNotFoundError:
-            return False, [f"CRITICAL ERROR: rooms.json not found at {rooms_file_path}"]
-        except json.JSONDecodeError:
-            return False, [f"CRITICAL ERROR: rooms.json at {rooms_file_path} is not valid JSON."]
-
-        project_rooms = [r for r in all_rooms_config if r.get("name") != "Oasis" and "capacity" in r and "name" in r]
-        oasis_config = next((r for r in all_rooms_config if r.get("name") == "Oasis" and "capacity" in r), None)
-
-        if not project_rooms and only in [None, "project"]:
-            print("Warning: No project rooms defined in rooms.json or they are malformed.")
-        if not oasis_config and only in [None, "oasis"]:
-            print("Warning: Oasis room configuration not found or malformed in rooms.json. Using default if needed.")
-            oasis_config = {"name": "Oasis", "capacity": 15}
-
-        if only in [None, "project"]:
-            print("Starting project room allocation...")
-            cur.execute("SELECT team_name, team_size, preferred_days FROM weekly_preferences")
-            team_preferences_raw = cur.fetchall()
-            print(f"Found {len(team_preferences_raw)} team preferences")
-
-            used_rooms_on_date = {date_obj: [] for date_obj in day_mapping.values()}
-            placed_teams_info = {}
-
-            teams_for_mon_wed = []
-            teams_for_tue_thu = []
-            teams_for_fallback_immediately = []
-
-            for team_name, team_size, preferred_days_str in team_preferences_raw:
-                pref_day_labels = [
-                    day.strip().capitalize() for day in preferred_days_str.split(',') if day.strip()
-                ]
-                team_data = (team_name, int(team_size), pref_day_labels)
-                print(f"Processing team {team_name}: raw='{preferred_days_str}' -> parsed={pref_day_labels}")
-
-                if pref_day_labels == ["Monday", "Wednesday"]:
-                    teams_for_mon_wed.append(team_data)
-                    print(f"  → Added to Monday/Wednesday group")
-                elif pref_day_labels == ["Tuesday", "Thursday"]:
-                    teams_for_tue_thu.append(team_data)
-                    print(f"  → Added to Tuesday/Thursday group")
-                else:
-                    teams_for_fallback_immediately.append(team_data)
-                    print(f"  → Added to immediate fallback group")
-
-            print(f"Teams preferring Mon/Wed: {len(teams_for_mon_wed)}")
-            print(f"Teams preferring Tue/Thu: {len(teams_for_tue_thu)}")
-            print(f"Teams with other preferences: {len(teams_for_fallback_immediately)}")
-
-            random.shuffle(teams_for_mon_wed)
-            random.shuffle(teams_for_tue_thu)
-            random.shuffle(teams_for_fallback_immediately)
-
-            def attempt_placement_for_pair(teams_list_for_pair, day1_label, day2_label):
-                nonlocal used_rooms_on_date, placed_teams_info
-                actual_date1 = day_mapping[day1_label]
-                actual_date2 = day_mapping[day2_label]
-                sorted_teams_for_pair = sorted(teams_list_for_pair, key=lambda x: x[1], reverse=True)
-                still_unplaced_from_this_pair = []
-
-                print(f"Attempting placement for {day1_label}/{day2_label} - {len(sorted_teams_for_pair)} teams")
-                print(f"  Teams to place: {[t[0] for t in sorted_teams_for_pair]}")
-                print(f"  Rooms already used on {day1_label}: {used_rooms_on_date[actual_date1]}")
-                print(f"  Rooms already used on {day2_label}: {used_rooms_on_date[actual_date2]}")
-
-                for team_name, team_size, original_pref_labels in sorted_teams_for_pair:
-                    if team_name in placed_teams_info:
-                        continue
-                    
-                    print(f"  Trying to place {team_name} (size {team_size}) in {day1_label}/{day2_label}")
-                    
-                    possible_rooms_for_team = [
-                        room_config for room_config in project_rooms
-                        if room_config["name"] not in used_rooms_on_date[actual_date1]
-                        and room_config["name"] not in used_rooms_on_date[actual_date2]
-                        and room_config["capacity"] >= team_size
-                    ]
-                    
-                    print(f"    Available rooms: {[r['name'] for r in possible_rooms_for_team]} (capacity >= {team_size})")
-                    
-                    if not possible_rooms_for_team:
-                        still_unplaced_from_this_pair.append((team_name, team_size, original_pref_labels))
-                        print(f"    ❌ No available rooms for {team_name}")
-                        continue
-                    min_suitable_capacity = min(r['capacity'] for r in possible_rooms_for_team)
-                    best_fit_candidate_rooms = [r for r in possible_rooms_for_team if r['capacity'] == min_suitable_capacity]
-                    random.shuffle(best_fit_candidate_rooms)
-                    chosen_room_config = best_fit_candidate_rooms[0]
-                    
-                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                (team_name, chosen_room_config["name"], actual_date1))
-                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                (team_name, chosen_room_config["name"], actual_date2))
-                    used_rooms_on_date[actual_date1].append(chosen_room_config["name"])
-                    used_rooms_on_date[actual_date2].append(chosen_room_config["name"])
-                    placed_teams_info[team_name] = [actual_date1, actual_date2]
-                    print(f"    ✅ Placed team {team_name} in {chosen_room_config['name']} for {day1_label}/{day2_label}")
-
-                return still_unplaced_from_this_pair
-
-            unplaced_after_mon_wed_pass = attempt_placement_for_pair(teams_for_mon_wed, "Monday", "Wednesday")
-            print(f"Unplaced after Mon/Wed pass: {[t[0] for t in unplaced_after_mon_wed_pass]}")
-            
-            unplaced_after_tue_thu_pass = attempt_placement_for_pair(teams_for_tue_thu, "Tuesday", "Thursday")
-            print(f"Unplaced after Tue/Thu pass: {[t[0] for t in unplaced_after_tue_thu_pass]}")
-            
-            # Log detailed results before fallback
-            print(f"After preferred placement phase:")
-            print(f"  - Monday/Wednesday teams placed: {len(teams_for_mon_wed) - len(unplaced_after_mon_wed_pass)}")
-            print(f"  - Tuesday/Thursday teams placed: {len(teams_for_tue_thu) - len(unplaced_after_tue_thu_pass)}")
-            print(f"  - Teams needing fallback: {len(unplaced_after_mon_wed_pass) + len(unplaced_after_tue_thu_pass) + len(teams_for_fallback_immediately)}")
-            
-            master_fallback_pool = unplaced_after_mon_wed_pass + unplaced_after_tue_thu_pass + teams_for_fallback_immediately
-            random.shuffle(master_fallback_pool)
-
-            print(f"Fallback allocation needed for {len(master_fallback_pool)} teams")
-            
-            final_unplaced_project_teams = []
-            sorted_fallback_teams = sorted(master_fallback_pool, key=lambda x: x[1], reverse=True)
-            
-            # Define the only valid day pairs for project teams
-            valid_day_pairs = [("Monday", "Wednesday"), ("Tuesday", "Thursday")]
-
-            for team_name, team_size, original_pref_labels in sorted_fallback_teams:
-                if team_name in placed_teams_info:
-                    continue
-                
-                placed_in_fallback = False
-                
-                print(f"Trying to place team {team_name} (preferred: {original_pref_labels}) in fallback...")
-                
-                # Determine fallback preference order based on original preference
-                # Keep original preference as first choice, then try the alternative
-                if original_pref_labels == ["Monday", "Wednesday"]:
-                    # If they preferred Mon/Wed, try Mon/Wed first, then Tue/Thu as fallback
-                    fallback_day_pairs = [("Monday", "Wednesday"), ("Tuesday", "Thursday")]
-                elif original_pref_labels == ["Tuesday", "Thursday"]:
-                    # If they preferred Tue/Thu, try Tue/Thu first, then Mon/Wed as fallback
-                    fallback_day_pairs = [("Tuesday", "Thursday"), ("Monday", "Wednesday")]
-                else:
-                    # For other preferences, try both valid pairs randomly
-                    fallback_day_pairs = valid_day_pairs.copy()
-                    random.shuffle(fallback_day_pairs)
-
-                for fb_day1_label, fb_day2_label in fallback_day_pairs:
-                    fb_actual_date1 = day_mapping[fb_day1_label]
-                    fb_actual_date2 = day_mapping[fb_day2_label]
-                    
-                    possible_rooms_for_fallback = [
-                        room_config for room_config in project_rooms
-                        if room_config["name"] not in used_rooms_on_date[fb_actual_date1]
-                        and room_config["name"] not in used_rooms_on_date[fb_actual_date2]
-                        and room_config["capacity"] >= team_size
-                    ]
-                    
-                    print(f"  Checking {fb_day1_label}/{fb_day2_label}: {len(possible_rooms_for_fallback)} available rooms (team size: {team_size})")
-                    
-                    if not possible_rooms_for_fallback:
-                        continue
-                    min_suitable_capacity_fb = min(r['capacity'] for r in possible_rooms_for_fallback)
-                    best_fit_candidate_rooms_fb = [r for r in possible_rooms_for_fallback if r['capacity'] == min_suitable_capacity_fb]
-                    random.shuffle(best_fit_candidate_rooms_fb)
-                    chosen_room_fb_config = best_fit_candidate_rooms_fb[0]
-                    
-                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                (team_name, chosen_room_fb_config["name"], fb_actual_date1))
-                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                (team_name, chosen_room_fb_config["name"], fb_actual_date2))
-                    used_rooms_on_date[fb_actual_date1].append(chosen_room_fb_config["name"])
-                    used_rooms_on_date[fb_actual_date2].append(chosen_room_fb_config["name"])
-                    
-                    placed_teams_info[team_name] = [fb_actual_date1, fb_actual_date2]
-                    placed_in_fallback = True
-                    
-                    # Enhanced logging to show if preference was honored or not
-                    preference_honored = (fb_day1_label, fb_day2_label) == (original_pref_labels[0], original_pref_labels[1]) if len(original_pref_labels) == 2 else False
-                    honor_status = "✓ PREFERENCE HONORED" if preference_honored else f"⚠ Fallback used (wanted {original_pref_labels})"
-                    print(f"  → Placed team {team_name} in {chosen_room_fb_config['name']} for {fb_day1_label}/{fb_day2_label} - {honor_status}")
-                    break
-
-                if not placed_in_fallback:
-                    final_unplaced_project_teams.append((team_name, team_size, original_pref_labels))
-
-            if final_unplaced_project_teams:
-                summary_message = f"--- Project Allocation: {len(final_unplaced_project_teams)} teams could not be placed. ---"
-                print(summary_message)
-                for team_name_unplaced, team_size_unplaced, original_pref_labels_unplaced in final_unplaced_project_teams:
-                    msg = f"Unplaced Project Team: {team_name_unplaced} (Size: {team_size_unplaced}, Preferred Days: {original_pref_labels_unplaced})"
-                    print(f"  {msg}")
-                    unplaced_project_team_messages.append(msg)
-            else:
-                print("--- Project Allocation: All project teams were successfully placed. ---")
+        with timed_phase(timings, "connect"):
+            conn = psycopg2.connect(database_url)
+            cur = conn.cursor()
 
-        if only in [None, "oasis"]:
-            print("Starting Oasis allocation...")
-            if not oasis_config:
-                print("Error: Oasis configuration missing or malformed, cannot perform Oasis allocation.")
-            else:
-                cur.execute("SELECT person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5 FROM oasis_preferences")
-                person_rows = cur.fetchall()
-                print(f"Found {len(person_rows)} Oasis preferences")
-                
-                if not person_rows:
-                    print("No Oasis preferences found for allocation.")
-                else:
-                    oasis_allocations_on_actual_date = {date_obj: set() for date_obj in day_mapping.values()}
-                    person_assigned_days = {row[0]: 0 for row in person_rows}
-                    person_preferences = {}
-                    day_to_people = {day: [] for day in day_mapping}
-
-                    # Parse preferences
-                    for person_name, d1, d2, d3, d4, d5 in person_rows:
-                        prefs = [
-                            day.strip().capitalize() for day in [d1, d2, d3, d4, d5]
-                            if day and day.strip().capitalize() in day_mapping
-                        ]
-                        person_preferences[person_name] = prefs
-                        for day in prefs:
-                            day_to_people[day].append(person_name)
-                        print(f"Person {person_name} prefers: {prefs}")
-
-                    # First pass: Give everyone at least one day (priority to those with 0 assignments)
-                    for day_label, date_obj in day_mapping.items():
-                        candidates = [p for p in day_to_people[day_label] if person_assigned_days[p] == 0]
-                        random.shuffle(candidates)
-                        for person_name in candidates:
-                            if len(oasis_allocations_on_actual_date[date_obj]) < oasis_config["capacity"]:
-                                cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                            (person_name, oasis_config["name"], date_obj))
-                                oasis_allocations_on_actual_date[date_obj].add(person_name)
-                                person_assigned_days[person_name] += 1
-                                print(f"First pass: Assigned {person_name} to {day_label} ({date_obj})")
-
-                    # Additional passes: Fill remaining spots
-                    still_assignable = True
-                    pass_number = 2
-                    while still_assignable:
-                        still_assignable = False
-                        all_people = list(person_preferences.keys())
-                        random.shuffle(all_people)
-
-                        print(f"Oasis allocation pass {pass_number}")
-                        for person_name in all_people:
-                            if person_assigned_days[person_name] >= len(person_preferences[person_name]):
-                                continue  # Person has been assigned to all their preferred days
-                            
-                            for day_label in person_preferences[person_name]:
-                                date_obj = day_mapping[day_label]
-                                if person_name in oasis_allocations_on_actual_date[date_obj]:
-                                    continue  # Person already assigned to this day
-                                
-                                if len(oasis_allocations_on_actual_date[date_obj]) < oasis_config["capacity"]:
-                                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)",
-                                                (person_name, oasis_config["name"], date_obj))
-                                    oasis_allocations_on_actual_date[date_obj].add(person_name)
-                                    person_assigned_days[person_name] += 1
-                                    still_assignable = True
-                                    print(f"Pass {pass_number}: Assigned {person_name} to {day_label} ({date_obj})")
-                                    break
-                        pass_number += 1
-
-                    # Print final Oasis summary
-                    print("Final Oasis allocation summary:")
-                    for day_label, date_obj in day_mapping.items():
-                        assigned_count = len(oasis_allocations_on_actual_date[date_obj])
-                        available_spots = oasis_config["capacity"] - assigned_count
-                        print(f"  {day_label} ({date_obj}): {assigned_count}/{oasis_config['capacity']} assigned, {available_spots} spots available")
+        with timed_phase(timings, "lock"):
+            locked = acquire_allocation_locks(cur, base_monday_date, only, site=site)
+            running_run_id = None
+            if not locked:
+                running_run_id = find_running_run(cur, base_monday_date, only, site)
+                print(f"Another allocation for week of {base_monday_date} is in progress (run {running_run_id}). "
+                      f"Waiting up to {lock_timeout}s.")
+                conn.rollback()
+                locked = acquire_allocation_locks(cur, base_monday_date, only, timeout=lock_timeout, site=site)
+        if not locked:
+            error_msg = f"Timed out after {lock_timeout}s waiting for the running allocation of week {base_monday_date}."
+            print(error_msg)
+            return False, [error_msg]
+        if on_conflict == "join" and running_run_id is not None:
+            status, messages = load_run_result(cur, running_run_id)
+            conn.commit()
+            stats["joined_run_id"] = running_run_id
+            print(f"Joined allocation run {running_run_id}, which finished with status '{status}'.")
+            return status == "succeeded", messages
 
+        run_id = start_run_record(cur, base_monday_date, only, solver, site)
         conn.commit()
-        print(f"Allocation completed successfully for week of {base_monday_date}")
-        return True, unplaced_project_team_messages
+        stats["run_id"] = run_id
+
+        success, messages = allocate_week(cur, base_monday_date, day_mapping, only, solver, seed, incremental,
+                                          candidates, time_budget, snapshot_dir, stats, site, fairness_weeks,
+                                          improve_budget, oasis_solver)
+
+        with timed_phase(timings, "commit"):
+            if success and not dry_run:
+                # The run record flips to succeeded in the same transaction as the allocation rows
+                finish_run_record(cur, run_id, "succeeded", stats, messages)
+                conn.commit()
+                print(f"Allocation completed successfully for week of {base_monday_date}")
+            else:
+                conn.rollback()
+                finish_run_record(cur, run_id, "dry_run" if success else "failed", stats, messages)
+                conn.commit()
+                if success:
+                    print(f"Dry run: rolled back allocation for week of {base_monday_date}")
+        return success, messages
 
     except psycopg2.Error as db_err:
         error_msg = f"Database error during allocation: {db_err}"
         print(error_msg)
         if conn:
             conn.rollback()
+            record_failed_run(conn, cur, run_id, stats, [error_msg])
         return False, [error_msg]
     except Exception as e:
         error_msg = f"General error during allocation: {type(e).__name__} - {e}"
@@ -373,9 +703,496 @@ def run_allocation(database_url, only=None, base_monday_date=None):
         traceback.print_exc()
         if conn:
             conn.rollback()
+            record_failed_run(conn, cur, run_id, stats, [error_msg])
         return False, [error_msg]
     finally:
+        if locked:
+            try:
+                release_allocation_locks(cur, allocation_lock_keys(base_monday_date, only, site))
+                conn.commit()
+            except psycopg2.Error as e:
+                # Session locks are released with the connection below anyway
+                print(f"Could not release allocation locks: {e}")
         if cur:
             cur.close()
         if conn:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+def check_week_consistency(cur, base_monday_date, oasis_capacity, site=None):
+    """
+    Check the committed week against the invariants both allocation phases rely on.
+
+    Returns:
+        list of problem descriptions, empty when the week is consistent
+    """
+    # Rows without a site (the app's writes) occupy rooms in every site run, so they count here too
+    clause, params = ("", ()) if site is None else (" AND (site = %s OR site IS NULL)", (site,))
+    week = (base_monday_date, base_monday_date + timedelta(days=6), *params)
+    problems = []
+    cur.execute(
+        "SELECT room_name, date, COUNT(*) FROM weekly_allocations "
+        "WHERE room_name != 'Oasis' AND date >= %s AND date <= %s" + clause + " GROUP BY room_name, date HAVING COUNT(*) > 1",
+        week,
+    )
+    problems += [f"{room_name} is booked {count} times on {date_val}" for room_name, date_val, count in cur.fetchall()]
+    cur.execute(
+        "SELECT team_name, date, COUNT(*) FROM weekly_allocations "
+        "WHERE room_name != 'Oasis' AND date >= %s AND date <= %s" + clause + " GROUP BY team_name, date HAVING COUNT(*) > 1",
+        week,
+    )
+    problems += [f"Team {team_name} holds {count} project rooms on {date_val}" for team_name, date_val, count in cur.fetchall()]
+    cur.execute(
+        "SELECT date, COUNT(*) FROM weekly_allocations "
+        "WHERE room_name = 'Oasis' AND date >= %s AND date <= %s" + clause + " GROUP BY date HAVING COUNT(*) > %s",
+        (*week, oasis_capacity),
+    )
+    problems += [f"Oasis has {count}/{oasis_capacity} people on {date_val}" for date_val, count in cur.fetchall()]
+    return problems
+
+def run_allocation_concurrently(database_url, base_monday_date=None, seed=None, dry_run=False, stats=None, **kwargs):
+    """
+    Run the project-room and Oasis allocations side by side.
+
+    The two phases own disjoint rows (room_name != 'Oasis' vs = 'Oasis'), so each
+    runs run_allocation on its own thread with its own connection and
+    transaction. Both phases share one seed so the run can still be replayed per
+    phase. After both have committed, a fresh connection checks the week for
+    double-booked rooms and Oasis overbooking.
+
+    Args:
+        database_url, base_monday_date, seed, dry_run: As for run_allocation
+        stats: Optional dict, filled with the combined row counts and "timings",
+            plus each phase's own stats under "phases"
+        **kwargs: Passed on to both run_allocation calls (solver, incremental, ...)
+
+    Returns:
+        tuple: (success: bool, messages: list)
+    """
+    if stats is None:
+        stats = {}
+    timings = stats.setdefault("timings", {})
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    stats["seed"] = seed
+    phase_stats = {"project": {}, "oasis": {}}
+    stats["phases"] = phase_stats
+
+    with timed_phase(timings, "phases"):
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="allocation") as executor:
+            futures = {
+                only: executor.submit(run_allocation, database_url, only=only, base_monday_date=base_monday_date,
+                                      seed=seed, dry_run=dry_run, stats=phase_stats[only], **kwargs)
+                for only in ("project", "oasis")
+            }
+            results = {only: future.result() for only, future in futures.items()}
+
+    messages = []
+    for only, (phase_success, phase_messages) in results.items():
+        if not phase_success:
+            messages.append(f"{only.capitalize()} allocation failed.")
+        messages.extend(phase_messages)
+        for phase, seconds in phase_stats[only].get("timings", {}).items():
+            timings[f"{only}.{phase}" if not phase.startswith(only) else phase] = seconds
+    for key in ("rows_written", "rows_deleted", "rows_unchanged"):
+        stats[key] = sum(phase_stats[only].get(key, 0) for only in phase_stats)
+    if "improvement" in phase_stats["project"]:
+        stats["improvement"] = phase_stats["project"]["improvement"]
+    success = all(phase_success for phase_success, _ in results.values())
+    if dry_run or base_monday_date is None:
+        return success, messages
+
+    conn = None
+    try:
+        with timed_phase(timings, "consistency_check"):
+            site = kwargs.get("site")
+            _, oasis_config = split_rooms_config(site_rooms_config(load_rooms_config(), site))
+            oasis_capacity = oasis_config["capacity"] if oasis_config else DEFAULT_OASIS_CAPACITY
+            conn = psycopg2.connect(database_url)
+            with conn.cursor() as cur:
+                problems = check_week_consistency(cur, base_monday_date, oasis_capacity, site)
+    except (psycopg2.Error, OSError, ValueError) as e:
+        problems = [f"Consistency check could not run: {e}"]
+    finally:
+        if conn:
+            conn.close()
+    for problem in problems:
+        print(f"CONSISTENCY ERROR: {problem}")
+    stats["consistency_problems"] = problems
+    return success and not problems, messages + [f"CONSISTENCY ERROR: {problem}" for problem in problems]
+
+def run_allocation_batch(database_url, mondays, only=None, solver="greedy", seed=None, dry_run=False,
+                         incremental=False, max_workers=None, stats=None, lock_timeout=DEFAULT_LOCK_TIMEOUT, site=None,
+                         improve_budget=None, oasis_solver="heap"):
+    """
+    Allocate several weeks with one read of the inputs and one write transaction.
+
+    rooms.json and the preference tables are read once; the weeks are solved
+    independently (on a process pool when there is more than one) and every
+    week's diff is applied in a single statement batch and commit. Each week
+    still holds its advisory locks and gets its own allocation_runs record.
+
+    Args:
+        database_url: Database connection string
+        mondays: Iterable of Monday dates to allocate
+        only, solver, dry_run, incremental, lock_timeout, site, improve_budget, oasis_solver: As for run_allocation
+        seed: Week i (in date order) is seeded with seed + i; a fresh base seed is drawn when None
+        max_workers: Process pool size for solving the weeks (1 solves in-process)
+        stats: Optional dict, filled with "timings", the combined row counts and
+            per-week "seeds" and "run_ids"
+
+    Returns:
+        tuple: (success: bool, messages: list)
+    """
+    if stats is None:
+        stats = {}
+    timings = stats.setdefault("timings", {})
+    stats["rows_written"] = 0
+    stats["rows_deleted"] = 0
+    stats["rows_unchanged"] = 0
+
+    mondays = sorted(set(mondays))
+    if not mondays:
+        return False, ["No weeks given for batch allocation."]
+    try:
+        day_mappings = {monday: get_day_mapping(monday) for monday in mondays}
+    except ValueError as e:
+        error_msg = f"Date validation error: {e}"
+        print(error_msg)
+        return False, [error_msg]
+    print(f"Running batch allocation for {len(mondays)} weeks: {', '.join(m.isoformat() for m in mondays)}")
+
+    conn = None
+    cur = None
+    held_weeks = []
+    run_ids = {}
+    messages = []
+
+    try:
+        with timed_phase(timings, "connect"):
+            conn = psycopg2.connect(database_url)
+            cur = conn.cursor()
+
+        # Locks are taken in date order so two overlapping batches cannot deadlock
+        with timed_phase(timings, "lock"):
+            for monday in mondays:
+                if not acquire_allocation_locks(cur, monday, only, timeout=lock_timeout, site=site):
+                    error_msg = f"Timed out after {lock_timeout}s waiting for the running allocation of week {monday}."
+                    print(error_msg)
+                    return False, [error_msg]
+                held_weeks.append(monday)
+            for monday in mondays:
+                run_ids[monday] = start_run_record(cur, monday, only, solver, site)
+            conn.commit()
+        stats["run_ids"] = {monday.isoformat(): run_id for monday, run_id in run_ids.items()}
+
+        with timed_phase(timings, "load"):
+            try:
+                all_rooms_config = site_rooms_config(load_rooms_config(), site)
+            except FileNotFoundError:
+                raise ValueError(f"rooms.json not found at {ROOMS_FILE_PATH}")
+            team_preferences_raw, oasis_preferences_raw = load_allocation_inputs(cur, only, site)
+            print(f"Found {len(team_preferences_raw)} team preferences and {len(oasis_preferences_raw)} Oasis preferences")
+            existing_by_week = load_existing_weeks(cur, mondays, only, site)
+            kept_by_week = {}
+            baseline_by_week = {}
+            if incremental:
+                team_submitted_at, person_submitted_at = load_submission_times(cur, only, site)
+                for monday, existing_week_rows in existing_by_week.items():
+                    kept_by_week[monday], baseline_by_week[monday] = split_existing_rows(
+                        existing_week_rows, team_submitted_at, person_submitted_at)
+            else:
+                baseline_by_week = {monday: [(*row[:3], row[4]) for row in rows] for monday, rows in existing_by_week.items()}
+            if site is not None:
+                for monday, unsited_rows in load_unsited_rows(cur, mondays, only).items():
+                    if unsited_rows:
+                        kept_by_week[monday] = kept_by_week.get(monday, []) + unsited_rows
+
+        if only == "oasis" and not oasis_preferences_raw:
+            print("No oasis preferences submitted. Skipping Oasis allocation.")
+            messages = ["No oasis preferences to allocate, so no changes made."]
+            plans = {}
+        else:
+            with timed_phase(timings, "solve"):
+                plans = build_multi_week_plans(all_rooms_config, team_preferences_raw, oasis_preferences_raw,
+                                               day_mappings, existing_rows_by_week=kept_by_week or None,
+                                               max_workers=max_workers, base_seed=seed, only=only, solver=solver,
+                                               improve_budget=improve_budget, oasis_solver=oasis_solver)
+        stats["seeds"] = {monday.isoformat(): plan.seed for monday, plan in plans.items()}
+
+        diff = AllocationDiff()
+        week_stats = {}
+        rollup_seconds = 0.0
+        for monday, plan in plans.items():
+            rollup_rows = history_rollup_rows(team_preferences_raw, oasis_preferences_raw,
+                                              kept_by_week.get(monday, []) + plan.rows, day_mappings[monday], only)
+            rollup_seconds += write_history_rollup(cur, monday, rollup_rows, only, site)
+            week_diff = diff_allocation_rows(baseline_by_week[monday], plan.rows)
+            diff.to_delete += week_diff.to_delete
+            diff.to_insert += week_diff.to_insert
+            diff.to_update += week_diff.to_update
+            diff.unchanged += week_diff.unchanged
+            week_stats[monday] = {
+                "seed": plan.seed,
+                "timings": plan.timings,
+                "rows_written": len(week_diff.to_insert) + len(week_diff.to_update),
+                "rows_deleted": len(week_diff.to_delete),
+                "rows_unchanged": week_diff.unchanged,
+            }
+            week_messages = plan.unplaced_messages() if only in [None, "project"] else []
+            messages += [f"Week of {monday}: {msg}" for msg in week_messages]
+            print(f"Week of {monday}: seed {plan.seed}, {len(plan.placed_teams)} teams placed, "
+                  f"{len(plan.unplaced_teams)} unplaced, {len(plan.oasis_rows)} Oasis rows")
+
+        timings["write"] = apply_allocation_diff(cur, diff, site)
+        timings["rollup"] = rollup_seconds
+        stats["rows_written"] = len(diff.to_insert) + len(diff.to_update)
+        stats["rows_deleted"] = len(diff.to_delete)
+        stats["rows_unchanged"] = diff.unchanged
+        print(f"Applied allocation diff for {len(mondays)} weeks in {timings['write'] * 1000:.1f} ms: "
+              f"{len(diff.to_insert)} inserted, {len(diff.to_update)} updated, {len(diff.to_delete)} deleted, "
+              f"{diff.unchanged} unchanged")
+
+        with timed_phase(timings, "commit"):
+            if dry_run:
+                conn.rollback()
+            for monday, run_id in run_ids.items():
+                finish_run_record(cur, run_id, "dry_run" if dry_run else "succeeded",
+                                  week_stats.get(monday, {}), [msg for msg in messages if msg.startswith(f"Week of {monday}")])
+            conn.commit()
+        if dry_run:
+            print(f"Dry run: rolled back batch allocation for {len(mondays)} weeks")
+        else:
+            print(f"Batch allocation completed successfully for {len(mondays)} weeks")
+        return True, messages
+
+    except Exception as e:
+        error_msg = f"Error during batch allocation: {type(e).__name__} - {e}"
+        print(error_msg)
+        if conn:
+            conn.rollback()
+            for run_id in run_ids.values():
+                record_failed_run(conn, cur, run_id, stats, [error_msg])
+        return False, [error_msg]
+    finally:
+        if held_weeks:
+            try:
+                for monday in held_weeks:
+                    release_allocation_locks(cur, allocation_lock_keys(monday, only, site))
+                conn.commit()
+            except psycopg2.Error as e:
+                print(f"Could not release allocation locks: {e}")
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+def _run_site_shard(database_url, site, base_monday_date, options):
+    """Process-pool entry point: allocate one site on the worker's own connection."""
+    stats = {}
+    success, messages = run_allocation(database_url, base_monday_date=base_monday_date, site=site, stats=stats,
+                                       **options)
+    return success, messages, stats
+
+def format_site_report(report):
+    """Render run_allocation_sharded's per-site report as printable lines."""
+    lines = [f"{'Site':<20} {'Status':<8} {'Total ms':>9} {'Written':>8} {'Deleted':>8} {'Unplaced':>9}"]
+    for site, site_report in report.items():
+        lines.append(
+            f"{site:<20} {'ok' if site_report['success'] else 'FAILED':<8} "
+            f"{sum(site_report['timings'].values()) * 1000:9.1f} {site_report['rows_written']:8d} "
+            f"{site_report['rows_deleted']:8d} {len(site_report['unplaced_teams']):9d}"
+        )
+        if site_report["unplaced_teams"]:
+            lines.append(f"    unplaced: {', '.join(site_report['unplaced_teams'])}")
+    return lines
+
+def run_allocation_sharded(database_url, base_monday_date=None, sites=None, max_workers=None, stats=None,
+                           **kwargs):
+    """
+    Allocate every office site, one shard per site across a process pool.
+
+    Sites share no rooms, preferences or allocation rows, so each shard is a
+    plain run_allocation(site=...) call in its own process, with its own
+    connection, advisory locks, allocation_runs record and transaction. A shard
+    failing does not roll back the others.
+
+    Args:
+        database_url, base_monday_date: As for run_allocation
+        sites: Site names to allocate (defaults to every site in rooms.json)
+        max_workers: Process pool size (defaults to the CPU count)
+        stats: Optional dict, filled with the combined row counts, the wall-clock
+            "timings" and a per-site "sites" report (success, timings, rows, unplaced teams)
+        **kwargs: Passed on to every run_allocation call (only, solver, seed, ...)
+
+    Returns:
+        tuple: (success: bool, messages: list), messages prefixed with their site
+    """
+    if stats is None:
+        stats = {}
+    timings = stats.setdefault("timings", {})
+    if sites is None:
+        try:
+            sites = [site for site in site_names(load_rooms_config()) if site is not None]
+        except (OSError, json.JSONDecodeError) as e:
+            error_msg = f"CRITICAL ERROR: could not read rooms.json at {ROOMS_FILE_PATH}: {e}"
+            print(error_msg)
+            return False, [error_msg]
+    if not sites:
+        return False, ["rooms.json defines no sites to shard over."]
+    print(f"Running sharded allocation for {len(sites)} sites: {', '.join(sites)}")
+
+    results = {}
+    with timed_phase(timings, "shards"):
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(_run_site_shard, database_url, site, base_monday_date, kwargs): site for site in sites
+            }
+            for future in as_completed(futures):
+                site = futures[future]
+                try:
+                    results[site] = future.result()
+                except Exception as e:
+                    results[site] = (False, [f"Shard crashed: {type(e).__name__} - {e}"], {})
+
+    report = {}
+    messages = []
+    for site in sites:
+        success, site_messages, site_stats = results[site]
+        report[site] = {
+            "success": success,
+            "run_id": site_stats.get("run_id"),
+            "seed": site_stats.get("seed"),
+            "timings": site_stats.get("timings", {}),
+            "rows_written": site_stats.get("rows_written", 0),
+            "rows_deleted": site_stats.get("rows_deleted", 0),
+            "rows_unchanged": site_stats.get("rows_unchanged", 0),
+            "unplaced_teams": site_stats.get("unplaced_teams", []),
+        }
+        messages += [f"[{site}] {msg}" for msg in site_messages]
+    for key in ("rows_written", "rows_deleted", "rows_unchanged"):
+        stats[key] = sum(site_report[key] for site_report in report.values())
+    stats["sites"] = report
+
+    print("--- Sharded allocation summary ---")
+    for line in format_site_report(report):
+        print(line)
+    return all(site_report["success"] for site_report in report.values()), messages
+
+def parse_week(value):
+    """argparse type for --week: a YYYY-MM-DD Monday."""
+    try:
+        week = datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a YYYY-MM-DD date")
+    if week.weekday() != 0:
+        raise argparse.ArgumentTypeError(f"{value} is a {week.strftime('%A')}, not a Monday")
+    return week
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the weekly project room and Oasis allocation.")
+    parser.add_argument("--week", type=parse_week, default=os.environ.get("ALLOCATION_WEEK") or None,
+                        help="Monday of the week to allocate (YYYY-MM-DD). Defaults to $ALLOCATION_WEEK.")
+    parser.add_argument("--weeks", type=int, default=1,
+                        help="Allocate this many consecutive weeks starting at --week in one batch transaction")
+    parser.add_argument("--only", choices=["project", "oasis"], help="Run only the project or only the Oasis allocation")
+    parser.add_argument("--site", help="Allocate only this office site (a key of \"sites\" in rooms.json)")
+    parser.add_argument("--all-sites", action="store_true",
+                        help="Allocate every site in rooms.json, one process per site")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run the project and Oasis allocations concurrently, each in its own transaction")
+    parser.add_argument("--solver", choices=PROJECT_SOLVERS, help="Project-room solver (default: greedy)")
+    parser.add_argument("--oasis-solver", choices=OASIS_SOLVERS, default="heap",
+                        help="Oasis lottery implementation: heap (default) or vectorised (NumPy, for large pools)")
+    parser.add_argument("--seed", type=int, help="Seed for the allocation lottery")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="Evaluate N independently seeded plans in parallel and commit the best")
+    parser.add_argument("--time-budget", type=float, help="Wall-clock limit in seconds for --candidates")
+    parser.add_argument("--improve-budget", type=float, metavar="SECONDS",
+                        help="Spend up to this long on a local search that improves the project placement")
+    parser.add_argument("--fairness-weeks", type=int, default=0,
+                        help="Favour teams and people who missed days over the last N weeks (0 = off)")
+    parser.add_argument("--dry-run", action="store_true", help="Compute and write the plan, then roll back")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Keep this week's allocations and only place new or changed preferences")
+    parser.add_argument("--on-conflict", choices=["wait", "join"], default="wait",
+                        help="If another run holds the week: wait and then run (default), or return that run's result")
+    parser.add_argument("--lock-timeout", type=float, default=DEFAULT_LOCK_TIMEOUT,
+                        help=f"Seconds to wait for another run of the same week (default: {DEFAULT_LOCK_TIMEOUT})")
+    parser.add_argument("--profile", metavar="PATH", help="Write a cProfile dump of the run to PATH")
+    parser.add_argument("--timings", action="store_true", help="Print wall-clock time per allocation phase")
+    parser.add_argument("--snapshot-dir", default=os.environ.get("ALLOCATION_SNAPSHOT_DIR") or None,
+                        help="Store each run's inputs, seed and plan digest here for --replay")
+    parser.add_argument("--replay", metavar="SNAPSHOT",
+                        help="Re-execute a stored run snapshot with its recorded seed (no database needed)")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URI"),
+                        help="Database connection string. Defaults to $DATABASE_URL or $SUPABASE_DB_URI.")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        start_time = time.perf_counter()
+        plan, matches = replay_run_snapshot(args.replay, solver=args.solver)
+        elapsed = time.perf_counter() - start_time
+        print(f"Replayed {args.replay} with seed {plan.seed}: {len(plan.rows)} rows, "
+              f"{len(plan.placed_teams)} teams placed, {len(plan.unplaced_teams)} unplaced in {elapsed * 1000:.1f} ms")
+        if args.timings:
+            for phase, seconds in plan.timings.items():
+                print(f"  {phase:<14} {seconds * 1000:10.1f} ms")
+        print("Plan matches the recorded run." if matches else "Plan DIFFERS from the recorded run.")
+        return 0 if matches else 1
+
+    if args.week is None:
+        parser.error("--week is required (or set ALLOCATION_WEEK). No automatic date calculation is done.")
+    if not args.database_url:
+        parser.error("No database URL. Pass --database-url or set DATABASE_URL.")
+    if args.weeks > 1 and (args.parallel or args.candidates > 1 or args.snapshot_dir or args.on_conflict == "join"
+                           or args.fairness_weeks):
+        parser.error("--weeks cannot be combined with --parallel, --candidates, --snapshot-dir, --fairness-weeks "
+                     "or --on-conflict join")
+    if args.all_sites and (args.site or args.weeks > 1 or args.parallel):
+        parser.error("--all-sites cannot be combined with --site, --weeks or --parallel")
+
+    stats = {}
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    run_options = dict(base_monday_date=args.week, site=args.site, solver=args.solver or "greedy", seed=args.seed,
+                       dry_run=args.dry_run, incremental=args.incremental, candidates=args.candidates,
+                       time_budget=args.time_budget, snapshot_dir=args.snapshot_dir, stats=stats,
+                       on_conflict=args.on_conflict, lock_timeout=args.lock_timeout,
+                       fairness_weeks=args.fairness_weeks, improve_budget=args.improve_budget,
+                       oasis_solver=args.oasis_solver)
+    if args.weeks > 1:
+        success, messages = run_allocation_batch(
+            args.database_url, [args.week + timedelta(weeks=i) for i in range(args.weeks)], only=args.only,
+            solver=args.solver or "greedy", seed=args.seed, dry_run=args.dry_run, incremental=args.incremental,
+            stats=stats, lock_timeout=args.lock_timeout, site=args.site, improve_budget=args.improve_budget,
+            oasis_solver=args.oasis_solver,
+        )
+    elif args.all_sites:
+        del run_options["site"]
+        del run_options["stats"]
+        success, messages = run_allocation_sharded(args.database_url, only=args.only, stats=stats, **run_options)
+    elif args.parallel and args.only is None:
+        success, messages = run_allocation_concurrently(args.database_url, **run_options)
+    else:
+        success, messages = run_allocation(args.database_url, only=args.only, **run_options)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+    if args.timings:
+        print("Phase timings:")
+        for phase, seconds in stats.get("timings", {}).items():
+            print(f"  {phase:<14} {seconds * 1000:10.1f} ms")
+        print(f"  rows written   {stats.get('rows_written', 0):10d}")
+        print(f"  rows deleted   {stats.get('rows_deleted', 0):10d}")
+        print(f"  rows unchanged {stats.get('rows_unchanged', 0):10d}")
+
+    for msg in messages:
+        print(msg)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1376 @@
+"""
+Pure in-memory allocation engine for project rooms and the Oasis.
+
+Nothing in this module talks to the database. run_allocation in allocate_rooms.py
+loads rooms.json and the preference tables, hands plain Python data to
+build_allocation_plan and writes the returned AllocationPlan back, so the solver
+can be timed and scaled without a live Postgres.
+"""
+import hashlib
+import heapq
+import multiprocessing
+import queue
+import random
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WEEKDAY_LABELS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+WEEKDAY_BITS = {day_label: 1 << i for i, day_label in enumerate(WEEKDAY_LABELS)}
+# Day patterns project teams can book when rooms.json does not define "day_patterns"
+DEFAULT_DAY_PATTERNS = [("Monday", "Wednesday"), ("Tuesday", "Thursday")]
+OASIS_ROOM_NAME = "Oasis"
+DEFAULT_OASIS_CAPACITY = 15
+PROJECT_SOLVERS = ("greedy", "optimal")
+OASIS_SOLVERS = ("heap", "vectorised")
+
+
+def _silent(*args, **kwargs):
+    pass
+
+
+def _lottery_shuffle(items, rng, shortfall=None, name_of=lambda item: item):
+    """
+    Shuffle items in place for the lottery.
+
+    With shortfall (name -> days missed in recent weeks) the shuffle is a
+    weighted lottery instead: each item is drawn ahead of the others with odds
+    proportional to 1 + its shortfall (Efraimidis-Spirakis keys). Without it
+    this is exactly rng.shuffle, so seeded runs replay unchanged.
+    """
+    if not shortfall:
+        rng.shuffle(items)
+        return
+    items.sort(key=lambda item: -rng.random() ** (1.0 / (1 + shortfall.get(name_of(item), 0))))
+
+
+@dataclass
+class AllocationPlan:
+    """
+    Result of one allocation run, independent of how it gets persisted.
+
+    Rows are (team_name, room_name, date) tuples, ready for weekly_allocations.
+    """
+    project_rows: list = field(default_factory=list)
+    oasis_rows: list = field(default_factory=list)
+    placed_teams: dict = field(default_factory=dict)        # team_name -> (room_name, (day_label, ...))
+    unplaced_teams: list = field(default_factory=list)      # (team_name, team_size, preferred_day_labels)
+    oasis_assignments: dict = field(default_factory=dict)   # person_name -> [day_label, ...]
+    timings: dict = field(default_factory=dict)             # phase name -> seconds
+    preferences_honoured: int = 0                           # placed teams that got their preferred day pattern
+    seed: int = None                                        # lottery seed, when the plan was seeded
+    candidates_evaluated: int = 1                           # plans compared to pick this one (best-of-N mode)
+    improvement: dict = None                                # local-search report, when that phase ran
+
+    @property
+    def rows(self):
+        return self.project_rows + self.oasis_rows
+
+    def oasis_spread(self):
+        """Difference between the most and fewest Oasis days given to anyone who asked for a seat."""
+        counts = [len(days) for days in self.oasis_assignments.values()]
+        return max(counts) - min(counts) if counts else 0
+
+    def score(self):
+        """Sort key for comparing candidate plans: higher is better."""
+        return (len(self.placed_teams), self.preferences_honoured, -self.oasis_spread(), len(self.oasis_rows))
+
+    def unplaced_messages(self):
+        return [
+            f"Unplaced Project Team: {team_name} (Size: {team_size}, Preferred Days: {pref_labels})"
+            for team_name, team_size, pref_labels in self.unplaced_teams
+        ]
+
+
+@dataclass
+class AllocationDiff:
+    """
+    Minimal change set that turns the stored rows for a week into a new plan.
+
+    to_insert holds (team_name, room_name, date) rows. to_delete holds
+    (id, team_name, room_name, date) stored rows and to_update holds
+    (id, team_name, old_room_name, date, new_room_name) for owners that keep
+    their day but move room; both are written by id, so one copy of a row
+    stored twice can go while the other stays. Rows present in both are left
+    alone, so their confirmed flags survive.
+    """
+    to_delete: list = field(default_factory=list)
+    to_insert: list = field(default_factory=list)
+    to_update: list = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def is_empty(self):
+        return not (self.to_delete or self.to_insert or self.to_update)
+
+
+def day_mask(day_labels):
+    """Weekday bitmask for a collection of day labels (Monday = bit 0 ... Friday = bit 4)."""
+    mask = 0
+    for day_label in day_labels:
+        mask |= WEEKDAY_BITS[day_label]
+    return mask
+
+
+def split_rooms_config(all_rooms_config):
+    """
+    Split the rooms.json entries into project rooms and the Oasis configuration.
+
+    rooms.json is either a plain list of rooms or an object with "rooms" and an
+    optional "day_patterns" catalogue.
+
+    Returns:
+        tuple: (project_rooms: list of dicts, oasis_config: dict or None)
+    """
+    rooms = all_rooms_config.get("rooms", []) if isinstance(all_rooms_config, dict) else all_rooms_config
+    project_rooms = [r for r in rooms if r.get("name") != OASIS_ROOM_NAME and "capacity" in r and "name" in r]
+    oasis_config = next((r for r in rooms if r.get("name") == OASIS_ROOM_NAME and "capacity" in r), None)
+    return project_rooms, oasis_config
+
+
+def site_names(all_rooms_config):
+    """
+    Office sites defined in rooms.json.
+
+    A multi-office rooms.json is {"sites": {site_name: <single-site config>, ...}};
+    any other file describes one office and yields [None].
+    """
+    if isinstance(all_rooms_config, dict) and "sites" in all_rooms_config:
+        return list(all_rooms_config["sites"])
+    return [None]
+
+
+def site_rooms_config(all_rooms_config, site=None):
+    """
+    The single-site rooms.json section build_allocation_plan reads for one site.
+
+    Raises:
+        ValueError: if the site is not defined, or no site is given for a file with several
+    """
+    sites = all_rooms_config.get("sites") if isinstance(all_rooms_config, dict) else None
+    if sites is None:
+        if site is not None:
+            raise ValueError(f"rooms.json defines no sites, so it has no site '{site}'")
+        return all_rooms_config
+    if site is None:
+        if len(sites) != 1:
+            raise ValueError(f"rooms.json defines several sites ({', '.join(sites)}); choose one")
+        return next(iter(sites.values()))
+    if site not in sites:
+        raise ValueError(f"Unknown site '{site}'. rooms.json defines: {', '.join(sites)}")
+    return sites[site]
+
+
+def day_patterns_from_config(all_rooms_config):
+    """
+    Read the project day-pattern catalogue from rooms.json.
+
+    Each entry of "day_patterns" is a list of weekday names, e.g.
+    ["Monday", "Wednesday"] or ["Friday"]. Days are kept in weekday order and
+    duplicate patterns are dropped.
+
+    Returns:
+        list of tuples of day labels
+    """
+    configured = all_rooms_config.get("day_patterns") if isinstance(all_rooms_config, dict) else None
+    if not configured:
+        return list(DEFAULT_DAY_PATTERNS)
+    patterns = []
+    for entry in configured:
+        days = entry.get("days", []) if isinstance(entry, dict) else entry
+        unknown = [day for day in days if day not in WEEKDAY_BITS]
+        if unknown or not days:
+            raise ValueError(f"Invalid day pattern {entry!r} in rooms.json: days must be weekday names")
+        pattern = tuple(day for day in WEEKDAY_LABELS if day in days)
+        if pattern not in patterns:
+            patterns.append(pattern)
+    return patterns
+
+
+def parse_team_preferences(team_preferences_raw, verbose=True):
+    """
+    Turn weekly_preferences rows (team_name, team_size, preferred_days) into
+    (team_name, team_size, [day_label, ...]) tuples.
+    """
+    log = print if verbose else _silent
+    teams = []
+    for team_name, team_size, preferred_days_str in team_preferences_raw:
+        pref_day_labels = [
+            day.strip().capitalize() for day in (preferred_days_str or "").split(',') if day.strip()
+        ]
+        log(f"Processing team {team_name}: raw='{preferred_days_str}' -> parsed={pref_day_labels}")
+        teams.append((team_name, int(team_size), pref_day_labels))
+    return teams
+
+
+def parse_oasis_preferences(person_rows, day_labels, verbose=True):
+    """
+    Turn oasis_preferences rows (person_name, day_1 ... day_5) into a
+    person_name -> [day_label, ...] dict, dropping days outside day_labels.
+    """
+    log = print if verbose else _silent
+    person_preferences = {}
+    for person_name, *days in person_rows:
+        prefs = [
+            day.strip().capitalize() for day in days
+            if day and day.strip().capitalize() in day_labels
+        ]
+        person_preferences[person_name] = prefs
+        log(f"Person {person_name} prefers: {prefs}")
+    return person_preferences
+
+
+class RoomAvailabilityIndex:
+    """
+    Free project rooms per weekday, for best-fit lookups that do not scan every room.
+
+    Rooms are kept in capacity order and each weekday holds an integer bitset
+    with bit i set while room i is free. "Smallest free room with capacity >= k
+    on every day of a pattern" is a bisect on the capacities plus an AND of at
+    most five bitsets and a lowest-set-bit lookup, however many rooms and
+    patterns there are.
+    """
+
+    def __init__(self, project_rooms):
+        self.rooms = sorted(project_rooms, key=lambda room_config: room_config["capacity"])
+        self.capacities = [room_config["capacity"] for room_config in self.rooms]
+        self.index_by_name = {room_config["name"]: i for i, room_config in enumerate(self.rooms)}
+        self.all_rooms = (1 << len(self.rooms)) - 1
+        self.free = {bit: self.all_rooms for bit in WEEKDAY_BITS.values()}
+
+    def take(self, room_index, mask):
+        for bit in self.free:
+            if mask & bit:
+                self.free[bit] &= ~(1 << room_index)
+
+    def take_by_name(self, room_name, mask):
+        room_index = self.index_by_name.get(room_name)
+        if room_index is not None:
+            self.take(room_index, mask)
+
+    def give_back_by_name(self, room_name, mask):
+        room_index = self.index_by_name.get(room_name)
+        if room_index is not None:
+            for bit in self.free:
+                if mask & bit:
+                    self.free[bit] |= 1 << room_index
+
+    def free_rooms(self, mask):
+        rooms_mask = self.all_rooms
+        for bit, free in self.free.items():
+            if mask & bit:
+                rooms_mask &= free
+        return rooms_mask
+
+    def best_fit(self, team_size, mask, rng):
+        """
+        Pick a random room among the smallest ones with capacity >= team_size
+        that are free on every day in mask, or return None.
+        """
+        first_fitting = bisect_left(self.capacities, team_size)
+        rooms_mask = self.free_rooms(mask) >> first_fitting
+        if not rooms_mask:
+            return None
+        smallest = first_fitting + (rooms_mask & -rooms_mask).bit_length() - 1
+        group_end = bisect_right(self.capacities, self.capacities[smallest])
+        group_mask = (rooms_mask >> (smallest - first_fitting)) & ((1 << (group_end - smallest)) - 1)
+        # Uniform choice among the free rooms of that capacity
+        for _ in range(rng.randrange(bin(group_mask).count("1"))):
+            group_mask &= group_mask - 1
+        return self.rooms[smallest + (group_mask & -group_mask).bit_length() - 1]
+
+
+def _label_pattern(pattern):
+    return "/".join(day_label[:3] for day_label in pattern)
+
+
+def allocate_project_rooms(project_rooms, teams, day_mapping, day_patterns=None, occupied=None, rng=None,
+                           shortfall=None, verbose=True):
+    """
+    Greedy placement: each pattern's teams get their preferred pattern first,
+    then everyone left goes through the fallback pool.
+
+    Args:
+        project_rooms: list of {"name": str, "capacity": int}
+        teams: list of (team_name, team_size, [day_label, ...])
+        day_mapping: day label -> date for the week being allocated
+        day_patterns: Bookable patterns as tuples of day labels (DEFAULT_DAY_PATTERNS when None)
+        occupied: Optional (room_name, date) pairs that are already taken
+        rng: random.Random used for shuffles and best-fit tie-breaks
+        shortfall: Optional team_name -> room days missed in recent weeks, for a history-weighted lottery
+        verbose: print the per-team placement log
+
+    Returns:
+        tuple: (rows, placed_teams, unplaced_teams)
+    """
+    log = print if verbose else _silent
+    rng = rng or random.Random()
+    day_patterns = [pattern for pattern in (day_patterns or DEFAULT_DAY_PATTERNS) if all(day in day_mapping for day in pattern)]
+    pattern_masks = [day_mask(pattern) for pattern in day_patterns]
+    pattern_by_mask = {mask: i for i, mask in enumerate(pattern_masks)}
+    day_by_date = {date_obj: day_label for day_label, date_obj in day_mapping.items()}
+    rows = []
+    availability = RoomAvailabilityIndex(project_rooms)
+    for room_name, date_obj in occupied or []:
+        if date_obj in day_by_date:
+            availability.take_by_name(room_name, WEEKDAY_BITS[day_by_date[date_obj]])
+    placed_teams = {}
+
+    teams_by_pattern = [[] for _ in day_patterns]
+    teams_for_fallback_immediately = []
+    preferred_pattern = {}
+
+    for team_data in teams:
+        team_name, _, pref_day_labels = team_data
+        known_days = all(day in WEEKDAY_BITS for day in pref_day_labels)
+        pattern_index = pattern_by_mask.get(day_mask(pref_day_labels)) if known_days and pref_day_labels else None
+        preferred_pattern[team_name] = pattern_index
+        if pattern_index is None:
+            teams_for_fallback_immediately.append(team_data)
+            log(f"  → {team_name} added to immediate fallback group")
+        else:
+            teams_by_pattern[pattern_index].append(team_data)
+            log(f"  → {team_name} added to {_label_pattern(day_patterns[pattern_index])} group")
+
+    for pattern, pattern_teams in zip(day_patterns, teams_by_pattern):
+        log(f"Teams preferring {_label_pattern(pattern)}: {len(pattern_teams)}")
+    log(f"Teams with other preferences: {len(teams_for_fallback_immediately)}")
+
+    team_name_of = lambda team_data: team_data[0]
+    for pattern_teams in teams_by_pattern:
+        _lottery_shuffle(pattern_teams, rng, shortfall, team_name_of)
+    _lottery_shuffle(teams_for_fallback_immediately, rng, shortfall, team_name_of)
+
+    def place(team_name, room_config, pattern_index):
+        for day_label in day_patterns[pattern_index]:
+            rows.append((team_name, room_config["name"], day_mapping[day_label]))
+        availability.take_by_name(room_config["name"], pattern_masks[pattern_index])
+        placed_teams[team_name] = (room_config["name"], day_patterns[pattern_index])
+
+    def attempt_placement_for_pattern(pattern_teams, pattern_index):
+        sorted_teams_for_pattern = sorted(pattern_teams, key=lambda x: x[1], reverse=True)
+        still_unplaced_from_this_pattern = []
+        label = _label_pattern(day_patterns[pattern_index])
+
+        log(f"Attempting placement for {label} - {len(sorted_teams_for_pattern)} teams")
+
+        for team_name, team_size, original_pref_labels in sorted_teams_for_pattern:
+            if team_name in placed_teams:
+                continue
+            chosen_room_config = availability.best_fit(team_size, pattern_masks[pattern_index], rng)
+            if chosen_room_config is None:
+                still_unplaced_from_this_pattern.append((team_name, team_size, original_pref_labels))
+                log(f"    ❌ No available rooms for {team_name} (size {team_size})")
+                continue
+            place(team_name, chosen_room_config, pattern_index)
+            log(f"    ✅ Placed team {team_name} in {chosen_room_config['name']} for {label}")
+
+        return still_unplaced_from_this_pattern
+
+    master_fallback_pool = []
+    for pattern_index, pattern_teams in enumerate(teams_by_pattern):
+        unplaced = attempt_placement_for_pattern(pattern_teams, pattern_index)
+        log(f"Unplaced after {_label_pattern(day_patterns[pattern_index])} pass: {[t[0] for t in unplaced]}")
+        master_fallback_pool.extend(unplaced)
+    master_fallback_pool.extend(teams_for_fallback_immediately)
+    _lottery_shuffle(master_fallback_pool, rng, shortfall, team_name_of)
+
+    log(f"Fallback allocation needed for {len(master_fallback_pool)} teams")
+
+    unplaced_teams = []
+    sorted_fallback_teams = sorted(master_fallback_pool, key=lambda x: x[1], reverse=True)
+
+    for team_name, team_size, original_pref_labels in sorted_fallback_teams:
+        if team_name in placed_teams:
+            continue
+
+        # Keep the original preference as first choice, then patterns with the same
+        # number of days, then the rest; random order within each group
+        pattern_index = preferred_pattern[team_name]
+        others = [i for i in range(len(day_patterns)) if i != pattern_index]
+        rng.shuffle(others)
+        others.sort(key=lambda i: len(day_patterns[i]) != len(original_pref_labels))
+        fallback_patterns = ([pattern_index] if pattern_index is not None else []) + others
+
+        for fb_pattern_index in fallback_patterns:
+            chosen_room_fb_config = availability.best_fit(team_size, pattern_masks[fb_pattern_index], rng)
+            if chosen_room_fb_config is None:
+                continue
+            place(team_name, chosen_room_fb_config, fb_pattern_index)
+            honor_status = "✓ PREFERENCE HONORED" if fb_pattern_index == pattern_index else f"⚠ Fallback used (wanted {original_pref_labels})"
+            log(f"  → Placed team {team_name} in {chosen_room_fb_config['name']} for {_label_pattern(day_patterns[fb_pattern_index])} - {honor_status}")
+            break
+        else:
+            unplaced_teams.append((team_name, team_size, original_pref_labels))
+
+    return rows, placed_teams, unplaced_teams
+
+
+def _min_cost_max_flow(node_count, edges, source, sink):
+    """
+    Successive-shortest-path min-cost max-flow (Bellman-Ford on the residual graph).
+
+    Args:
+        node_count: Number of nodes, numbered 0 .. node_count - 1
+        edges: list of (from_node, to_node, capacity, cost)
+        source, sink: Node ids
+
+    Returns:
+        list: flow pushed over each entry of edges, in the same order
+    """
+    graph = [[] for _ in range(node_count)]
+    # Residual arcs are [to, remaining_capacity, cost, index_of_reverse_arc]
+    forward_arcs = []
+    for u, v, capacity, cost in edges:
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+        forward_arcs.append((u, len(graph[u]) - 1, capacity))
+
+    while True:
+        dist = [None] * node_count
+        parent = [None] * node_count
+        dist[source] = 0
+        updated = True
+        while updated:
+            updated = False
+            for u in range(node_count):
+                if dist[u] is None:
+                    continue
+                for arc_index, (v, remaining, cost, _) in enumerate(graph[u]):
+                    if remaining > 0 and (dist[v] is None or dist[u] + cost < dist[v]):
+                        dist[v] = dist[u] + cost
+                        parent[v] = (u, arc_index)
+                        updated = True
+        if dist[sink] is None:
+            break
+
+        push = None
+        v = sink
+        while v != source:
+            u, arc_index = parent[v]
+            remaining = graph[u][arc_index][1]
+            push = remaining if push is None else min(push, remaining)
+            v = u
+        v = sink
+        while v != source:
+            u, arc_index = parent[v]
+            arc = graph[u][arc_index]
+            arc[1] -= push
+            graph[v][arc[3]][1] += push
+            v = u
+
+    return [capacity - graph[u][arc_index][1] for u, arc_index, capacity in forward_arcs]
+
+
+def patterns_are_disjoint(day_patterns):
+    """True when no weekday appears in more than one pattern."""
+    seen = 0
+    for pattern in day_patterns:
+        mask = day_mask(pattern)
+        if seen & mask:
+            return False
+        seen |= mask
+    return True
+
+
+def allocate_project_rooms_optimal(project_rooms, teams, day_mapping, day_patterns=None, occupied=None, rng=None,
+                                   shortfall=None, verbose=True):
+    """
+    Optimal project placement as a min-cost max-flow problem.
+
+    When the day patterns are disjoint, every room offers one independent slot
+    per pattern, so team -> (room, pattern) is a bipartite matching. Teams are
+    grouped by (size, preferred pattern) and slots by (capacity, pattern),
+    which keeps the flow network at a few dozen nodes however many teams and
+    rooms there are. The flow places as many teams as possible; among those
+    placements a missed preference costs more than any capacity slack, and the
+    slack (room capacity - team size) breaks the remaining ties towards best fit.
+
+    Overlapping patterns (e.g. Monday alone and Monday/Wednesday) share room
+    days, which a matching cannot express; the greedy solver is used instead.
+
+    Same arguments and return value as allocate_project_rooms.
+    """
+    log = print if verbose else _silent
+    rng = rng or random.Random()
+    day_patterns = [pattern for pattern in (day_patterns or DEFAULT_DAY_PATTERNS) if all(day in day_mapping for day in pattern)]
+    if not patterns_are_disjoint(day_patterns):
+        log("Day patterns overlap, so the optimal solver cannot model them as a matching. Using the greedy solver.")
+        return allocate_project_rooms(project_rooms, teams, day_mapping, day_patterns=day_patterns,
+                                      occupied=occupied, rng=rng, shortfall=shortfall, verbose=verbose)
+    rows = []
+    placed_teams = {}
+    pattern_by_mask = {day_mask(pattern): i for i, pattern in enumerate(day_patterns)}
+
+    team_classes = {}
+    for team_name, team_size, pref_labels in teams:
+        known_days = pref_labels and all(day in WEEKDAY_BITS for day in pref_labels)
+        preferred_pattern = pattern_by_mask.get(day_mask(pref_labels)) if known_days else None
+        team_classes.setdefault((team_size, preferred_pattern), []).append((team_name, team_size, pref_labels))
+    occupied = set(occupied or [])
+    slot_classes = {}
+    for room_config in project_rooms:
+        for pattern_index, pattern in enumerate(day_patterns):
+            if any((room_config["name"], day_mapping[day_label]) in occupied for day_label in pattern):
+                continue
+            slot_classes.setdefault((room_config["capacity"], pattern_index), []).append(room_config)
+
+    team_keys = list(team_classes)
+    slot_keys = list(slot_classes)
+    source = 0
+    sink = 1
+    team_node = {key: 2 + i for i, key in enumerate(team_keys)}
+    slot_node = {key: 2 + len(team_keys) + i for i, key in enumerate(slot_keys)}
+    max_capacity = max((room_config["capacity"] for room_config in project_rooms), default=0)
+    preference_miss_cost = max_capacity + 1
+
+    edges = []
+    for key in team_keys:
+        edges.append((source, team_node[key], len(team_classes[key]), 0))
+    for key in slot_keys:
+        edges.append((slot_node[key], sink, len(slot_classes[key]), 0))
+    assignment_edges = []
+    for team_size, preferred_pattern in team_keys:
+        for capacity, pattern_index in slot_keys:
+            if capacity < team_size:
+                continue
+            cost = (capacity - team_size) + (0 if pattern_index == preferred_pattern else preference_miss_cost)
+            assignment_edges.append(((team_size, preferred_pattern), (capacity, pattern_index)))
+            edges.append((team_node[(team_size, preferred_pattern)], slot_node[(capacity, pattern_index)], len(team_classes[(team_size, preferred_pattern)]), cost))
+
+    flows = _min_cost_max_flow(2 + len(team_keys) + len(slot_keys), edges, source, sink)
+    assignment_flows = flows[len(team_keys) + len(slot_keys):]
+
+    # Turn class-level flow back into concrete teams and rooms
+    for members in team_classes.values():
+        _lottery_shuffle(members, rng, shortfall, lambda team_data: team_data[0])
+        if shortfall:
+            members.reverse()  # pop() below hands out slots from the end, so the lottery winners go last
+    for rooms_in_class in slot_classes.values():
+        rng.shuffle(rooms_in_class)
+    for (team_key, slot_key), flow in zip(assignment_edges, assignment_flows):
+        pattern = day_patterns[slot_key[1]]
+        for _ in range(flow):
+            team_name, team_size, pref_labels = team_classes[team_key].pop()
+            room_config = slot_classes[slot_key].pop()
+            for day_label in pattern:
+                rows.append((team_name, room_config["name"], day_mapping[day_label]))
+            placed_teams[team_name] = (room_config["name"], pattern)
+            honor_status = "✓ PREFERENCE HONORED" if slot_key[1] == team_key[1] else f"⚠ Fallback used (wanted {pref_labels})"
+            log(f"  → Placed team {team_name} in {room_config['name']} for {_label_pattern(pattern)} - {honor_status}")
+
+    unplaced_teams = [team for members in team_classes.values() for team in members]
+    return rows, placed_teams, unplaced_teams
+
+
+def improve_project_placement(project_rooms, teams, placed_teams, unplaced_teams, day_mapping, day_patterns=None,
+                              occupied=None, time_budget=None, max_steps=None, rng=None, verbose=True):
+    """
+    Anytime local search over a finished project placement.
+
+    Each step takes one team that is unplaced or sits outside its preferred
+    pattern and tries, in order:
+      - unplaced: a free (room, pattern) slot that fits, else moving the single
+        team that blocks a fitting slot to some other free slot
+      - placed off-preference: a free slot with its preferred pattern, else a
+        swap with a team holding such a slot, when both rooms still fit
+    A move is only kept when it places more teams or, failing that, honours
+    more preferences, so the plan never gets worse and can be cut off at any
+    step. The search ends at a local optimum (a full pass without a kept
+    move), when time_budget runs out or after max_steps steps. The budget is
+    also checked inside a step's slot scan; a step cut short there is undone
+    and not counted, so replaying with max_steps gives the same plan.
+
+    Free slots come from a RoomAvailabilityIndex, and the holders of every
+    slot and the placed teams of every kind (size and preferred days) are
+    indexed up front and updated on each move, so a step looks up free slots,
+    blockers and swap partners instead of rescanning every room and pattern.
+
+    Args:
+        project_rooms, day_mapping, day_patterns, occupied: As for allocate_project_rooms
+        teams: Every (team_name, team_size, [day_label, ...]) the solver was given
+        placed_teams, unplaced_teams: The solver's result
+        time_budget: Optional wall-clock limit in seconds
+        max_steps: Optional step limit; a replay passes the recorded step count
+        rng: random.Random used for the visiting order
+        verbose: print each kept move
+
+    Returns:
+        tuple: (rows, placed_teams, unplaced_teams, report), report holding the
+            steps taken, moves kept, placed/honoured gains, elapsed_ms,
+            improvement_per_ms ((placed + honoured gain) per millisecond) and
+            why the search stopped
+    """
+    log = print if verbose else _silent
+    rng = rng or random.Random()
+    start_time = time.perf_counter()
+    deadline = start_time + time_budget if time_budget is not None else None
+    day_patterns = [pattern for pattern in (day_patterns or DEFAULT_DAY_PATTERNS) if all(day in day_mapping for day in pattern)]
+    capacity_of = {room_config["name"]: room_config["capacity"] for room_config in project_rooms}
+    size_of = {team_name: team_size for team_name, team_size, _ in teams}
+    preferred_days = {team_name: set(pref_labels) for team_name, _, pref_labels in teams}
+    # Teams with the same size and preferred days can use exactly the same slots
+    kind_of = {team_name: (team_size, frozenset(pref_labels)) for team_name, team_size, pref_labels in teams}
+    day_by_date = {date_obj: day_label for day_label, date_obj in day_mapping.items()}
+
+    # Indexes built once and kept up to date by every assign and release: free rooms per weekday
+    # as bitsets, the holders of every (room_name, pattern) slot's days, and placed teams by kind
+    index = RoomAvailabilityIndex(project_rooms)
+    rooms_by_capacity = [room_config["name"] for room_config in index.rooms]
+    pattern_masks = {pattern: day_mask(pattern) for pattern in day_patterns}
+    patterns_by_day = {day_label: [pattern for pattern in day_patterns if day_label in pattern] for day_label in day_mapping}
+    slot_holders = {(room_name, pattern): {} for room_name in rooms_by_capacity for pattern in day_patterns}
+    # (room_name, day_label) -> team_name, or None for a cell held by a row the search may not touch
+    holder = {}
+    # Patterns a team holding `own` can switch to inside its room when another team takes `wanted` there:
+    # they share a day with `own` (else they would be free for the newcomer too) and none with `wanted`
+    in_room_moves = {
+        (own, wanted): [other for other in day_patterns if set(other) & set(own) and not set(other) & set(wanted)]
+        for own in day_patterns for wanted in day_patterns if set(own) & set(wanted)
+    }
+    can_move_in_room = any(in_room_moves.values())
+    overlapping_patterns = {own: [pattern for pattern in day_patterns if set(pattern) & set(own)] for own in day_patterns}
+    placed_by_kind = {}  # (team_size, preferred days) -> placed team names, as an insertion-ordered dict
+
+    def hold(room_name, day_label, team_name):
+        holder[(room_name, day_label)] = team_name
+        for pattern in patterns_by_day[day_label]:
+            holders = slot_holders[(room_name, pattern)]
+            holders[team_name] = holders.get(team_name, 0) + 1
+
+    def unhold(room_name, day_label):
+        team_name = holder.pop((room_name, day_label))
+        for pattern in patterns_by_day[day_label]:
+            holders = slot_holders[(room_name, pattern)]
+            holders[team_name] -= 1
+            if not holders[team_name]:
+                del holders[team_name]
+
+    def honoured(team_name, pattern):
+        return set(pattern) == preferred_days[team_name]
+
+    def out_of_time():
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def assign(team_name, room_name, pattern):
+        placed[team_name] = (room_name, pattern)
+        placed_by_kind.setdefault(kind_of[team_name], {})[team_name] = None
+        index.take_by_name(room_name, day_mask(pattern))
+        for day_label in pattern:
+            hold(room_name, day_label, team_name)
+
+    def release(team_name):
+        room_name, pattern = placed.pop(team_name)
+        del placed_by_kind[kind_of[team_name]][team_name]
+        if not placed_by_kind[kind_of[team_name]]:
+            del placed_by_kind[kind_of[team_name]]
+        index.give_back_by_name(room_name, day_mask(pattern))
+        for day_label in pattern:
+            unhold(room_name, day_label)
+        return room_name, pattern
+
+    placed = {}
+    for room_name, date_obj in occupied or []:
+        if room_name in capacity_of and date_obj in day_by_date and (room_name, day_by_date[date_obj]) not in holder:
+            hold(room_name, day_by_date[date_obj], None)
+            index.take_by_name(room_name, WEEKDAY_BITS[day_by_date[date_obj]])
+    for team_name, (room_name, pattern) in placed_teams.items():
+        assign(team_name, room_name, pattern)
+
+    def split_patterns(kind, only_preferred):
+        preferred = [pattern for pattern in day_patterns if set(pattern) == kind[1]]
+        others = [] if only_preferred else [pattern for pattern in day_patterns if set(pattern) != kind[1]]
+        return preferred, others
+
+    def free_slot(kind, only_preferred=False):
+        """Free slot for a team of this kind: preferred pattern first, then the tightest room, from the bitsets."""
+        first_fitting = bisect_left(index.capacities, kind[0])
+        for patterns in split_patterns(kind, only_preferred):
+            best = None
+            for pattern in patterns:
+                rooms_mask = index.free_rooms(pattern_masks[pattern]) >> first_fitting
+                if rooms_mask:
+                    room_index = first_fitting + (rooms_mask & -rooms_mask).bit_length() - 1
+                    if best is None or room_index < best[0]:
+                        best = (room_index, pattern)
+            if best:
+                return rooms_by_capacity[best[0]], best[1]
+        return None
+
+    def try_place(team_name):
+        slot = free_slot(kind_of[team_name])
+        if slot:
+            assign(team_name, *slot)
+            log(f"  ↗ Local search placed {team_name} in {slot[0]} for {_label_pattern(slot[1])}")
+            return True
+        # A kicked blocker can move to a slot that is already free for its kind, or to another
+        # pattern in its own room that the kick leaves free. Without in-room moves only placed
+        # teams of a kind with a free slot are worth kicking, so only those are looked at.
+        free_for_kind = {}
+        for kind in placed_by_kind:
+            slot = free_slot(kind)
+            if slot:
+                free_for_kind[kind] = slot
+        if can_move_in_room:
+            blockers = list(placed)
+        else:
+            blockers = [blocker for kind in free_for_kind for blocker in placed_by_kind[kind]]
+        best = None
+        for blocker in blockers:
+            if out_of_time():
+                return None
+            room_name, own = placed[blocker]
+            if capacity_of[room_name] < size_of[team_name]:
+                continue
+            for pattern in overlapping_patterns.get(own, ()):
+                if list(slot_holders[(room_name, pattern)]) != [blocker]:
+                    continue
+                new_slot = free_for_kind.get(kind_of[blocker]) or next(
+                    ((room_name, other) for other in in_room_moves[(own, pattern)]
+                     if all(other_holder == blocker for other_holder in slot_holders[(room_name, other)])),
+                    None,
+                )
+                # Same order as free_slot: preferred pattern first, then the tightest room
+                rank = (not honoured(team_name, pattern), index.index_by_name[room_name], day_patterns.index(pattern))
+                if new_slot and (best is None or rank < best[0]):
+                    best = (rank, blocker, room_name, pattern, new_slot)
+        if best is None:
+            return False
+        _, blocker, room_name, pattern, new_slot = best
+        release(blocker)
+        assign(team_name, room_name, pattern)
+        assign(blocker, *new_slot)
+        log(f"  ↗ Local search moved {blocker} to {new_slot[0]} for {_label_pattern(new_slot[1])} "
+            f"and placed {team_name} in {room_name}")
+        return True
+
+    def try_honour(team_name):
+        slot = free_slot(kind_of[team_name], only_preferred=True)
+        if slot:
+            old_room_name, _ = release(team_name)
+            assign(team_name, *slot)
+            log(f"  ↗ Local search moved {team_name} from {old_room_name} to {slot[0]} for {_label_pattern(slot[1])}")
+            return True
+        # Swap partners come from the kind index: a team that wants the same days would lose exactly
+        # what this one gains, and a kind too big for this team's room cannot take it over
+        own_slot = placed[team_name]
+        preferred = split_patterns(kind_of[team_name], only_preferred=True)[0]
+        best = None
+        for kind, kind_teams in placed_by_kind.items():
+            if kind[1] == kind_of[team_name][1] or kind[0] > capacity_of[own_slot[0]]:
+                continue
+            for other in kind_teams:
+                if out_of_time():
+                    return None
+                room_name, pattern = placed[other]
+                if pattern not in preferred or capacity_of[room_name] < size_of[team_name]:
+                    continue
+                # Tightest room first, as in free_slot
+                rank = (index.index_by_name[room_name], day_patterns.index(pattern))
+                if best is None or rank < best[0]:
+                    best = (rank, other, room_name, pattern)
+        if best is None:
+            return False
+        _, other, room_name, pattern = best
+        release(team_name)
+        release(other)
+        assign(team_name, room_name, pattern)
+        assign(other, *own_slot)
+        log(f"  ↗ Local search swapped {team_name} ({own_slot[0]}) and {other} ({room_name})")
+        return True
+
+    placed_before = len(placed)
+    honoured_before = sum(1 for team_name, (_, pattern) in placed.items() if honoured(team_name, pattern))
+    steps = 0
+    moves = 0
+    stopped_by = "local_optimum"
+    improved = True
+    while improved and stopped_by == "local_optimum":
+        improved = False
+        candidates = [team_name for team_name, _, _ in teams
+                      if team_name not in placed or not honoured(team_name, placed[team_name][1])]
+        rng.shuffle(candidates)
+        for team_name in candidates:
+            if max_steps is not None and steps >= max_steps:
+                stopped_by = "steps"
+                break
+            if out_of_time():
+                stopped_by = "budget"
+                break
+            if team_name in placed and honoured(team_name, placed[team_name][1]):
+                continue  # Already fixed by an earlier move in this pass
+            moved = try_place(team_name) if team_name not in placed else try_honour(team_name)
+            if moved is None:
+                stopped_by = "budget"  # Cut short mid-step; nothing was changed, so the step does not count
+                break
+            steps += 1
+            if moved:
+                moves += 1
+                improved = True
+
+    rows = [
+        (team_name, room_name, day_mapping[day_label])
+        for team_name, (room_name, pattern) in placed.items() for day_label in pattern
+    ]
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    placed_gain = len(placed) - placed_before
+    honoured_gain = sum(1 for team_name, (_, pattern) in placed.items() if honoured(team_name, pattern)) - honoured_before
+    report = {
+        "steps": steps,
+        "moves": moves,
+        "placed_gain": placed_gain,
+        "honoured_gain": honoured_gain,
+        "elapsed_ms": round(elapsed_ms, 3),
+        "improvement_per_ms": round((placed_gain + honoured_gain) / elapsed_ms, 6) if elapsed_ms else 0.0,
+        "stopped_by": stopped_by,
+    }
+    return rows, placed, [team for team in unplaced_teams if team[0] not in placed], report
+
+
+def allocate_oasis(oasis_config, person_preferences, day_mapping, seats_taken=None, rng=None, shortfall=None,
+                   verbose=True):
+    """
+    Fair Oasis lottery: everyone gets one preferred day first, then remaining
+    seats are filled round-robin.
+
+    A min-heap keyed on (days assigned so far, random tiebreak) always serves
+    the person with the fewest days next, so nobody gets a second day while
+    someone who could still be seated has none. Each pop hands out that
+    person's next preferred day that still has a seat; a full day never
+    reopens, so every preference is looked at once and the whole lottery is a
+    single O(N log N) sweep.
+
+    With shortfall the random tiebreak becomes a weighted draw, so within each
+    round people who missed days in recent weeks tend to be served first.
+
+    Args:
+        oasis_config: {"name": str, "capacity": int}
+        person_preferences: person_name -> [day_label, ...]
+        day_mapping: day label -> date for the week being allocated
+        seats_taken: Optional day label -> seats already occupied before the lottery
+        rng: random.Random used for the heap tiebreaks
+        shortfall: Optional person_name -> Oasis days missed in recent weeks
+        verbose: print the per-person assignment log
+
+    Returns:
+        tuple: (rows, person_name -> [assigned day_label, ...])
+    """
+    log = print if verbose else _silent
+    rng = rng or random.Random()
+    rows = []
+    capacity = oasis_config["capacity"]
+    seats_taken = seats_taken or {}
+    remaining_capacity = {day_label: capacity - seats_taken.get(day_label, 0) for day_label in day_mapping}
+    assignments = {person_name: [] for person_name in person_preferences}
+    next_preference = {person_name: 0 for person_name in person_preferences}
+
+    def tiebreak(person_name):
+        if not shortfall:
+            return rng.random()
+        return -rng.random() ** (1.0 / (1 + shortfall.get(person_name, 0)))
+
+    heap = [(0, tiebreak(person_name), person_name) for person_name, prefs in person_preferences.items() if prefs]
+    heapq.heapify(heap)
+
+    while heap:
+        assigned_count, _, person_name = heapq.heappop(heap)
+        prefs = person_preferences[person_name]
+        position = next_preference[person_name]
+        while position < len(prefs) and (remaining_capacity[prefs[position]] <= 0 or prefs[position] in assignments[person_name]):
+            position += 1
+        if position == len(prefs):
+            continue  # Every remaining preferred day is full or already assigned
+
+        day_label = prefs[position]
+        date_obj = day_mapping[day_label]
+        rows.append((person_name, oasis_config["name"], date_obj))
+        assignments[person_name].append(day_label)
+        remaining_capacity[day_label] -= 1
+        next_preference[person_name] = position + 1
+        log(f"Round {assigned_count + 1}: Assigned {person_name} to {day_label} ({date_obj})")
+
+        if position + 1 < len(prefs):
+            heapq.heappush(heap, (assigned_count + 1, tiebreak(person_name), person_name))
+
+    log("Final Oasis allocation summary:")
+    for day_label, date_obj in day_mapping.items():
+        assigned_count = capacity - remaining_capacity[day_label]
+        log(f"  {day_label} ({date_obj}): {assigned_count}/{capacity} assigned, {remaining_capacity[day_label]} spots available")
+
+    return rows, assignments
+
+
+def allocate_oasis_vectorised(oasis_config, person_preferences, day_mapping, seats_taken=None, rng=None,
+                              shortfall=None, verbose=True):
+    """
+    Matrix version of allocate_oasis for large pools and several shared spaces.
+
+    Preferences become a people x days matrix of preference ranks (its
+    rank < not_wanted view is the boolean wants matrix). Each lottery round draws
+    one random permutation of the people still in play; everyone asks for
+    their best preferred day that is open and not yet theirs, and per day the
+    first `remaining seats` askers in permutation order win. Losers asked for
+    a day that is now full, so they immediately ask for their next open day
+    within the same round; every such sub-round fills at least one day, so a
+    round is at most one sub-round per weekday. Seats a day hands out are
+    spread over the spaces by the cumulative per-space capacity.
+
+    The fairness guarantees are those of allocate_oasis: nobody gets a
+    (k+1)th day while someone who could still be seated has k, the order within
+    a round is a fresh uniform (or shortfall-weighted) lottery, and a full day
+    never reopens. Contention inside a round is resolved for first choices
+    before fallbacks, so for the same seed the two solvers can pick different
+    winners.
+
+    Args:
+        oasis_config: {"name": str, "capacity": int}, or a list of them for several
+            shared spaces pooled per day (filled in list order)
+        person_preferences: person_name -> [day_label, ...]
+        day_mapping: day label -> date for the week being allocated
+        seats_taken: Optional seats occupied before the lottery, keyed by day label
+            (counted against the spaces in order) or by (space name, day label)
+        rng: random.Random the round permutations are derived from
+        shortfall: Optional person_name -> Oasis days missed in recent weeks
+        verbose: print the per-round and per-day summary
+
+    Returns:
+        tuple: (rows, person_name -> [assigned day_label, ...])
+    """
+    if np is None:
+        raise ImportError("The vectorised Oasis solver needs numpy (pip install numpy).")
+    log = print if verbose else _silent
+    rng = rng or random.Random()
+    generator = np.random.default_rng(rng.randrange(2 ** 63))
+    spaces = oasis_config if isinstance(oasis_config, list) else [oasis_config]
+    space_names = [space["name"] for space in spaces]
+    seats_taken = seats_taken or {}
+    day_labels = list(day_mapping)
+    day_index = {day_label: d for d, day_label in enumerate(day_labels)}
+
+    remaining = np.array([[space["capacity"] for _ in day_labels] for space in spaces], dtype=np.int64)
+    for d, day_label in enumerate(day_labels):
+        for s, space in enumerate(spaces):
+            remaining[s, d] -= seats_taken.get((space["name"], day_label), 0)
+        pooled = seats_taken.get(day_label, 0)
+        for s in range(len(spaces)):
+            used = min(pooled, max(int(remaining[s, d]), 0))
+            remaining[s, d] -= used
+            pooled -= used
+    remaining = np.maximum(remaining, 0)
+
+    assignments = {person_name: [] for person_name in person_preferences}
+    people = [person_name for person_name, prefs in person_preferences.items() if prefs]
+    not_wanted = len(day_labels)
+    # Built as plain lists first: element-wise writes into a NumPy array are far slower
+    rank_rows = []
+    for person_name in people:
+        rank_row = [not_wanted] * len(day_labels)
+        for position, day_label in enumerate(person_preferences[person_name]):
+            d = day_index[day_label]
+            rank_row[d] = min(rank_row[d], position)
+        rank_rows.append(rank_row)
+    rank = np.array(rank_rows, dtype=np.int16).reshape(len(people), len(day_labels))
+    assigned = np.zeros(rank.shape, dtype=bool)
+    in_play = rank.min(axis=1, initial=not_wanted) < not_wanted
+    weights = None
+    if shortfall:
+        weights = 1.0 / (1 + np.array([shortfall.get(person_name, 0) for person_name in people], dtype=float))
+
+    rows = []
+    round_number = 0
+    while in_play.any():
+        round_number += 1
+        # Priority of each person in this round's lottery, lower goes first
+        priority = np.empty(len(people), dtype=np.int64)
+        if weights is None:
+            priority[generator.permutation(len(people))] = np.arange(len(people))
+        else:
+            priority[np.argsort(-generator.random(len(people)) ** weights)] = np.arange(len(people))
+        askers = np.flatnonzero(in_play)
+        seated_this_round = 0
+        while askers.size:
+            day_open = remaining.sum(axis=0) > 0
+            asker_rank = np.where(~assigned[askers] & day_open, rank[askers], not_wanted)
+            choice = asker_rank.argmin(axis=1)
+            can_ask = asker_rank[np.arange(askers.size), choice] < not_wanted
+            in_play[askers[~can_ask]] = False  # Every remaining preferred day is full or already theirs
+            askers, choice = askers[can_ask], choice[can_ask]
+
+            order = np.lexsort((priority[askers], choice))
+            askers, choice = askers[order], choice[order]
+            per_day = np.bincount(choice, minlength=len(day_labels))
+            place_in_queue = np.arange(askers.size) - (np.cumsum(per_day) - per_day)[choice]
+            day_remaining = remaining.sum(axis=0)
+            wins = place_in_queue < day_remaining[choice]
+
+            winners, won_days, seat_numbers = askers[wins], choice[wins], place_in_queue[wins]
+            free_before = np.cumsum(remaining, axis=0)  # seats free in spaces 0..s, per day
+            for d in np.unique(won_days):
+                on_day = won_days == d
+                space_of_seat = np.searchsorted(free_before[:, d], seat_numbers[on_day], side="right")
+                day_label, date_obj = day_labels[d], day_mapping[day_labels[d]]
+                for i, s in zip(winners[on_day].tolist(), space_of_seat.tolist()):
+                    rows.append((people[i], space_names[s], date_obj))
+                    assignments[people[i]].append(day_label)
+                remaining[:, d] -= np.bincount(space_of_seat, minlength=len(spaces))
+            assigned[winners, won_days] = True
+            seated_this_round += winners.size
+            askers = askers[~wins]
+        log(f"Round {round_number}: {seated_this_round} seats assigned")
+
+    log("Final Oasis allocation summary:")
+    for d, (day_label, date_obj) in enumerate(day_mapping.items()):
+        total = sum(space["capacity"] for space in spaces)
+        log(f"  {day_label} ({date_obj}): {total - int(remaining[:, d].sum())}/{total} assigned, "
+            f"{int(remaining[:, d].sum())} spots available")
+
+    return rows, assignments
+
+
+def build_allocation_plan(all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mapping,
+                          only=None, solver="greedy", existing_rows=None, seed=None, team_shortfall=None,
+                          person_shortfall=None, improve_budget=None, improve_steps=None, oasis_solver="heap",
+                          deadline=None, verbose=True):
+    """
+    Compute an allocation plan from plain data.
+
+    With existing_rows the plan is incremental: those rows stay in place, the
+    teams and people that own them are not placed again, and everyone else is
+    fitted into the capacity that is left. The plan then only holds new rows.
+
+    Args:
+        all_rooms_config: Parsed rooms.json (list of {"name", "capacity"}, or {"rooms": [...], "day_patterns": [...]})
+        team_preferences_raw: weekly_preferences rows (team_name, team_size, preferred_days)
+        oasis_preferences_raw: oasis_preferences rows (person_name, day_1 ... day_5)
+        day_mapping: day label -> date for the week being allocated
+        only: "project" or "oasis" to plan only that part, None for both
+        solver: "greedy" (size-sorted best fit) or "optimal" (min-cost flow) for project rooms
+        existing_rows: Optional (team_name, room_name, date) rows already allocated this week
+        seed: Seed for the plan's random.Random; a fresh one is drawn (and recorded) when None
+        team_shortfall, person_shortfall: Optional name -> days missed over recent weeks
+            (see history_rollup_rows); when given, the lotteries favour those who missed out
+        improve_budget: Optional seconds of local search (improve_project_placement) after the project solver
+        improve_steps: Optional step limit for that search; also enables it without a time budget
+        oasis_solver: "heap" (allocate_oasis) or "vectorised" (allocate_oasis_vectorised, needs numpy)
+        deadline: Optional time.time() value; the local search is cut short so it ends by then
+        verbose: print the detailed allocation log
+
+    Returns:
+        AllocationPlan
+    """
+    if solver not in PROJECT_SOLVERS:
+        raise ValueError(f"Unknown project solver '{solver}'. Expected one of {PROJECT_SOLVERS}.")
+    if oasis_solver not in OASIS_SOLVERS:
+        raise ValueError(f"Unknown Oasis solver '{oasis_solver}'. Expected one of {OASIS_SOLVERS}.")
+    log = print if verbose else _silent
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    rng = random.Random(seed)
+    plan = AllocationPlan(seed=seed)
+    project_rooms, oasis_config = split_rooms_config(all_rooms_config)
+    day_patterns = day_patterns_from_config(all_rooms_config)
+
+    if not project_rooms and only in [None, "project"]:
+        log("Warning: No project rooms defined in rooms.json or they are malformed.")
+    if not oasis_config and only in [None, "oasis"]:
+        log("Warning: Oasis room configuration not found or malformed in rooms.json. Using default if needed.")
+        oasis_config = {"name": OASIS_ROOM_NAME, "capacity": DEFAULT_OASIS_CAPACITY}
+
+    existing_rows = existing_rows or []
+    existing_project_rows = [row for row in existing_rows if row[1] != OASIS_ROOM_NAME]
+    existing_oasis_rows = [row for row in existing_rows if row[1] == OASIS_ROOM_NAME]
+
+    if only in [None, "project"]:
+        start_time = time.perf_counter()
+        teams = parse_team_preferences(team_preferences_raw, verbose=verbose)
+        already_placed = {team_name for team_name, _, _ in existing_project_rows}
+        teams = [team for team in teams if team[0] not in already_placed]
+        occupied = [(room_name, date_obj) for _, room_name, date_obj in existing_project_rows]
+        allocate = allocate_project_rooms_optimal if solver == "optimal" else allocate_project_rooms
+        plan.project_rows, plan.placed_teams, plan.unplaced_teams = allocate(
+            project_rooms, teams, day_mapping, day_patterns=day_patterns, occupied=occupied, rng=rng,
+            shortfall=team_shortfall, verbose=verbose
+        )
+        plan.timings["project_solve"] = time.perf_counter() - start_time
+        if deadline is not None and (improve_budget is not None or improve_steps is not None):
+            time_left = max(0.0, deadline - time.time())
+            improve_budget = time_left if improve_budget is None else min(improve_budget, time_left)
+        if improve_budget is not None or improve_steps is not None:
+            start_time = time.perf_counter()
+            # Own generator, so the Oasis lottery below draws the same numbers with or without this phase
+            search_rng = random.Random(f"improve:{seed}")
+            plan.project_rows, plan.placed_teams, plan.unplaced_teams, plan.improvement = improve_project_placement(
+                project_rooms, teams, plan.placed_teams, plan.unplaced_teams, day_mapping, day_patterns=day_patterns,
+                occupied=occupied, time_budget=improve_budget, max_steps=improve_steps, rng=search_rng,
+                verbose=verbose
+            )
+            plan.timings["project_improve"] = time.perf_counter() - start_time
+        preferred_days = {team_name: set(pref_labels) for team_name, _, pref_labels in teams}
+        plan.preferences_honoured = sum(
+            1 for team_name, (_, pattern) in plan.placed_teams.items() if set(pattern) == preferred_days[team_name]
+        )
+
+    if only in [None, "oasis"] and oasis_preferences_raw:
+        start_time = time.perf_counter()
+        person_preferences = parse_oasis_preferences(oasis_preferences_raw, day_mapping, verbose=verbose)
+        already_seated = {person_name for person_name, _, _ in existing_oasis_rows}
+        person_preferences = {p: prefs for p, prefs in person_preferences.items() if p not in already_seated}
+        day_by_date = {date_obj: day_label for day_label, date_obj in day_mapping.items()}
+        seats_taken = {}
+        for _, _, date_obj in existing_oasis_rows:
+            if date_obj in day_by_date:
+                seats_taken[day_by_date[date_obj]] = seats_taken.get(day_by_date[date_obj], 0) + 1
+        allocate = allocate_oasis_vectorised if oasis_solver == "vectorised" else allocate_oasis
+        plan.oasis_rows, plan.oasis_assignments = allocate(
+            oasis_config, person_preferences, day_mapping, seats_taken=seats_taken, rng=rng,
+            shortfall=person_shortfall, verbose=verbose
+        )
+        plan.timings["oasis_solve"] = time.perf_counter() - start_time
+
+    return plan
+
+
+def history_rollup_rows(team_preferences_raw, oasis_preferences_raw, week_rows, day_labels, only=None):
+    """
+    Per-owner requested vs allocated days for one week, for allocation_history_rollup.
+
+    Args:
+        team_preferences_raw, oasis_preferences_raw: The preference rows the week was planned from
+        week_rows: Every (team_name, room_name, date) row the run's scope holds after the run
+        day_labels: Day labels of the week (Oasis preferences outside them are ignored)
+        only: "project" or "oasis" to roll up only that part, None for both
+
+    Returns:
+        list of (owner_kind, owner_name, requested_days, allocated_days), owner_kind
+        being "team" or "oasis"
+    """
+    allocated = {}
+    for team_name, room_name, _ in week_rows:
+        key = ("oasis" if room_name == OASIS_ROOM_NAME else "team", team_name)
+        allocated[key] = allocated.get(key, 0) + 1
+    rollup = []
+    if only in [None, "project"]:
+        for team_name, _, pref_labels in parse_team_preferences(team_preferences_raw, verbose=False):
+            rollup.append(("team", team_name, len(pref_labels), allocated.get(("team", team_name), 0)))
+    if only in [None, "oasis"]:
+        for person_name, prefs in parse_oasis_preferences(oasis_preferences_raw, day_labels, verbose=False).items():
+            rollup.append(("oasis", person_name, len(prefs), allocated.get(("oasis", person_name), 0)))
+    return rollup
+
+
+def _as_naive_utc(value):
+    """Compare timestamps from timestamp and timestamptz columns on the same footing."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def split_existing_rows(existing_rows, team_submitted_at, person_submitted_at):
+    """
+    Decide which of this week's allocation rows an incremental run keeps.
+
+    A row goes stale when its owner submitted preferences after it was
+    allocated; everything else (including manual and ad-hoc rows without a
+    matching preference) is kept so confirmations survive.
+
+    Args:
+        existing_rows: (team_name, room_name, date, allocated_at, id) rows for the week
+        team_submitted_at: team_name -> weekly_preferences.submission_time
+        person_submitted_at: person_name -> oasis_preferences.submission_time
+
+    Returns:
+        tuple: (kept_rows as (team_name, room_name, date), stale_rows as (team_name, room_name, date, id))
+    """
+    submitted_at_by_kind = {False: team_submitted_at, True: person_submitted_at}
+    allocated_at_by_owner = {}
+    for team_name, room_name, _, allocated_at, _ in existing_rows:
+        key = (team_name, room_name == OASIS_ROOM_NAME)
+        allocated_at = _as_naive_utc(allocated_at)
+        if allocated_at is not None:
+            earliest = allocated_at_by_owner.get(key)
+            allocated_at_by_owner[key] = allocated_at if earliest is None else min(earliest, allocated_at)
+
+    kept_rows = []
+    stale_rows = []
+    for team_name, room_name, date_obj, _, row_id in existing_rows:
+        key = (team_name, room_name == OASIS_ROOM_NAME)
+        submitted_at = _as_naive_utc(submitted_at_by_kind[key[1]].get(team_name))
+        allocated_at = allocated_at_by_owner.get(key)
+        if submitted_at is not None and allocated_at is not None and submitted_at > allocated_at:
+            stale_rows.append((team_name, room_name, date_obj, row_id))
+        else:
+            kept_rows.append((team_name, room_name, date_obj))
+    return kept_rows, stale_rows
+
+
+def diff_allocation_rows(current_rows, planned_rows):
+    """
+    Compare stored allocation rows with a planned set.
+
+    Rows are matched per (owner, date, Oasis or project room): identical rows
+    are kept, a leftover stored row and a leftover planned row for the same
+    key become a room update, and anything else is a delete or an insert.
+    Stored rows are told apart by id, so a row stored twice and planned once
+    keeps one copy and deletes the other.
+
+    Args:
+        current_rows: (team_name, room_name, date, id) rows stored for the week
+        planned_rows: (team_name, room_name, date) rows of the new plan
+
+    Returns:
+        AllocationDiff
+    """
+    current_by_key = {}
+    for team_name, room_name, date_obj, row_id in current_rows:
+        current_by_key.setdefault((team_name, date_obj, room_name == OASIS_ROOM_NAME), []).append((room_name, row_id))
+    planned_by_key = {}
+    for team_name, room_name, date_obj in planned_rows:
+        planned_by_key.setdefault((team_name, date_obj, room_name == OASIS_ROOM_NAME), []).append(room_name)
+
+    diff = AllocationDiff()
+    for key in dict.fromkeys([*current_by_key, *planned_by_key]):
+        team_name, date_obj, _ = key
+        current = list(current_by_key.get(key, []))
+        new_rooms = []
+        for room_name in planned_by_key.get(key, []):
+            match = next((stored for stored in current if stored[0] == room_name), None)
+            if match is not None:
+                current.remove(match)
+                diff.unchanged += 1
+            else:
+                new_rooms.append(room_name)
+        while current and new_rooms:
+            old_room_name, row_id = current.pop()
+            diff.to_update.append((row_id, team_name, old_room_name, date_obj, new_rooms.pop()))
+        diff.to_delete.extend((row_id, team_name, room_name, date_obj) for room_name, row_id in current)
+        diff.to_insert.extend((team_name, room_name, date_obj) for room_name in new_rooms)
+    return diff
+
+
+def _solve_candidate(seed, args, kwargs):
+    """Process-pool entry point: build one plan with the lottery seeded by `seed`."""
+    return build_allocation_plan(*args, seed=seed, **kwargs)
+
+
+_candidate_inputs = None
+
+
+def _init_candidate_worker(args, kwargs):
+    """Pool initializer: keep the shared inputs in the worker so each task only carries its seed."""
+    global _candidate_inputs
+    _candidate_inputs = (args, kwargs)
+
+
+def _solve_seeded_candidate(seed):
+    args, kwargs = _candidate_inputs
+    return _solve_candidate(seed, args, kwargs)
+
+
+def build_best_of_n_plan(all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mapping,
+                         candidates=8, time_budget=None, max_workers=None, base_seed=None, **kwargs):
+    """
+    Evaluate independently seeded candidate plans in parallel and keep the best.
+
+    Candidates are scored by AllocationPlan.score: placed teams first, then
+    honoured preferences, then the narrowest Oasis fairness spread, then
+    filled Oasis seats.
+
+    Args:
+        candidates: Number of candidate plans to build
+        time_budget: Optional wall-clock limit in seconds. Each candidate gets the
+            deadline, so its local search stops there. When it expires the best
+            finished candidate wins and the worker processes still solving are
+            terminated; only if none has finished yet is the first one to finish awaited.
+        max_workers: Process pool size (defaults to the CPU count)
+        base_seed: Candidate i is seeded with base_seed + i (random when None)
+        **kwargs: Passed on to build_allocation_plan (only, solver, existing_rows, ...)
+
+    Returns:
+        AllocationPlan: the winning plan, with seed, candidates_evaluated and a
+            "candidate_search" timing filled in
+    """
+    if base_seed is None:
+        base_seed = random.randrange(2 ** 31)
+    kwargs["verbose"] = False
+    args = (all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mapping)
+    seeds = [base_seed + i for i in range(candidates)]
+
+    start_time = time.perf_counter()
+    deadline = None if time_budget is None else start_time + time_budget
+    if time_budget is not None:
+        kwargs["deadline"] = time.time() + time_budget
+    results = []
+    finished = queue.Queue()
+    # multiprocessing.Pool rather than ProcessPoolExecutor: leaving the block terminates
+    # candidates that are still solving instead of letting them run on after we return.
+    # The inputs go to each worker once, so no large task is mid-send when the pool is terminated.
+    with multiprocessing.Pool(processes=max_workers, initializer=_init_candidate_worker,
+                              initargs=(args, kwargs)) as pool:
+        for seed in seeds:
+            pool.apply_async(_solve_seeded_candidate, (seed,), callback=finished.put, error_callback=finished.put)
+        while len(results) < candidates:
+            timeout = None if deadline is None or not results else max(0.0, deadline - time.perf_counter())
+            try:
+                outcome = finished.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if isinstance(outcome, BaseException):
+                raise outcome
+            results.append(outcome)
+
+    best_plan = max(results, key=lambda plan: (plan.score(), -plan.seed))
+    best_plan.timings["candidate_search"] = time.perf_counter() - start_time
+    best_plan.candidates_evaluated = len(results)
+    print(f"Best of {len(results)}/{candidates} candidate plans: seed {best_plan.seed}, score {best_plan.score()}")
+    return best_plan
+
+
+def build_multi_week_plans(all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mappings,
+                           existing_rows_by_week=None, max_workers=None, base_seed=None, **kwargs):
+    """
+    Plan several weeks from one set of inputs.
+
+    Weeks share no rooms, dates or seats, so each is an independent
+    build_allocation_plan call; with more than one week and max_workers != 1
+    they are solved on a process pool.
+
+    Args:
+        day_mappings: Monday date -> day label -> date mapping, one per week
+        existing_rows_by_week: Optional Monday date -> existing_rows for incremental weeks
+        max_workers: Process pool size (defaults to the CPU count, 1 solves in-process)
+        base_seed: Week i (in Monday order) is seeded with base_seed + i (random when None)
+        **kwargs: Passed on to build_allocation_plan (only, solver, ...)
+
+    Returns:
+        dict: Monday date -> AllocationPlan, in Monday order
+    """
+    if base_seed is None:
+        base_seed = random.randrange(2 ** 31)
+    kwargs["verbose"] = False
+    existing_rows_by_week = existing_rows_by_week or {}
+    mondays = sorted(day_mappings)
+    jobs = [
+        (base_seed + i, (all_rooms_config, team_preferences_raw, oasis_preferences_raw, day_mappings[monday]),
+         {**kwargs, "existing_rows": existing_rows_by_week.get(monday)})
+        for i, monday in enumerate(mondays)
+    ]
+    if len(jobs) == 1 or max_workers == 1:
+        return {monday: _solve_candidate(*job) for monday, job in zip(mondays, jobs)}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        plans = executor.map(_solve_candidate, *zip(*jobs))
+        return dict(zip(mondays, plans))
+
+
+def plan_digest(plan):
+    """Order-independent SHA-256 of a plan's rows, used to check that a replay reproduced a run."""
+    digest = hashlib.sha256()
+    for team_name, room_name, date_obj in sorted((str(t), str(r), str(d)) for t, r, d in plan.rows):
+        digest.update(f"{team_name}\t{room_name}\t{date_obj}\n".encode())
+    return digest.hexdigest()
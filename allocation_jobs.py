@@ -0,0 +1,283 @@
+"""
+Postgres-backed job queue for allocation runs.
+
+The admin panel only inserts a row into allocation_jobs and gets the job id
+back. A worker process (python allocation_jobs.py) claims queued jobs with
+FOR UPDATE SKIP LOCKED, runs run_allocation and keeps writing the per-phase
+timings into the job row while the run is in progress, so the page can poll
+a job without blocking and a browser refresh cannot kill a run halfway.
+Those writes double as a heartbeat: a running job whose worker has been quiet
+for STALE_JOB_TIMEOUT seconds (the process died or lost its connection) is put
+back in the queue by the next claim, or failed once it has had MAX_JOB_ATTEMPTS.
+
+By default the app runs the same worker as a background thread inside the
+Streamlit process (start_local_worker); deployments that run this module as a
+separate worker switch that off with ALLOCATION_LOCAL_WORKER=false.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from allocate_rooms import parse_week, run_allocation, run_allocation_concurrently
+
+JOB_POLL_INTERVAL = 2.0
+PROGRESS_INTERVAL = 1.0
+# Seconds without a heartbeat after which a running job counts as abandoned
+STALE_JOB_TIMEOUT = 60
+# Claims a job gets before an abandoned run fails it instead of requeueing it
+MAX_JOB_ATTEMPTS = 2
+# run_allocation keyword arguments a job may carry in its options column
+JOB_OPTIONS = ("site", "solver", "seed", "dry_run", "incremental", "candidates", "time_budget", "parallel",
+               "fairness_weeks", "improve_budget", "oasis_solver")
+
+def enqueue_allocation_job(conn, base_monday_date, only=None, options=None, requested_by=None):
+    """
+    Queue an allocation run for a week.
+
+    Args:
+        conn: Open psycopg2 connection; the insert is committed
+        base_monday_date: Monday of the week to allocate
+        only: "project" or "oasis", None for both
+        options: Optional dict of run_allocation options (see JOB_OPTIONS)
+        requested_by: Free-text label shown in the job list
+
+    Returns:
+        int: the job id
+    """
+    options = options or {}
+    unknown = set(options) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown allocation job options: {sorted(unknown)}")
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO allocation_jobs (week, scope, options, status, requested_by, enqueued_at) "
+            "VALUES (%s, %s, %s::jsonb, 'queued', %s, NOW() AT TIME ZONE 'UTC') RETURNING id",
+            (base_monday_date, only or "all", json.dumps(options), requested_by),
+        )
+        job_id = cur.fetchone()[0]
+    conn.commit()
+    return job_id
+
+def get_allocation_jobs(conn, job_ids=None, limit=10):
+    """
+    Fetch jobs by id, or the most recent ones, newest first.
+
+    Returns:
+        list of dicts with the allocation_jobs columns
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if job_ids:
+            cur.execute("SELECT * FROM allocation_jobs WHERE id IN %s ORDER BY id DESC", (tuple(job_ids),))
+        else:
+            cur.execute("SELECT * FROM allocation_jobs ORDER BY id DESC LIMIT %s", (limit,))
+        jobs = [dict(row) for row in cur.fetchall()]
+    conn.commit()
+    return jobs
+
+def recover_stale_jobs(conn, stale_timeout=STALE_JOB_TIMEOUT, max_attempts=MAX_JOB_ATTEMPTS):
+    """
+    Requeue running jobs whose heartbeat is older than stale_timeout seconds.
+
+    A job that has already been claimed max_attempts times is failed instead,
+    so a run that keeps killing its worker does not loop forever. Runs in the
+    caller's transaction; the caller commits.
+
+    Returns:
+        tuple: (requeued job ids, failed job ids)
+    """
+    stale_sql = ("status = 'running' AND COALESCE(heartbeat_at, started_at) "
+                 "< NOW() AT TIME ZONE 'UTC' - %s * INTERVAL '1 second'")
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE allocation_jobs SET status = 'failed', finished_at = NOW() AT TIME ZONE 'UTC', messages = %s::jsonb "
+            f"WHERE {stale_sql} AND attempts >= %s RETURNING id",
+            (json.dumps([f"The worker stopped responding for over {stale_timeout}s on each of {max_attempts} attempts."]),
+             stale_timeout, max_attempts),
+        )
+        failed = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            "UPDATE allocation_jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL "
+            f"WHERE {stale_sql} RETURNING id",
+            (stale_timeout,),
+        )
+        requeued = [row[0] for row in cur.fetchall()]
+    for job_id in requeued:
+        print(f"Allocation job {job_id} had no heartbeat for {stale_timeout}s; requeued")
+    for job_id in failed:
+        print(f"Allocation job {job_id} had no heartbeat for {stale_timeout}s; marked failed")
+    return requeued, failed
+
+def claim_next_job(conn, worker_name, stale_timeout=STALE_JOB_TIMEOUT):
+    """
+    Mark the oldest queued job as running and return it, or None when the queue is empty.
+
+    Abandoned running jobs are recovered first (see recover_stale_jobs), so a job
+    whose worker died is picked up again. SKIP LOCKED lets several workers poll the
+    same table without handing out a job twice.
+    """
+    recover_stale_jobs(conn, stale_timeout)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "UPDATE allocation_jobs SET status = 'running', worker = %s, started_at = NOW() AT TIME ZONE 'UTC', "
+            "heartbeat_at = NOW() AT TIME ZONE 'UTC', attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM allocation_jobs WHERE status = 'queued' ORDER BY id "
+            "            FOR UPDATE SKIP LOCKED LIMIT 1) "
+            "RETURNING id, week, scope, options",
+            (worker_name,),
+        )
+        job = cur.fetchone()
+    conn.commit()
+    return dict(job) if job else None
+
+def _job_result(stats):
+    return {key: stats[key] for key in ("run_id", "joined_run_id", "seed", "rows_written", "rows_deleted",
+                                        "rows_unchanged", "candidates_evaluated", "improvement") if key in stats}
+
+def record_job_progress(conn, job_id, stats):
+    """Write the phases a running job has finished so far, and its heartbeat."""
+    timings = dict(stats.get("timings", {}))
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE allocation_jobs SET timings = %s::jsonb, result = %s::jsonb, "
+            "heartbeat_at = NOW() AT TIME ZONE 'UTC' WHERE id = %s",
+            (json.dumps({phase: round(seconds, 6) for phase, seconds in timings.items()}),
+             json.dumps(_job_result(stats)), job_id),
+        )
+    conn.commit()
+
+def finish_job(conn, job_id, success, messages, stats):
+    """Store a job's final status, timings, result counts and messages."""
+    timings = dict(stats.get("timings", {}))
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE allocation_jobs SET status = %s, finished_at = NOW() AT TIME ZONE 'UTC', "
+            "timings = %s::jsonb, result = %s::jsonb, messages = %s::jsonb WHERE id = %s",
+            ("succeeded" if success else "failed",
+             json.dumps({phase: round(seconds, 6) for phase, seconds in timings.items()}),
+             json.dumps(_job_result(stats)), json.dumps(messages), job_id),
+        )
+    conn.commit()
+
+def run_job(conn, database_url, job):
+    """
+    Run one claimed job and keep its row up to date.
+
+    The allocation runs on a helper thread; this thread flushes the timings
+    run_allocation has recorded so far every PROGRESS_INTERVAL seconds.
+
+    Returns:
+        bool: whether the allocation succeeded
+    """
+    options = dict(job["options"] or {})
+    only = None if job["scope"] == "all" else job["scope"]
+    stats = {"timings": {}}
+    outcome = {}
+
+    def target():
+        if options.pop("parallel", False) and only is None:
+            outcome["result"] = run_allocation_concurrently(database_url, base_monday_date=job["week"], stats=stats,
+                                                            on_conflict="join", **options)
+        else:
+            outcome["result"] = run_allocation(database_url, only=only, base_monday_date=job["week"], stats=stats,
+                                               on_conflict="join", **options)
+
+    allocation_thread = threading.Thread(target=target, name=f"allocation-job-{job['id']}", daemon=True)
+    allocation_thread.start()
+    while allocation_thread.is_alive():
+        allocation_thread.join(PROGRESS_INTERVAL)
+        if allocation_thread.is_alive():
+            record_job_progress(conn, job["id"], stats)
+
+    success, messages = outcome.get("result", (False, ["Allocation thread ended without a result."]))
+    finish_job(conn, job["id"], success, messages, stats)
+    return success
+
+def run_worker(database_url, poll_interval=JOB_POLL_INTERVAL, drain=False, stop_event=None):
+    """
+    Poll allocation_jobs and run queued jobs one at a time.
+
+    Args:
+        database_url: Database connection string
+        poll_interval: Seconds to sleep when the queue is empty
+        drain: Return once the queue is empty instead of polling forever
+        stop_event: Optional threading.Event that stops the loop between jobs
+    """
+    worker_name = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+    print(f"Allocation worker {worker_name} started")
+    conn = None
+    while not (stop_event and stop_event.is_set()):
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(database_url)
+            job = claim_next_job(conn, worker_name)
+            if job is None:
+                if drain:
+                    break
+                time.sleep(poll_interval)
+                continue
+            print(f"[{datetime.now().isoformat(timespec='seconds')}] Running allocation job {job['id']} "
+                  f"({job['scope']}, week of {job['week']})")
+            success = run_job(conn, database_url, job)
+            print(f"Allocation job {job['id']} {'succeeded' if success else 'failed'}")
+        except psycopg2.Error as e:
+            print(f"Allocation worker database error: {e}. Reconnecting in {poll_interval}s.")
+            if conn is not None:
+                conn.close()
+            conn = None
+            time.sleep(poll_interval)
+    if conn is not None:
+        conn.close()
+
+def start_local_worker(database_url, poll_interval=JOB_POLL_INTERVAL):
+    """
+    In-process worker used by the app by default: run_worker on a daemon thread.
+
+    Returns:
+        tuple: (thread, stop_event)
+    """
+    stop_event = threading.Event()
+    worker_thread = threading.Thread(
+        target=run_worker, args=(database_url,), kwargs={"poll_interval": poll_interval, "stop_event": stop_event},
+        name="allocation-local-worker", daemon=True,
+    )
+    worker_thread.start()
+    return worker_thread, stop_event
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued allocation jobs, or queue one.")
+    parser.add_argument("--enqueue", type=parse_week, metavar="WEEK",
+                        help="Queue an allocation for this Monday (YYYY-MM-DD) and exit")
+    parser.add_argument("--only", choices=["project", "oasis"], help="With --enqueue: run only one allocation")
+    parser.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URI"),
+                        help="Database connection string. Defaults to $DATABASE_URL or $SUPABASE_DB_URI.")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("No database URL. Pass --database-url or set DATABASE_URL.")
+
+    if args.enqueue:
+        conn = psycopg2.connect(args.database_url)
+        try:
+            job_id = enqueue_allocation_job(conn, args.enqueue, only=args.only, requested_by="cli")
+        finally:
+            conn.close()
+        print(f"Queued allocation job {job_id}")
+        return 0
+
+    try:
+        run_worker(args.database_url, poll_interval=args.poll_interval, drain=args.drain)
+    except KeyboardInterrupt:
+        print("Allocation worker stopped")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 import streamlit as st
 import psycopg2
 import psycopg2.pool
+import psycopg2.errors
 import json
 import os
+import time
 from datetime import datetime, timedelta, date
 import pytz
 import pandas as pd
-from psycopg2.extras import RealDictCursor
-from allocate_rooms import run_allocation  # Assuming this file exists and is correct
+from allocation_jobs import enqueue_allocation_job, get_allocation_jobs, start_local_worker
+from allocate_rooms import allocation_lock_keys
+from bulk_save import describe_frame_save, save_frame_diff
+from allocation_engine import WEEKDAY_LABELS, day_patterns_from_config, site_names, site_rooms_config, split_rooms_config
 
 # -----------------------------------------------------
 # Configuration and Global Constants
@@ -17,6 +21,11 @@ st.set_page_config(page_title="Weekly Room Allocator Strategy", layout="wide")
 DATABASE_URL = st.secrets.get("SUPABASE_DB_URI", os.environ.get("SUPABASE_DB_URI"))
 OFFICE_TIMEZONE_STR = st.secrets.get("OFFICE_TIMEZONE", os.environ.get("OFFICE_TIMEZONE", "UTC"))
 RESET_PASSWORD = "trainee"  # Consider moving to secrets
+# Queued allocation jobs run on a thread inside this process unless ALLOCATION_LOCAL_WORKER is switched off
+# because a separate worker (python allocation_jobs.py) is deployed
+LOCAL_ALLOCATION_WORKER = str(st.secrets.get("ALLOCATION_LOCAL_WORKER", os.environ.get("ALLOCATION_LOCAL_WORKER", "true"))).lower() not in ("0", "false", "no")
+# A job still queued after this long means no worker is picking jobs up
+STALE_JOB_MINUTES = 2
 
 try:
     OFFICE_TIMEZONE = pytz.timezone(OFFICE_TIMEZONE_STR)
@@ -28,11 +37,26 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOMS_FILE = os.path.join(BASE_DIR, 'rooms.json')
 try:
     with open(ROOMS_FILE, 'r') as f:
-        AVAILABLE_ROOMS = json.load(f)
+        ROOMS_CONFIG = json.load(f)
 except FileNotFoundError:
     st.error(f"Error: {ROOMS_FILE} not found. Please ensure it exists in the application directory.")
-    AVAILABLE_ROOMS = []
-oasis = next((r for r in AVAILABLE_ROOMS if r["name"] == "Oasis"), {"capacity": 20})
+    ROOMS_CONFIG = []
+# A multi-office rooms.json ({"sites": {...}}) gets a site picker, defaulting to OFFICE_SITE. Everything the
+# app reads or writes is then limited to that site; a single-office file leaves SITE None and the site column unused.
+SITES = site_names(ROOMS_CONFIG)
+if SITES == [None]:
+    SITE = None
+else:
+    DEFAULT_SITE = st.secrets.get("OFFICE_SITE", os.environ.get("OFFICE_SITE"))
+    SITE = st.sidebar.selectbox("🏢 Office Site", SITES, index=SITES.index(DEFAULT_SITE) if DEFAULT_SITE in SITES else 0,
+                                key="office_site")
+SITE_ROOMS_CONFIG = site_rooms_config(ROOMS_CONFIG, SITE)
+PROJECT_ROOMS, oasis_config = split_rooms_config(SITE_ROOMS_CONFIG)
+AVAILABLE_ROOMS = PROJECT_ROOMS + ([oasis_config] if oasis_config else [])
+oasis = oasis_config or {"capacity": 20}
+# Bookable project day patterns from rooms.json, and the weekdays they cover
+DAY_PATTERNS = day_patterns_from_config(SITE_ROOMS_CONFIG)
+PROJECT_DAYS = [day for day in WEEKDAY_LABELS if any(day in pattern for pattern in DAY_PATTERNS)]
 
 # -----------------------------------------------------
 # STATIC DATE CONFIGURATION - EDIT THESE VALUES MANUALLY
@@ -40,6 +64,10 @@ oasis = next((r for r in AVAILABLE_ROOMS if r["name"] == "Oasis"), {"capacity":
 # These are the actual date objects used for database operations (you can change these if needed)
 STATIC_PROJECT_MONDAY = date(2024, 5, 27)  # Monday of the week you want to display for project rooms
 STATIC_OASIS_MONDAY = date(2024, 5, 27)    # Monday of the week you want to display for Oasis
+# Seconds between reads of the allocation_version counter that invalidates the cached room grid
+ALLOCATION_VERSION_TTL = 5
+# Seconds an Oasis matrix save waits for a running allocation or another save before asking to try again
+MATRIX_SAVE_LOCK_TIMEOUT = 5
 
 # -----------------------------------------------------
 # Database Connection Pool
@@ -60,6 +88,14 @@ def return_connection(pool, conn):
 
 pool = get_db_connection_pool()
 
+@st.cache_resource
+def get_local_allocation_worker():
+    # One worker thread per Streamlit process, shared by all sessions
+    return start_local_worker(DATABASE_URL)
+
+if LOCAL_ALLOCATION_WORKER and DATABASE_URL:
+    get_local_allocation_worker()
+
 # -----------------------------------------------------
 # Archive/Backup Functions for Data Preservation
 # -----------------------------------------------------
@@ -124,8 +160,8 @@ def create_archive_tables(pool):
     finally:
         return_connection(pool, conn)
 
-def backup_weekly_preferences(pool, deleted_by="admin", deletion_reason="Manual deletion"):
-    """Backup weekly preferences before deletion"""
+def backup_weekly_preferences(pool, deleted_by="admin", deletion_reason="Manual deletion", site=None):
+    """Backup weekly preferences (of one site, if given) before deletion"""
     if not pool: return False
     conn = get_connection(pool)
     if not conn: return False
@@ -136,7 +172,7 @@ def backup_weekly_preferences(pool, deleted_by="admin", deletion_reason="Manual
                 (team_name, contact_person, team_size, preferred_days, submission_time, deleted_by, deletion_reason)
                 SELECT team_name, contact_person, team_size, preferred_days, submission_time, %s, %s
                 FROM weekly_preferences
-            """, (deleted_by, deletion_reason))
+            """ + site_filter(site, "WHERE")[0], (deleted_by, deletion_reason, *site_filter(site)[1]))
             conn.commit()
             return True
     except Exception as e:
@@ -146,8 +182,8 @@ def backup_weekly_preferences(pool, deleted_by="admin", deletion_reason="Manual
     finally:
         return_connection(pool, conn)
 
-def backup_oasis_preferences(pool, deleted_by="admin", deletion_reason="Manual deletion"):
-    """Backup oasis preferences before deletion"""
+def backup_oasis_preferences(pool, deleted_by="admin", deletion_reason="Manual deletion", site=None):
+    """Backup oasis preferences (of one site, if given) before deletion"""
     if not pool: return False
     conn = get_connection(pool)
     if not conn: return False
@@ -160,7 +196,7 @@ def backup_oasis_preferences(pool, deleted_by="admin", deletion_reason="Manual d
                 SELECT person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5,
                        submission_time, %s, %s
                 FROM oasis_preferences
-            """, (deleted_by, deletion_reason))
+            """ + site_filter(site, "WHERE")[0], (deleted_by, deletion_reason, *site_filter(site)[1]))
             conn.commit()
             return True
     except Exception as e:
@@ -268,51 +304,140 @@ if "oasis_display_monday" not in st.session_state:
 # -----------------------------------------------------
 # Database Utility Functions
 # -----------------------------------------------------
+def site_filter(site, keyword="AND", include_unsited=False):
+    """
+    SQL condition limiting a query to one office site, and its parameters. Empty when site is None,
+    so single-site databases never touch the site column.
+
+    include_unsited also matches rows without a site, which allocation runs for every site count as
+    occupied; seat counts use it so the app never books past what a run would see.
+    """
+    if site is None: return "", ()
+    if include_unsited: return f" {keyword} (site = %s OR site IS NULL)", (site,)
+    return f" {keyword} site = %s", (site,)
+
+def build_room_grid(pool, display_monday: date, site=None):
+    """
+    Room x day grid of project allocations in one query: the database joins the week's
+    allocations to their teams' contacts and pivots them by weekday. Raises on rooms.json
+    or database errors.
+    """
+    day_dates = {day: display_monday + timedelta(days=WEEKDAY_LABELS.index(day)) for day in PROJECT_DAYS}
+    with open(ROOMS_FILE) as f: all_rooms = [r["name"] for r in split_rooms_config(site_rooms_config(json.load(f), site))[0]]
+    site_sql, site_params = site_filter(site)
+    columns = ["Room", *day_dates]
+    conn = get_connection(pool)
+    if not conn: return pd.DataFrame([[room, *["Vacant"] * len(day_dates)] for room in all_rooms], columns=columns)
+    day_columns = ", ".join(
+        f"COALESCE(MAX(labelled.label) FILTER (WHERE labelled.date = %s), 'Vacant') AS \"{day}\"" for day in day_dates
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                WITH week AS (
+                    SELECT team_name, room_name, date FROM weekly_allocations
+                    WHERE room_name != 'Oasis' AND date >= %s AND date <= %s{site_sql}
+                ), contacts AS (
+                    SELECT DISTINCT ON (team_name) team_name, contact_person FROM weekly_preferences
+                    WHERE team_name IN (SELECT team_name FROM week){site_sql}
+                    ORDER BY team_name, submission_time DESC
+                ), labelled AS (
+                    SELECT week.room_name, week.date,
+                           CASE WHEN contacts.contact_person <> '' THEN week.team_name || ' (' || contacts.contact_person || ')'
+                                ELSE week.team_name END AS label
+                    FROM week LEFT JOIN contacts ON contacts.team_name = week.team_name
+                )
+                SELECT rooms.room_name, {day_columns}
+                FROM unnest(%s::text[]) WITH ORDINALITY AS rooms(room_name, position)
+                LEFT JOIN labelled ON labelled.room_name = rooms.room_name
+                GROUP BY rooms.room_name, rooms.position
+                ORDER BY rooms.position
+            """, (min(day_dates.values()), max(day_dates.values()), *site_params, *site_params, *day_dates.values(), all_rooms))
+            return pd.DataFrame(cur.fetchall(), columns=columns)
+    finally: return_connection(pool, conn)
+
+@st.cache_data(ttl=ALLOCATION_VERSION_TTL, show_spinner=False)
+def get_allocation_version():
+    """Current allocation_version counter, read at most once per TTL for all sessions. None when unavailable."""
+    if not pool: return None
+    conn = get_connection(pool)
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM allocation_version WHERE id = 1")
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except psycopg2.Error:
+        conn.rollback()  # No counter (migrate_allocation_schema.sql not applied yet): the grid is simply not cached
+        return None
+    finally: return_connection(pool, conn)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def load_room_grid(display_monday: date, allocation_version: int, site=None):
+    """build_room_grid shared by all sessions; a new allocation_version makes a new cache entry."""
+    return build_room_grid(pool, display_monday, site)
+
 def get_room_grid(pool, display_monday: date):
     if not pool: return pd.DataFrame()
-    this_monday = display_monday
-    day_mapping = {
-        this_monday + timedelta(days=0): "Monday", this_monday + timedelta(days=1): "Tuesday",
-        this_monday + timedelta(days=2): "Wednesday", this_monday + timedelta(days=3): "Thursday"
-    }
-    day_labels = list(day_mapping.values())
+    allocation_version = get_allocation_version()
     try:
-        with open(ROOMS_FILE) as f: all_rooms = [r["name"] for r in json.load(f) if r["name"] != "Oasis"]
+        if allocation_version is None:
+            return build_room_grid(pool, display_monday, SITE)
+        return load_room_grid(display_monday, allocation_version, SITE)
     except (FileNotFoundError, json.JSONDecodeError):
         st.error(f"Error: Could not load valid data from {ROOMS_FILE}.")
         return pd.DataFrame()
-    grid = {room: {**{"Room": room}, **{day: "Vacant" for day in day_labels}} for room in all_rooms}
+    except psycopg2.Error as e:
+        st.warning(f"Database error while getting room grid: {e}")
+        return pd.DataFrame([{"Room": room["name"], **{day: "Vacant" for day in PROJECT_DAYS}} for room in PROJECT_ROOMS])
+
+def queue_allocation(pool, only, week):
     conn = get_connection(pool)
-    if not conn: return pd.DataFrame(grid.values())
+    if not conn:
+        st.error("No DB connection")
+        return None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            start_date, end_date = this_monday, this_monday + timedelta(days=3) 
-            cur.execute("""
-                SELECT team_name, room_name, date FROM weekly_allocations
-                WHERE room_name != 'Oasis' AND date >= %s AND date <= %s
-            """, (start_date, end_date))
-            allocations = cur.fetchall()
-            cur.execute("SELECT team_name, contact_person FROM weekly_preferences") 
-            contacts = {row["team_name"]: row["contact_person"] for row in cur.fetchall()}
-        for row in allocations:
-            team, room, date_val = row["team_name"], row["room_name"], row["date"]
-            day = day_mapping.get(date_val)
-            if room not in grid or not day: continue
-            contact = contacts.get(team)
-            grid[room][day] = f"{team} ({contact})" if contact else team
-        return pd.DataFrame(grid.values())
+        return enqueue_allocation_job(conn, week, only=only, options={"site": SITE} if SITE else None,
+                                      requested_by="admin panel")
     except psycopg2.Error as e:
-        st.warning(f"Database error while getting room grid: {e}")
-        return pd.DataFrame(grid.values())
+        st.error(f"❌ Failed to queue allocation: {e}")
+        conn.rollback()
+        return None
     finally: return_connection(pool, conn)
 
+def get_allocation_jobs_df(pool, limit=10):
+    if not pool: return pd.DataFrame()
+    conn = get_connection(pool)
+    if not conn: return pd.DataFrame()
+    try:
+        jobs = get_allocation_jobs(conn, limit=limit)
+    except psycopg2.Error as e:
+        st.warning(f"Failed to fetch allocation jobs: {e}")
+        conn.rollback()
+        return pd.DataFrame()
+    finally: return_connection(pool, conn)
+    return pd.DataFrame([{
+        "Job": job["id"],
+        "Week": job["week"],
+        "Scope": job["scope"] + (f" ({job['options']['site']})" if (job["options"] or {}).get("site") else ""),
+        "Status": job["status"],
+        "Queued At": job["enqueued_at"],
+        "Started At": job["started_at"],
+        "Finished At": job["finished_at"],
+        "Phase Timings": ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in (job["timings"] or {}).items()),
+        "Rows Written": (job["result"] or {}).get("rows_written"),
+        "Messages": "; ".join(job["messages"] or []),
+    } for job in jobs])
+
 def get_preferences(pool):
     if not pool: return pd.DataFrame()
     conn = get_connection(pool)
     if not conn: return pd.DataFrame()
+    site_sql, site_params = site_filter(SITE, "WHERE")
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT team_name, contact_person, team_size, preferred_days, submission_time FROM weekly_preferences ORDER BY submission_time DESC")
+            cur.execute(f"SELECT team_name, contact_person, team_size, preferred_days, submission_time FROM weekly_preferences{site_sql} ORDER BY submission_time DESC", site_params)
             rows = cur.fetchall()
             return pd.DataFrame(rows, columns=["Team", "Contact", "Size", "Days", "Submitted At"])
     except Exception as e:
@@ -324,9 +449,10 @@ def get_oasis_preferences(pool):
     if not pool: return pd.DataFrame()
     conn = get_connection(pool)
     if not conn: return pd.DataFrame()
+    site_sql, site_params = site_filter(SITE, "WHERE")
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time FROM oasis_preferences ORDER BY submission_time DESC")
+            cur.execute(f"SELECT person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time FROM oasis_preferences{site_sql} ORDER BY submission_time DESC", site_params)
             rows = cur.fetchall()
             return pd.DataFrame(rows, columns=["Person", "Day 1", "Day 2", "Day 3", "Day 4", "Day 5", "Submitted At"])
     except Exception as e:
@@ -334,6 +460,30 @@ def get_oasis_preferences(pool):
         return pd.DataFrame()
     finally: return_connection(pool, conn)
 
+# Admin editor columns for bulk_save: (frame column, table column, SQL type)
+TEAM_PREFERENCE_COLUMNS = [("Team", "team_name", "text"), ("Contact", "contact_person", "text"), ("Size", "team_size", "integer"),
+                           ("Days", "preferred_days", "text"), ("Submitted At", "submission_time", "timestamp")]
+OASIS_PREFERENCE_COLUMNS = [("Person", "person_name", "text"), *((f"Day {i}", f"preferred_day_{i}", "text") for i in range(1, 6)),
+                            ("Submitted At", "submission_time", "timestamp")]
+PROJECT_ALLOCATION_COLUMNS = [("Room", "room_name", "text"), ("Date", "date", "date"), ("Team", "team_name", "text")]
+SUBMISSION_TIME_DEFAULT = {"submission_time": "NOW() AT TIME ZONE 'UTC'"}
+# Inserted editor rows belong to the selected site, and saves only touch that site's rows
+SITE_COLUMN = {"site": SITE} if SITE else None
+
+def room_grid_cells(grid_df, display_monday):
+    """
+    Unpivot a room grid (Room x project day labels) into one Room/Date/Team row per occupied cell.
+
+    Labels are "Team (Contact)"; only the team name is kept. Vacant and empty cells are dropped.
+    """
+    day_columns = [day for day in PROJECT_DAYS if day in grid_df.columns]
+    cells = grid_df.melt(id_vars=["Room"], value_vars=day_columns, var_name="Day", value_name="Label")
+    cells["Team"] = cells["Label"].where(cells["Label"].notna(), "").astype(str).str.split("(").str[0].str.strip()
+    cells = cells[(cells["Team"] != "") & (cells["Label"] != "Vacant") & cells["Room"].notna()]
+    cells["Room"] = cells["Room"].astype(str)
+    cells["Date"] = cells["Day"].map(lambda day: display_monday + timedelta(days=WEEKDAY_LABELS.index(day)))
+    return cells[["Room", "Date", "Team"]]
+
 # -----------------------------------------------------
 # Insert / Update Functions
 # -----------------------------------------------------
@@ -347,21 +497,28 @@ def insert_preference(pool, team, contact, size, days):
         return False
     conn = get_connection(pool)
     if not conn: return False
+    site_sql, site_params = site_filter(SITE)
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT 1 FROM weekly_preferences WHERE team_name = %s", (team,))
+            cur.execute(f"SELECT 1 FROM weekly_preferences WHERE team_name = %s{site_sql}", (team, *site_params))
             if cur.fetchone():
                 st.error(f"❌ Team '{team}' has already submitted a preference. Contact admin to change.")
                 return False
             new_days_set = set(days.split(','))
-            valid_pairs = [set(["Monday", "Wednesday"]), set(["Tuesday", "Thursday"])]
-            if new_days_set not in valid_pairs:
-                st.error("❌ Invalid day selection. Must select Monday & Wednesday or Tuesday & Thursday.")
+            valid_patterns = [set(pattern) for pattern in DAY_PATTERNS]
+            if new_days_set not in valid_patterns:
+                st.error(f"❌ Invalid day selection. Must select one of: {', '.join(' & '.join(p) for p in DAY_PATTERNS)}.")
                 return False
-            cur.execute(
-                "INSERT INTO weekly_preferences (team_name, contact_person, team_size, preferred_days, submission_time) VALUES (%s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')",
-                (team, contact, size, days)
-            )
+            if SITE is None:
+                cur.execute(
+                    "INSERT INTO weekly_preferences (team_name, contact_person, team_size, preferred_days, submission_time) VALUES (%s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')",
+                    (team, contact, size, days)
+                )
+            else:
+                cur.execute(
+                    "INSERT INTO weekly_preferences (team_name, contact_person, team_size, preferred_days, submission_time, site) VALUES (%s, %s, %s, %s, NOW() AT TIME ZONE 'UTC', %s)",
+                    (team, contact, size, days, SITE)
+                )
             conn.commit()
             return True
     except psycopg2.Error as e:
@@ -380,17 +537,24 @@ def insert_oasis(pool, person, selected_days):
         return False
     conn = get_connection(pool)
     if not conn: return False
+    site_sql, site_params = site_filter(SITE)
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT 1 FROM oasis_preferences WHERE person_name = %s", (person,))
+            cur.execute(f"SELECT 1 FROM oasis_preferences WHERE person_name = %s{site_sql}", (person, *site_params))
             if cur.fetchone():
                 st.error("❌ You've already submitted. Contact admin to change your selection.")
                 return False
             padded_days = selected_days + [None] * (5 - len(selected_days))
-            cur.execute(
-                "INSERT INTO oasis_preferences (person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time) VALUES (%s, %s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')",
-                (person.strip(), *padded_days)
-            )
+            if SITE is None:
+                cur.execute(
+                    "INSERT INTO oasis_preferences (person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time) VALUES (%s, %s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')",
+                    (person.strip(), *padded_days)
+                )
+            else:
+                cur.execute(
+                    "INSERT INTO oasis_preferences (person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time, site) VALUES (%s, %s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC', %s)",
+                    (person.strip(), *padded_days, SITE)
+                )
             conn.commit()
             return True
     except psycopg2.Error as e:
@@ -399,6 +563,106 @@ def insert_oasis(pool, person, selected_days):
         return False
     finally: return_connection(pool, conn)
 
+def save_oasis_matrix_diff(conn, monday, day_dates, loaded_matrix, edited_matrix, capacity, site=None,
+                           lock_timeout=MATRIX_SAVE_LOCK_TIMEOUT):
+    """
+    Write only the Oasis matrix cells the admin changed, as one statement batch.
+
+    Cells that were unticked are deleted. Cells that stay ticked are confirmed where
+    they were not yet, so rows that were already confirmed keep their confirmed_at.
+    Newly ticked cells go in through one INSERT ... SELECT that ranks them per day
+    (Bud first) and skips any that would take the day past capacity, counted on the
+    server after the deletes. A newly ticked cell whose row another session added
+    since the matrix was loaded is confirmed instead of inserted twice. The week's
+    Oasis advisory lock serialises the save with other saves and with allocation runs;
+    waiting for it longer than lock_timeout seconds raises psycopg2.errors.LockNotAvailable.
+    With a site, only that site's rows are changed and new rows are tagged with it;
+    the capacity count also includes rows without a site, as allocation runs do.
+
+    Args:
+        conn: Open connection; the caller commits
+        monday: Monday of the displayed week
+        day_dates: weekday name -> date for the matrix columns
+        loaded_matrix: person x weekday booleans as loaded from weekly_allocations
+        edited_matrix: The same matrix after editing
+        capacity: Oasis seats per day
+        site: Office site of the matrix, or None for a single-site database
+        lock_timeout: Seconds to wait for the week's locks
+
+    Returns:
+        dict: "inserted", "deleted" and "kept" cell counts ("kept" includes rows found already booked),
+            and the "rejected" (name, weekday) cells
+    """
+    loaded = loaded_matrix.reindex(index=edited_matrix.index, columns=edited_matrix.columns, fill_value=False).astype(bool)
+    edited = edited_matrix.astype(bool)
+
+    def cells(mask):
+        stacked = mask.stack()
+        return [(name, day_dates[day]) for name, day in stacked[stacked].index]
+
+    removed = cells(loaded & ~edited)
+    kept = cells(loaded & edited)
+    added = sorted(cells(edited & ~loaded), key=lambda cell: cell[0] != "Bud")
+    with conn.cursor() as cur:
+        # The same keys a run for this site takes, so the save waits for it and for whole-database runs
+        statements = [cur.mogrify("SET LOCAL lock_timeout = %s", (f"{lock_timeout}s",))] + [
+            cur.mogrify(f"SELECT pg_advisory_xact_lock{'_shared' if shared else ''}(%s, %s)", (lock_class, lock_key))
+            for lock_class, lock_key, shared in allocation_lock_keys(monday, "oasis", site)
+        ]
+        site_sql = cur.mogrify(" AND w.site = %s", (site,)) if site is not None else b""
+        counted_sql = cur.mogrify(" AND (w.site = %s OR w.site IS NULL)", (site,)) if site is not None else b""
+        if removed:
+            values = b",".join(cur.mogrify("(%s, %s::date)", cell) for cell in removed)
+            statements.append(
+                b"DELETE FROM weekly_allocations w USING (VALUES " + values + b") AS d(team_name, date) "
+                b"WHERE w.room_name = 'Oasis' AND w.team_name = d.team_name AND w.date = d.date" + site_sql
+            )
+        if kept:
+            values = b",".join(cur.mogrify("(%s, %s::date)", cell) for cell in kept)
+            statements.append(
+                b"UPDATE weekly_allocations w SET confirmed = TRUE, confirmed_at = NOW() "
+                b"FROM (VALUES " + values + b") AS k(team_name, date) "
+                b"WHERE w.room_name = 'Oasis' AND w.team_name = k.team_name AND w.date = k.date AND w.confirmed IS NOT TRUE"
+                + site_sql
+            )
+        if added:
+            values = b",".join(cur.mogrify("(%s, %s::date, %s)", (*cell, position)) for position, cell in enumerate(added))
+            statements.append(
+                b"WITH requested AS ("
+                b"    SELECT a.team_name, a.date, a.position, EXISTS ("
+                b"        SELECT 1 FROM weekly_allocations w WHERE w.room_name = 'Oasis' AND w.team_name = a.team_name AND w.date = a.date"
+                + site_sql +
+                b"    ) AS booked FROM (VALUES " + values + b") AS a(team_name, date, position)"
+                b"), ranked AS ("
+                b"    SELECT r.*, ROW_NUMBER() OVER (PARTITION BY r.date, r.booked ORDER BY r.position) AS place,"
+                b"           (SELECT COUNT(*) FROM weekly_allocations w WHERE w.room_name = 'Oasis' AND w.date = r.date"
+                + counted_sql + b") AS taken"
+                b"    FROM requested r"
+                b"), confirmed AS ("
+                b"    UPDATE weekly_allocations w SET confirmed = TRUE, confirmed_at = NOW() FROM ranked r"
+                b"    WHERE r.booked AND w.room_name = 'Oasis' AND w.team_name = r.team_name AND w.date = r.date"
+                b"    AND w.confirmed IS NOT TRUE" + site_sql +
+                b"), inserted AS ("
+                b"    INSERT INTO weekly_allocations (team_name, room_name, date, confirmed, confirmed_at"
+                + (b", site" if site is not None else b"") + b")"
+                b"    SELECT team_name, 'Oasis', date, TRUE, NOW()"
+                + (cur.mogrify(", %s", (site,)) if site is not None else b"") + b" FROM ranked "
+                + cur.mogrify("WHERE NOT booked AND (team_name = 'Bud' OR taken + place <= %s)", (capacity,)) +
+                b"    RETURNING team_name, date"
+                b") SELECT r.team_name, r.date, r.booked, i.team_name IS NOT NULL FROM ranked r "
+                b"LEFT JOIN inserted i ON i.team_name = r.team_name AND i.date = r.date"
+            )
+        cur.execute(b";\n".join(statements))
+        outcomes = cur.fetchall() if added else []
+    day_names = {date_obj: day for day, date_obj in day_dates.items()}
+    return {
+        "inserted": sum(1 for _, _, _, was_inserted in outcomes if was_inserted),
+        "deleted": len(removed),
+        "kept": len(kept) + sum(1 for _, _, booked, _ in outcomes if booked),
+        "rejected": [(name, day_names[date_obj]) for name, date_obj, booked, was_inserted in outcomes
+                     if not booked and not was_inserted],
+    }
+
 # -----------------------------------------------------
 # Streamlit App UI
 # -----------------------------------------------------
@@ -411,10 +675,10 @@ with col2:
         st.switch_page("pages/3_Historical_Analytics.py")
 
 st.info(
-    """
+    f"""
     💡 **How This Works:**
     
-    - 🧑‍🤝‍🧑 Project teams can select **either Monday & Wednesday** or **Tuesday & Thursday**. **Friday** is (for now) flexible. 
+    - 🧑‍🤝‍🧑 Project teams can select **{"** or **".join(" & ".join(pattern) for pattern in DAY_PATTERNS)}**. 
       There are 4 rooms for 4 persons.
     - 🌿 Oasis users can choose **up to 5 preferred weekdays**, and will be randomly assigned—fairness is guaranteed. 
       There are 16 places in the Oasis.
@@ -521,31 +785,30 @@ with st.expander("🔐 Admin Controls"):
 
         st.subheader("🧠 Project Room Admin")
         if st.button("🚀 Run Project Room Allocation", key="btn_run_proj_alloc"):
-            if run_allocation:
-                # Pass the static Monday date to the allocation function
-                success, _ = run_allocation(DATABASE_URL, only="project", base_monday_date=st.session_state.project_rooms_display_monday) 
-
-                if success:
-                    st.success(f"✅ Project room allocation completed.")
-                    st.rerun()
-                else:
-                    st.error("❌ Project room allocation failed.")
-            else:
-                st.error("run_allocation function not available.")
+            # Queue the run for the allocation worker so this page does not block on it
+            job_id = queue_allocation(pool, "project", st.session_state.project_rooms_display_monday)
+            if job_id:
+                st.success(f"✅ Project room allocation queued as job {job_id}. Track it under Allocation Jobs below.")
 
         st.subheader("🌿 Oasis Admin")
         if st.button("🎲 Run Oasis Allocation", key="btn_run_oasis_alloc"):
-            if run_allocation:
-                # Pass the static Monday date to the allocation function
-                success, _ = run_allocation(DATABASE_URL, only="oasis", base_monday_date=st.session_state.oasis_display_monday) 
+            job_id = queue_allocation(pool, "oasis", st.session_state.oasis_display_monday)
+            if job_id:
+                st.success(f"✅ Oasis allocation queued as job {job_id}. Track it under Allocation Jobs below.")
 
-                if success:
-                    st.success(f"✅ Oasis allocation completed.")
-                    st.rerun()
-                else:
-                    st.error("❌ Oasis allocation failed.")
-            else:
-                st.error("run_allocation function not available.")
+        st.subheader("📋 Allocation Jobs")
+        if not LOCAL_ALLOCATION_WORKER:
+            st.caption("Jobs are run by the external allocation worker (`python allocation_jobs.py`).")
+        st.button("🔄 Refresh Job Status", key="btn_refresh_alloc_jobs")
+        jobs_df = get_allocation_jobs_df(pool)
+        if not jobs_df.empty:
+            stale_cutoff = datetime.now(pytz.utc).replace(tzinfo=None) - timedelta(minutes=STALE_JOB_MINUTES)
+            if ((jobs_df["Status"] == "queued") & (pd.to_datetime(jobs_df["Queued At"]) < stale_cutoff)).any():
+                st.warning(f"⚠️ Some jobs have been queued for over {STALE_JOB_MINUTES} minutes. Check that an allocation "
+                           "worker is running, or remove ALLOCATION_LOCAL_WORKER=false so the app runs jobs itself.")
+            st.dataframe(jobs_df, use_container_width=True, hide_index=True)
+        else:
+            st.info("No allocation jobs yet.")
 
         st.subheader("📌 Project Room Allocations (Admin Edit)")
         try:
@@ -558,22 +821,15 @@ with st.expander("🔐 Admin Controls"):
                     if not conn_admin_alloc: st.error("No DB connection")
                     else:
                         try:
-                            with conn_admin_alloc.cursor() as cur:
-                                week_start_date = current_proj_display_mon
-                                week_end_date = current_proj_display_mon + timedelta(days=3) 
-                                cur.execute("DELETE FROM weekly_allocations WHERE room_name != 'Oasis' AND date >= %s AND date <= %s", (week_start_date, week_end_date))
-                                day_indices = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3}
-                                for _, row in editable_alloc_proj.iterrows(): 
-                                    for day_name, day_idx in day_indices.items():
-                                        value = row.get(day_name, "")
-                                        if value and value != "Vacant":
-                                            team_info = str(value).split("(")[0].strip()
-                                            room_name_val = str(row["Room"]) if pd.notnull(row["Room"]) else None
-                                            alloc_date = current_proj_display_mon + timedelta(days=day_idx)
-                                            if team_info and room_name_val:
-                                                cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (%s, %s, %s)", (team_info, room_name_val, alloc_date))
+                            save_result = save_frame_diff(
+                                conn_admin_alloc, "weekly_allocations", PROJECT_ALLOCATION_COLUMNS, ["Room", "Date"],
+                                room_grid_cells(alloc_df_admin, current_proj_display_mon),
+                                room_grid_cells(editable_alloc_proj, current_proj_display_mon),
+                                scope_sql=b" AND t.room_name != 'Oasis'", fixed=SITE_COLUMN,
+                            )
                             conn_admin_alloc.commit()
-                            st.success(f"✅ Manual project room allocations updated.")
+                            get_allocation_version.clear()  # Show the edit now rather than after the version TTL
+                            st.success(f"✅ Manual project room allocations updated: {describe_frame_save(save_result)}.")
                             st.rerun()
                         except Exception as e:
                             st.error(f"❌ Failed to save project room allocations: {e}")
@@ -591,8 +847,11 @@ with st.expander("🔐 Admin Controls"):
                 try:
                     with conn_reset_pra.cursor() as cur:
                         mon_to_reset = st.session_state.project_rooms_display_monday
-                        cur.execute("DELETE FROM weekly_allocations WHERE room_name != 'Oasis' AND date >= %s AND date <= %s", (mon_to_reset, mon_to_reset + timedelta(days=6))) 
+                        site_sql, site_params = site_filter(SITE)
+                        cur.execute("DELETE FROM weekly_allocations WHERE room_name != 'Oasis' AND date >= %s AND date <= %s" + site_sql,
+                                    (mon_to_reset, mon_to_reset + timedelta(days=6), *site_params))
                         conn_reset_pra.commit()
+                        get_allocation_version.clear()
                         st.success(f"✅ Project room allocations removed.")
                         st.rerun()
                 except Exception as e: 
@@ -616,14 +875,16 @@ with st.expander("🔐 Admin Controls"):
             with col1:
                 if st.button("✅ Yes, Delete All Preferences", key="btn_confirm_delete_proj_prefs"):
                     # First backup the data
-                    backup_success = backup_weekly_preferences(pool, "admin", "Manual deletion via admin panel")
+                    backup_success = backup_weekly_preferences(pool, "admin", "Manual deletion via admin panel", SITE)
                     
                     conn_reset_prp = get_connection(pool)
                     if conn_reset_prp:
                         try:
                             with conn_reset_prp.cursor() as cur:
-                                cur.execute("DELETE FROM weekly_preferences")
+                                site_sql, site_params = site_filter(SITE, "WHERE")
+                                cur.execute("DELETE FROM weekly_preferences" + site_sql, site_params)
                                 conn_reset_prp.commit()
+                                get_allocation_version.clear()
                                 if backup_success:
                                     st.success("✅ All project room preferences removed and backed up to archive.")
                                 else:
@@ -649,7 +910,9 @@ with st.expander("🔐 Admin Controls"):
                 try:
                     with conn_reset_oa.cursor() as cur:
                         mon_to_reset = st.session_state.oasis_display_monday
-                        cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND date >= %s AND date <= %s", (mon_to_reset, mon_to_reset + timedelta(days=6))) 
+                        site_sql, site_params = site_filter(SITE)
+                        cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND date >= %s AND date <= %s" + site_sql,
+                                    (mon_to_reset, mon_to_reset + timedelta(days=6), *site_params))
                         conn_reset_oa.commit()
                         st.success(f"✅ Oasis allocations removed.")
                         st.rerun()
@@ -674,13 +937,14 @@ with st.expander("🔐 Admin Controls"):
             with col1:
                 if st.button("✅ Yes, Delete All Preferences", key="btn_confirm_delete_oasis_prefs"):
                     # First backup the data
-                    backup_success = backup_oasis_preferences(pool, "admin", "Manual deletion via admin panel")
+                    backup_success = backup_oasis_preferences(pool, "admin", "Manual deletion via admin panel", SITE)
                     
                     conn_reset_op = get_connection(pool)
                     if conn_reset_op:
                         try:
                             with conn_reset_op.cursor() as cur:
-                                cur.execute("DELETE FROM oasis_preferences")
+                                site_sql, site_params = site_filter(SITE, "WHERE")
+                                cur.execute("DELETE FROM oasis_preferences" + site_sql, site_params)
                                 conn_reset_op.commit()
                                 if backup_success:
                                     st.success("✅ All Oasis preferences removed and backed up to archive.")
@@ -707,14 +971,11 @@ with st.expander("🔐 Admin Controls"):
                 conn_admin_tp = get_connection(pool)
                 if conn_admin_tp:
                     try:
-                        with conn_admin_tp.cursor() as cur:
-                            cur.execute("DELETE FROM weekly_preferences")
-                            for _, row in editable_team_df.iterrows():
-                                sub_time = row.get("Submitted At", datetime.now(pytz.utc))
-                                if pd.isna(sub_time) or sub_time is None: sub_time = datetime.now(pytz.utc)
-                                cur.execute("INSERT INTO weekly_preferences (team_name, contact_person, team_size, preferred_days, submission_time) VALUES (%s, %s, %s, %s, %s)",
-                                            (row["Team"], row["Contact"], int(row["Size"]), row["Days"], sub_time) )
-                            conn_admin_tp.commit(); st.success("✅ Team preferences updated."); st.rerun()
+                        save_result = save_frame_diff(conn_admin_tp, "weekly_preferences", TEAM_PREFERENCE_COLUMNS, ["Team"],
+                                                      df_team_prefs_admin, editable_team_df, defaults=SUBMISSION_TIME_DEFAULT,
+                                                      fixed=SITE_COLUMN)
+                        conn_admin_tp.commit(); get_allocation_version.clear()
+                        st.success(f"✅ Team preferences updated: {describe_frame_save(save_result)}."); st.rerun()
                     except Exception as e: st.error(f"❌ Failed to update team preferences: {e}"); conn_admin_tp.rollback()
                     finally: return_connection(pool, conn_admin_tp)
         else: st.info("No team preferences submitted yet to edit.")
@@ -728,14 +989,11 @@ with st.expander("🔐 Admin Controls"):
                 conn_admin_op = get_connection(pool)
                 if conn_admin_op:
                     try:
-                        with conn_admin_op.cursor() as cur:
-                            cur.execute("DELETE FROM oasis_preferences")
-                            for _, row in editable_oasis_df_prefs.iterrows():
-                                sub_time = row.get("Submitted At", datetime.now(pytz.utc))
-                                if pd.isna(sub_time) or sub_time is None: sub_time = datetime.now(pytz.utc)
-                                cur.execute("INSERT INTO oasis_preferences (person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5, submission_time) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                                            (row["Person"], row.get("Day 1"), row.get("Day 2"), row.get("Day 3"), row.get("Day 4"), row.get("Day 5"), sub_time))
-                            conn_admin_op.commit(); st.success("✅ Oasis preferences updated."); st.rerun()
+                        save_result = save_frame_diff(conn_admin_op, "oasis_preferences", OASIS_PREFERENCE_COLUMNS, ["Person"],
+                                                      df_oasis_prefs_admin[cols_to_display], editable_oasis_df_prefs,
+                                                      defaults=SUBMISSION_TIME_DEFAULT, fixed=SITE_COLUMN)
+                        conn_admin_op.commit()
+                        st.success(f"✅ Oasis preferences updated: {describe_frame_save(save_result)}."); st.rerun()
                     except Exception as e: st.error(f"❌ Failed to update oasis preferences: {e}"); conn_admin_op.rollback()
                     finally: return_connection(pool, conn_admin_op)
         else: st.info("No oasis preferences submitted yet to edit.")
@@ -757,14 +1015,11 @@ with st.form("team_form_main"):
     team_name = st.text_input("Team Name", key="tf_team_name")
     contact_person = st.text_input("Contact Person", key="tf_contact_person")
     team_size = st.number_input("Team Size (3-4)", min_value=3, max_value=4, value=3, key="tf_team_size")
-    day_choice = st.selectbox("Preferred Days", ["Monday and Wednesday", "Tuesday and Thursday"], key="tf_day_choice")
+    day_map = {" and ".join(pattern): ",".join(pattern) for pattern in DAY_PATTERNS}
+    day_choice = st.selectbox("Preferred Days", list(day_map), key="tf_day_choice")
     submit_team_pref = st.form_submit_button("Submit Project Room Request")
 
     if submit_team_pref:
-        day_map = {
-            "Monday and Wednesday": "Monday,Wednesday",
-            "Tuesday and Thursday": "Tuesday,Thursday"
-        }
         if insert_preference(pool, team_name, contact_person, team_size, day_map[day_choice]):
             st.success(f"✅ Preference submitted for {team_name}!")
             st.rerun()
@@ -831,22 +1086,30 @@ with st.form("oasis_add_form_main"):
                     with conn_adhoc.cursor() as cur:
                         name_clean = adhoc_oasis_name.strip().title()
                         days_map_indices = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3, "Friday": 4}
+                        site_sql, site_params = site_filter(SITE)
+                        counted_sql, counted_params = site_filter(SITE, include_unsited=True)
                         
                         for day_str in adhoc_oasis_days: 
                             date_obj_check = current_oasis_display_mon_adhoc + timedelta(days=days_map_indices[day_str])
-                            cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND team_name = %s AND date = %s", (name_clean, date_obj_check))
+                            cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND team_name = %s AND date = %s" + site_sql,
+                                        (name_clean, date_obj_check, *site_params))
                         
                         added_to_all_selected = True
                         for day_str in adhoc_oasis_days:
                             date_obj = current_oasis_display_mon_adhoc + timedelta(days=days_map_indices[day_str])
-                            cur.execute("SELECT COUNT(*) FROM weekly_allocations WHERE room_name = 'Oasis' AND date = %s", (date_obj,))
+                            cur.execute("SELECT COUNT(*) FROM weekly_allocations WHERE room_name = 'Oasis' AND date = %s" + counted_sql,
+                                        (date_obj, *counted_params))
                             count = cur.fetchone()[0]
                             if count >= oasis.get("capacity", 20):
                                 st.warning(f"⚠️ Oasis is full on {day_str}. Could not add {name_clean}.")
                                 added_to_all_selected = False
                             else:
                                 # Insert unconfirmed allocation (needs matrix confirmation)
-                                cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date, confirmed) VALUES (%s, 'Oasis', %s, %s)", (name_clean, date_obj, False))
+                                if SITE is None:
+                                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date, confirmed) VALUES (%s, 'Oasis', %s, %s)", (name_clean, date_obj, False))
+                                else:
+                                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date, confirmed, site) VALUES (%s, 'Oasis', %s, %s, %s)",
+                                                (name_clean, date_obj, False, SITE))
                         conn_adhoc.commit()
                         if added_to_all_selected and adhoc_oasis_days:
                             st.success(f"✅ {name_clean} added to Oasis for selected day(s)! Please confirm attendance via the matrix below.")
@@ -873,9 +1136,10 @@ if not conn_matrix: st.error("No DB connection for Oasis Overview")
 else:
     try:
         with conn_matrix.cursor() as cur:
+            site_sql, site_params = site_filter(SITE)
             cur.execute( 
-                "SELECT team_name, date FROM weekly_allocations WHERE room_name = 'Oasis' AND date >= %s AND date <= %s",
-                (oasis_overview_monday_display, oasis_overview_days_dates[-1])
+                "SELECT team_name, date FROM weekly_allocations WHERE room_name = 'Oasis' AND date >= %s AND date <= %s" + site_sql,
+                (oasis_overview_monday_display, oasis_overview_days_dates[-1], *site_params)
             )
             rows = cur.fetchall()
 
@@ -887,7 +1151,8 @@ else:
         names_from_prefs = set()
         try: 
             with conn_matrix.cursor() as cur: 
-                cur.execute("SELECT DISTINCT person_name FROM oasis_preferences")
+                site_sql, site_params = site_filter(SITE, "WHERE")
+                cur.execute("SELECT DISTINCT person_name FROM oasis_preferences" + site_sql, site_params)
                 pref_rows = cur.fetchall()
                 names_from_prefs = {row[0] for row in pref_rows}
         except psycopg2.Error: st.warning("Could not fetch names from Oasis preferences for matrix display.")
@@ -895,26 +1160,26 @@ else:
         all_relevant_names = sorted(list(unique_names_allocated.union(names_from_prefs).union({"Niek"}))) 
         if not all_relevant_names: all_relevant_names = ["Niek"] 
 
-        initial_matrix_df = pd.DataFrame(False, index=all_relevant_names, columns=oasis_overview_day_names)
+        # One crosstab for the whole week: person x weekday, True where the person has a row that day
+        df_matrix_week = df_matrix_data[df_matrix_data["Date"].isin(oasis_overview_days_dates)]
+        day_name_by_date = dict(zip(oasis_overview_days_dates, oasis_overview_day_names))
+        loaded_matrix_df = (
+            pd.crosstab(df_matrix_week["Name"], df_matrix_week["Date"].map(day_name_by_date))
+            .gt(0)
+            .reindex(index=all_relevant_names, columns=oasis_overview_day_names, fill_value=False)
+            .astype(bool)
+        )
+        # What the database holds; the save diffs the edited matrix against this, not against the Bud-filled view
+        initial_matrix_df = loaded_matrix_df.copy()
 
-        if not df_matrix_data.empty: 
-            for _, row_data in df_matrix_data.iterrows():
-                person_name = row_data["Name"]
-                alloc_date = row_data["Date"]
-                if alloc_date in oasis_overview_days_dates and person_name in initial_matrix_df.index:
-                    initial_matrix_df.at[person_name, alloc_date.strftime("%A")] = True
-        
         if "Bud" in initial_matrix_df.index: 
-            for day_n in oasis_overview_day_names: initial_matrix_df.at["Bud", day_n] = True
+            initial_matrix_df.loc["Bud"] = True
         
         st.subheader("🪑 Oasis Availability Summary")
-        current_day_alloc_counts = {day_dt: 0 for day_dt in oasis_overview_days_dates}
-        if not df_matrix_data.empty:
-            for day_dt_check in oasis_overview_days_dates:
-                current_day_alloc_counts[day_dt_check] = df_matrix_data[df_matrix_data["Date"] == day_dt_check]["Name"].nunique()
+        current_day_alloc_counts = df_matrix_week.groupby("Date")["Name"].nunique().to_dict()
         
         for day_dt, day_str_label in zip(oasis_overview_days_dates, oasis_overview_day_names):
-            used_spots = current_day_alloc_counts[day_dt]
+            used_spots = current_day_alloc_counts.get(day_dt, 0)
             spots_left = max(0, oasis_capacity - used_spots)
             st.markdown(f"**{day_str_label}**: {spots_left} spot(s) left")
 
@@ -925,39 +1190,30 @@ else:
             key="oasis_matrix_editor_main"
         )
 
+        # Outcome of the last save, kept across the st.rerun() that reloads the matrix
+        for level, message in st.session_state.pop("oasis_matrix_save_messages", []):
+            getattr(st, level)(message)
+
         if st.button("💾 Save Oasis Matrix Changes", key="btn_save_oasis_matrix_changes"):
             try:
-                with conn_matrix.cursor() as cur:
-                    # Delete existing Oasis allocations for this week
-                    cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND team_name != 'Bud' AND date >= %s AND date <= %s", (oasis_overview_monday_display, oasis_overview_days_dates[-1]))
-                    if "Bud" in edited_matrix.index: 
-                        cur.execute("DELETE FROM weekly_allocations WHERE room_name = 'Oasis' AND team_name = 'Bud' AND date >= %s AND date <= %s", (oasis_overview_monday_display, oasis_overview_days_dates[-1]))
-                        for day_idx, day_col_name in enumerate(oasis_overview_day_names):
-                            if edited_matrix.at["Bud", day_col_name]:
-                                # Insert confirmed allocation for Bud
-                                cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date, confirmed, confirmed_at) VALUES (%s, %s, %s, %s, NOW())", ("Bud", "Oasis", oasis_overview_monday_display + timedelta(days=day_idx), True))
-                    
-                    occupied_counts_per_day = {day_col: 0 for day_col in oasis_overview_day_names}
-                    if "Bud" in edited_matrix.index: 
-                        for day_col_name in oasis_overview_day_names:
-                            if edited_matrix.at["Bud", day_col_name]:
-                                occupied_counts_per_day[day_col_name] +=1
-                                
-                    for person_name_matrix in edited_matrix.index: 
-                        if person_name_matrix == "Bud": continue 
-                        for day_idx, day_col_name in enumerate(oasis_overview_day_names):
-                            if edited_matrix.at[person_name_matrix, day_col_name]: 
-                                if occupied_counts_per_day[day_col_name] < oasis_capacity:
-                                    date_obj_alloc = oasis_overview_monday_display + timedelta(days=day_idx)
-                                    # Insert confirmed allocation (matrix confirms attendance)
-                                    cur.execute("INSERT INTO weekly_allocations (team_name, room_name, date, confirmed, confirmed_at) VALUES (%s, %s, %s, %s, NOW())", (person_name_matrix, "Oasis", date_obj_alloc, True))
-                                    occupied_counts_per_day[day_col_name] += 1
-                                else:
-                                    st.warning(f"⚠️ {person_name_matrix} could not be added to Oasis on {day_col_name}: capacity reached.")
-                                    
-                    conn_matrix.commit()
-                    st.success("✅ Oasis Matrix saved successfully! All entries marked as confirmed.")
-                    st.rerun()
+                start_time = time.perf_counter()
+                save_result = save_oasis_matrix_diff(
+                    conn_matrix, oasis_overview_monday_display,
+                    dict(zip(oasis_overview_day_names, oasis_overview_days_dates)),
+                    loaded_matrix_df, edited_matrix, oasis_capacity, site=SITE,
+                )
+                conn_matrix.commit()
+                st.session_state.oasis_matrix_save_messages = [
+                    ("warning", f"⚠️ {person_name_matrix} could not be added to Oasis on {day_col_name}: capacity reached.")
+                    for person_name_matrix, day_col_name in save_result["rejected"]
+                ] + [("success", f"✅ Oasis Matrix saved in {(time.perf_counter() - start_time) * 1000:.0f} ms: "
+                                 f"{save_result['inserted']} added, {save_result['deleted']} removed, "
+                                 f"{save_result['kept']} kept. All ticked entries are confirmed.")]
+                st.rerun()
+            except psycopg2.errors.LockNotAvailable:
+                if conn_matrix: conn_matrix.rollback()
+                st.warning(f"⚠️ An allocation run or another save is updating this week's Oasis right now. "
+                           f"Nothing was saved; please try again in a moment.")
             except Exception as e_matrix_save:
                 st.error(f"❌ Failed to save Oasis Matrix: {e_matrix_save}")
                 if conn_matrix: conn_matrix.rollback()
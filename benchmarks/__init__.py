@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the room allocator.
+
+Run from the repository root, e.g. ``python -m benchmarks.compare_solvers``.
+"""
@@ -0,0 +1,57 @@
+"""
+Compare the greedy and optimal (min-cost flow) project-room solvers on a
+synthetic week.
+
+Usage:
+    python -m benchmarks.compare_solvers --teams 5000 --rooms 500 --seed 1
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from allocation_engine import PROJECT_SOLVERS, build_allocation_plan
+from benchmarks.workload import DAY_LABELS, generate_rooms_config, generate_team_preferences
+
+
+def synthetic_week(team_count, room_count, seed):
+    """Build a rooms config and weekly_preferences rows for one synthetic week."""
+    rng = random.Random(seed)
+    rooms = [room for room in generate_rooms_config(max(1, room_count // 5)) if room["name"] != "Oasis"]
+    return rooms, generate_team_preferences(team_count, rng)
+
+
+def run_solver(solver, rooms, preferences, day_mapping, seed):
+    start_time = time.perf_counter()
+    plan = build_allocation_plan(rooms, preferences, [], day_mapping, only="project", solver=solver, seed=seed,
+                                 verbose=False)
+    elapsed = time.perf_counter() - start_time
+    preferred_labels = {team_name: days.split(",") for team_name, _, days in preferences}
+    honoured = sum(1 for team_name, (_, pattern) in plan.placed_teams.items() if set(pattern) == set(preferred_labels[team_name]))
+    return {
+        "solver": solver,
+        "seconds": round(elapsed, 6),
+        "placed_teams": len(plan.placed_teams),
+        "unplaced_teams": len(plan.unplaced_teams),
+        "preferences_honoured": honoured,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--teams", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solvers", nargs="+", choices=PROJECT_SOLVERS, default=list(PROJECT_SOLVERS))
+    args = parser.parse_args(argv)
+
+    monday = date(2024, 5, 27)
+    day_mapping = {label: monday + timedelta(days=i) for i, label in enumerate(DAY_LABELS)}
+    rooms, preferences = synthetic_week(args.teams, args.rooms, args.seed)
+    results = [run_solver(solver, rooms, preferences, day_mapping, args.seed) for solver in args.solvers]
+    print(json.dumps({"teams": args.teams, "rooms": args.rooms, "seed": args.seed, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
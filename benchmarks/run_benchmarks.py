@@ -0,0 +1,140 @@
+"""
+End-to-end allocation benchmark against an in-memory SQLite stand-in.
+
+Each run loads a synthetic workload into SQLite, then goes through the same
+load -> solve phases as run_allocation and prints one JSON document with wall
+time per phase, rows written, peak traced memory and placement rates.
+
+The "write_stand_in" phase is a plain SQLite executemany of the plan's rows.
+It is not the production write path (apply_allocation_diff, a Postgres
+multi-statement batch), so it only shows how the row count grows with scale,
+not what a real run spends writing.
+
+Usage:
+    python -m benchmarks.run_benchmarks --scales 1 10 100 1000 --skew 0.3
+"""
+import argparse
+import json
+import sqlite3
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from allocate_rooms import load_allocation_inputs
+from allocation_engine import OASIS_SOLVERS, PROJECT_SOLVERS, build_allocation_plan
+from benchmarks.workload import DAY_LABELS, generate_workload
+
+BENCHMARK_MONDAY = date(2024, 5, 27)
+
+SCHEMA = """
+CREATE TABLE weekly_preferences (team_name TEXT, contact_person TEXT, team_size INTEGER, preferred_days TEXT, submission_time TEXT);
+CREATE TABLE oasis_preferences (person_name TEXT, preferred_day_1 TEXT, preferred_day_2 TEXT, preferred_day_3 TEXT,
+                                preferred_day_4 TEXT, preferred_day_5 TEXT, submission_time TEXT);
+CREATE TABLE weekly_allocations (id INTEGER PRIMARY KEY, team_name TEXT, room_name TEXT, date TEXT,
+                                 confirmed BOOLEAN DEFAULT 0, confirmed_at TEXT);
+"""
+
+
+def create_stand_in_database(workload):
+    """Create an in-memory SQLite database holding the workload's preference tables."""
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO weekly_preferences (team_name, contact_person, team_size, preferred_days) VALUES (?, 'bench', ?, ?)",
+        workload["team_preferences"],
+    )
+    conn.executemany(
+        "INSERT INTO oasis_preferences (person_name, preferred_day_1, preferred_day_2, preferred_day_3, preferred_day_4, preferred_day_5) VALUES (?, ?, ?, ?, ?, ?)",
+        workload["oasis_preferences"],
+    )
+    conn.commit()
+    return conn
+
+
+def placement_report(plan, team_preferences, oasis_preferences):
+    requested_oasis_days = sum(sum(1 for day in row[1:] if day) for row in oasis_preferences)
+    seated_people = sum(1 for days in plan.oasis_assignments.values() if days)
+    return {
+        "teams": len(team_preferences),
+        "placed_teams": len(plan.placed_teams),
+        "project_placement_rate": round(len(plan.placed_teams) / len(team_preferences), 4) if team_preferences else None,
+        "oasis_people": len(oasis_preferences),
+        "oasis_people_seated_rate": round(seated_people / len(oasis_preferences), 4) if oasis_preferences else None,
+        "oasis_day_fill_rate": round(len(plan.oasis_rows) / requested_oasis_days, 4) if requested_oasis_days else None,
+    }
+
+
+def run_benchmark(scale, demand=1.2, skew=0.0, seed=0, solver="greedy", trace_memory=True, improve_budget=None,
+                  oasis_solver="heap"):
+    """Run one benchmark case and return its JSON-serialisable report."""
+    timings = {}
+    start_time = time.perf_counter()
+    workload = generate_workload(scale=scale, demand=demand, skew=skew, seed=seed)
+    conn = create_stand_in_database(workload)
+    timings["setup"] = time.perf_counter() - start_time
+
+    day_mapping = {label: BENCHMARK_MONDAY + timedelta(days=i) for i, label in enumerate(DAY_LABELS)}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        cur = conn.cursor()
+        start_time = time.perf_counter()
+        team_preferences_raw, oasis_preferences_raw = load_allocation_inputs(cur)
+        timings["load"] = time.perf_counter() - start_time
+
+        plan = build_allocation_plan(workload["rooms"], team_preferences_raw, oasis_preferences_raw, day_mapping,
+                                     solver=solver, seed=seed, improve_budget=improve_budget,
+                                     oasis_solver=oasis_solver, verbose=False)
+        timings.update(plan.timings)
+
+        start_time = time.perf_counter()
+        rows = [(team_name, room_name, date_obj.isoformat()) for team_name, room_name, date_obj in plan.rows]
+        cur.executemany("INSERT INTO weekly_allocations (team_name, room_name, date) VALUES (?, ?, ?)", rows)
+        conn.commit()
+        timings["write_stand_in"] = time.perf_counter() - start_time
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        conn.close()
+
+    return {
+        "scale": scale,
+        "demand": demand,
+        "skew": skew,
+        "seed": seed,
+        "solver": solver,
+        "oasis_solver": oasis_solver,
+        "project_rooms": len(workload["rooms"]) - 1,
+        "oasis_capacity": workload["rooms"][-1]["capacity"],
+        "timings_seconds": {phase: round(seconds, 6) for phase, seconds in timings.items()},
+        "rows_written": len(rows),
+        "peak_memory_bytes": peak_memory,
+        "improvement": plan.improvement,
+        **placement_report(plan, workload["team_preferences"], workload["oasis_preferences"]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the room allocator on synthetic workloads.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--demand", type=float, default=1.2, help="Requests per available slot")
+    parser.add_argument("--skew", type=float, default=0.0, help="Preference skew, 0 = uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solver", choices=PROJECT_SOLVERS, default="greedy")
+    parser.add_argument("--oasis-solver", choices=OASIS_SOLVERS, default="heap")
+    parser.add_argument("--improve-budget", type=float, help="Seconds of local search after the project solver")
+    parser.add_argument("--no-trace-memory", action="store_true", help="Skip tracemalloc (faster, no peak memory)")
+    args = parser.parse_args(argv)
+
+    results = [
+        run_benchmark(scale, demand=args.demand, skew=args.skew, seed=args.seed, solver=args.solver,
+                      trace_memory=not args.no_trace_memory, improve_budget=args.improve_budget,
+                      oasis_solver=args.oasis_solver)
+        for scale in args.scales
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
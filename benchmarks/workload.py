@@ -0,0 +1,93 @@
+"""
+Synthetic workloads for the allocation benchmarks.
+
+A workload is a rooms.json-style room list plus weekly_preferences and
+oasis_preferences rows, scaled from today's office (5 project rooms and a
+16-seat Oasis) by an integer factor.
+"""
+import random
+
+DAY_LABELS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+BASE_PROJECT_ROOM_CAPACITIES = [6, 4, 4, 4, 4]
+BASE_OASIS_CAPACITY = 16
+
+
+def generate_rooms_config(scale):
+    """rooms.json entries for `scale` copies of the current office."""
+    rooms = [
+        {"name": f"Room {copy:04d}-{i}", "capacity": capacity}
+        for copy in range(scale)
+        for i, capacity in enumerate(BASE_PROJECT_ROOM_CAPACITIES)
+    ]
+    rooms.append({"name": "Oasis", "capacity": BASE_OASIS_CAPACITY * scale})
+    return rooms
+
+
+def generate_team_preferences(team_count, rng, skew=0.0, other_share=0.05):
+    """
+    weekly_preferences rows (team_name, team_size, preferred_days).
+
+    skew in [0, 1] shifts demand from Tue/Thu towards Mon/Wed: 0 is an even
+    split, 1 sends every pair request to Mon/Wed. other_share is the fraction
+    of teams that ask for something other than a valid pair.
+    """
+    mon_wed_share = 0.5 + skew / 2
+    rows = []
+    for i in range(team_count):
+        draw = rng.random()
+        if draw < other_share:
+            preferred_days = rng.choice(["Friday", "Monday,Tuesday", ""])
+        elif rng.random() < mon_wed_share:
+            preferred_days = "Monday,Wednesday"
+        else:
+            preferred_days = "Tuesday,Thursday"
+        rows.append((f"Team {i:06d}", rng.choice([3, 3, 4, 4, 4, 5, 6]), preferred_days))
+    return rows
+
+
+def generate_oasis_preferences(person_count, rng, skew=0.0):
+    """
+    oasis_preferences rows (person_name, day_1 ... day_5).
+
+    Day popularity follows a Zipf-like curve 1 / rank ** (2 * skew), so 0 is
+    uniform and larger values concentrate demand on the first weekdays.
+    """
+    weights = [1 / (rank + 1) ** (2 * skew) for rank in range(len(DAY_LABELS))]
+    rows = []
+    for i in range(person_count):
+        day_count = rng.randint(1, len(DAY_LABELS))
+        chosen = []
+        while len(chosen) < day_count:
+            day = rng.choices(DAY_LABELS, weights=weights)[0]
+            if day not in chosen:
+                chosen.append(day)
+        rows.append((f"Person {i:06d}", *(chosen + [None] * (len(DAY_LABELS) - day_count))))
+    return rows
+
+
+def generate_workload(scale=1, demand=1.2, skew=0.0, seed=0, team_count=None, person_count=None):
+    """
+    Build a complete synthetic workload.
+
+    Args:
+        scale: Multiple of the current office (5 project rooms, 16 Oasis seats)
+        demand: Requests per available slot when counts are not given explicitly
+        skew: Preference skew passed to both generators (0 = uniform)
+        seed: Seed for the generator's own Random instance
+        team_count, person_count: Override the demand-derived population sizes
+
+    Returns:
+        dict with "rooms", "team_preferences" and "oasis_preferences"
+    """
+    rng = random.Random(seed)
+    rooms = generate_rooms_config(scale)
+    project_slots = (len(rooms) - 1) * 2  # Every room can host one Mon/Wed and one Tue/Thu team
+    if team_count is None:
+        team_count = round(project_slots * demand)
+    if person_count is None:
+        person_count = round(BASE_OASIS_CAPACITY * scale * 2 * demand)
+    return {
+        "rooms": rooms,
+        "team_preferences": generate_team_preferences(team_count, rng, skew),
+        "oasis_preferences": generate_oasis_preferences(person_count, rng, skew),
+    }
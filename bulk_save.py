@@ -0,0 +1,195 @@
+"""
+Diff-based bulk saves for the admin table editors.
+
+The admin panel edits whole tables in st.data_editor. Rather than deleting
+the table and inserting every row again, save_frame_diff matches the rows as
+they were loaded with the edited rows on a key, and writes only what changed:
+one DELETE, one UPDATE and one INSERT, sent as a single statement batch inside
+the caller's transaction. Rows nobody touched are not rewritten, so their ids
+and any columns the editor does not show survive a save.
+"""
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+
+@dataclass
+class FrameDiff:
+    """
+    Row changes between two editor frames, in database column order.
+
+    to_insert and to_update hold full rows; to_delete holds key tuples.
+    """
+    to_insert: list = field(default_factory=list)
+    to_update: list = field(default_factory=list)
+    to_delete: list = field(default_factory=list)
+    unchanged: int = 0
+    skipped: int = 0
+
+    @property
+    def is_empty(self):
+        return not (self.to_insert or self.to_update or self.to_delete)
+
+
+def _cell(value):
+    """Plain Python value for a frame cell: NaN/NaT become None, numpy and pandas scalars are unwrapped."""
+    if value is None or (not isinstance(value, (list, tuple, dict)) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "dtype"):
+        return value.item()
+    return value
+
+
+def frame_rows(df, columns, key_columns):
+    """
+    Index a frame's rows by key.
+
+    Args:
+        df: DataFrame holding every frame column named in columns
+        columns: List of (frame_column, db_column, sql_type)
+        key_columns: Frame columns that identify a row
+
+    Returns:
+        tuple: (key tuple -> row tuple in columns order, number of rows skipped for an empty key)
+
+    Raises:
+        ValueError: when two rows share a key
+    """
+    frame_columns = [frame_column for frame_column, _, _ in columns]
+    key_positions = [frame_columns.index(key) for key in key_columns]
+    rows, skipped, duplicates = {}, 0, []
+    for values in df[frame_columns].itertuples(index=False, name=None):
+        row = tuple(_cell(value) for value in values)
+        key = tuple(row[position] for position in key_positions)
+        if any(part is None or part == "" for part in key):
+            skipped += 1  # Blank rows the dynamic editor adds until they are filled in
+        elif key in rows:
+            duplicates.append(key)
+        else:
+            rows[key] = row
+    if duplicates:
+        raise ValueError(f"Duplicate {', '.join(key_columns)} rows: {', '.join(' / '.join(map(str, key)) for key in duplicates)}")
+    return rows, skipped
+
+
+def diff_frames(original, edited, columns, key_columns):
+    """
+    Work out which rows an edit inserted, updated and deleted.
+
+    Rows are matched on key_columns; a matched row counts as updated when any
+    other column differs. Rows with an empty key are ignored on both sides.
+
+    Returns:
+        FrameDiff
+    """
+    original_rows, _ = frame_rows(original, columns, key_columns)
+    edited_rows, skipped = frame_rows(edited, columns, key_columns)
+    diff = FrameDiff(skipped=skipped)
+    for key, row in edited_rows.items():
+        if key not in original_rows:
+            diff.to_insert.append(row)
+        elif row != original_rows[key]:
+            diff.to_update.append(row)
+        else:
+            diff.unchanged += 1
+    diff.to_delete = [key for key in original_rows if key not in edited_rows]
+    return diff
+
+
+def apply_frame_diff(cur, table, columns, key_columns, diff, defaults=None, scope_sql=b"", fixed=None):
+    """
+    Write a FrameDiff to a table as one statement batch.
+
+    Every value is cast to its column's SQL type in the VALUES lists, so
+    columns that are NULL in every row still line up with the table.
+
+    Args:
+        cur: Cursor on the caller's transaction; the caller commits
+        table: Table name
+        columns: List of (frame_column, db_column, sql_type), in FrameDiff row order
+        key_columns: Frame columns the rows are matched on
+        diff: FrameDiff from diff_frames
+        defaults: Optional db_column -> SQL expression used where an inserted or updated value is NULL
+        scope_sql: Optional extra condition on the target rows (alias t) for updates and deletes,
+            e.g. b" AND t.room_name != 'Oasis'"
+        fixed: Optional db_column -> value for a column the editor does not show, e.g. {"site": "Utrecht"}:
+            inserted rows get the value, and updates and deletes only touch rows that hold it
+    """
+    defaults = defaults or {}
+    fixed = fixed or {}
+    scope_sql = scope_sql + b"".join(cur.mogrify(f" AND t.{db_column} = %s", (value,)) for db_column, value in fixed.items())
+    fixed_columns = "".join(f", {db_column}" for db_column in fixed)
+    fixed_values = b"".join(b", " + cur.mogrify("%s", (value,)) for value in fixed.values())
+    db_columns = [db_column for _, db_column, _ in columns]
+    key_db_columns = [db_column for frame_column, db_column, _ in columns if frame_column in key_columns]
+    row_placeholder = "(" + ", ".join(f"%s::{sql_type}" for _, _, sql_type in columns) + ")"
+    key_placeholder = "(" + ", ".join(f"%s::{sql_type}" for frame_column, _, sql_type in columns
+                                      if frame_column in key_columns) + ")"
+
+    def value_of(db_column):
+        return f"COALESCE(v.{db_column}, {defaults[db_column]})" if db_column in defaults else f"v.{db_column}"
+
+    key_match = " AND ".join(f"t.{db_column} = v.{db_column}" for db_column in key_db_columns).encode()
+    statements = []
+    if diff.to_delete:
+        values = b",".join(cur.mogrify(key_placeholder, key) for key in diff.to_delete)
+        statements.append(
+            f"DELETE FROM {table} t USING (VALUES ".encode() + values
+            + f") AS v({', '.join(key_db_columns)}) WHERE ".encode() + key_match + scope_sql
+        )
+    if diff.to_update:
+        values = b",".join(cur.mogrify(row_placeholder, row) for row in diff.to_update)
+        assignments = ", ".join(f"{db_column} = {value_of(db_column)}" for db_column in db_columns
+                                if db_column not in key_db_columns)
+        statements.append(
+            f"UPDATE {table} t SET {assignments} FROM (VALUES ".encode() + values
+            + f") AS v({', '.join(db_columns)}) WHERE ".encode() + key_match + scope_sql
+        )
+    if diff.to_insert:
+        values = b",".join(cur.mogrify(row_placeholder, row) for row in diff.to_insert)
+        statements.append(
+            f"INSERT INTO {table} ({', '.join(db_columns)}{fixed_columns}) "
+            f"SELECT {', '.join(value_of(db_column) for db_column in db_columns)}".encode() + fixed_values
+            + b" FROM (VALUES " + values + f") AS v({', '.join(db_columns)})".encode()
+        )
+    if statements:
+        cur.execute(b";\n".join(statements))
+
+
+def save_frame_diff(conn, table, columns, key_columns, original, edited, defaults=None, scope_sql=b"", fixed=None):
+    """
+    Save an admin editor's changes: diff the loaded and edited frames and apply the result.
+
+    Args:
+        conn: Open connection; the caller commits or rolls back
+        table, columns, key_columns, defaults, scope_sql, fixed: See apply_frame_diff
+        original: Frame as it was loaded into the editor
+        edited: Frame returned by st.data_editor
+
+    Returns:
+        dict: "inserted", "updated", "deleted", "unchanged" and "skipped" row counts, and "elapsed_ms"
+
+    Raises:
+        ValueError: when the edited frame repeats a key
+    """
+    start_time = time.perf_counter()
+    diff = diff_frames(original, edited, columns, key_columns)
+    with conn.cursor() as cur:
+        apply_frame_diff(cur, table, columns, key_columns, diff, defaults=defaults, scope_sql=scope_sql, fixed=fixed)
+    return {
+        "inserted": len(diff.to_insert),
+        "updated": len(diff.to_update),
+        "deleted": len(diff.to_delete),
+        "unchanged": diff.unchanged,
+        "skipped": diff.skipped,
+        "elapsed_ms": (time.perf_counter() - start_time) * 1000,
+    }
+
+
+def describe_frame_save(result):
+    """One-line summary of a save_frame_diff result for the admin panel."""
+    return (f"{result['inserted']} added, {result['updated']} updated, {result['deleted']} removed, "
+            f"{result['unchanged']} unchanged in {result['elapsed_ms']:.0f} ms")
@@ -0,0 +1,110 @@
+-- Schema changes the allocation scripts, job worker and app need on top of the original tables
+-- (weekly_preferences, oasis_preferences, weekly_allocations and the archives in backup_tables.sql).
+-- Apply before deploying this version:  psql "$DATABASE_URL" -f migrate_allocation_schema.sql
+-- Every statement is idempotent, so the file can be re-run after each upgrade.
+
+-- Columns the allocation diff and incremental runs read from weekly_allocations
+ALTER TABLE weekly_allocations ADD COLUMN IF NOT EXISTS confirmed BOOLEAN DEFAULT FALSE;
+ALTER TABLE weekly_allocations ADD COLUMN IF NOT EXISTS confirmed_at TIMESTAMP;
+-- allocated_at is compared with submission_time, which the app writes as UTC, so it defaults to UTC too
+ALTER TABLE weekly_allocations ADD COLUMN IF NOT EXISTS allocated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'UTC');
+ALTER TABLE weekly_allocations ALTER COLUMN allocated_at SET DEFAULT (NOW() AT TIME ZONE 'UTC');
+
+-- Registry of allocation runs (one row per run_allocation call)
+-- Runs hold a per-week advisory lock while status = 'running'
+CREATE TABLE IF NOT EXISTS allocation_runs (
+    id SERIAL PRIMARY KEY,
+    week DATE NOT NULL,
+    scope VARCHAR(20) NOT NULL,          -- 'project', 'oasis' or 'all'
+    solver VARCHAR(20),
+    status VARCHAR(20) NOT NULL DEFAULT 'running',  -- running, succeeded, failed, dry_run, abandoned
+    seed BIGINT,
+    started_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    timings JSONB,
+    rows_written INTEGER,
+    rows_deleted INTEGER,
+    rows_unchanged INTEGER,
+    messages JSONB
+);
+
+CREATE INDEX IF NOT EXISTS idx_allocation_runs_week ON allocation_runs(week, scope, started_at DESC);
+
+-- Queue of allocation runs requested from the admin panel, processed by allocation_jobs.py
+CREATE TABLE IF NOT EXISTS allocation_jobs (
+    id SERIAL PRIMARY KEY,
+    week DATE NOT NULL,
+    scope VARCHAR(20) NOT NULL,          -- 'project', 'oasis' or 'all'
+    options JSONB,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, succeeded, failed
+    requested_by VARCHAR(255),
+    worker VARCHAR(255),
+    enqueued_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,              -- last progress write of the worker running the job
+    attempts INTEGER NOT NULL DEFAULT 0, -- times a worker has claimed the job
+    finished_at TIMESTAMP,
+    timings JSONB,                       -- per-phase seconds, updated while the job runs
+    result JSONB,                        -- run_id, seed and row counts
+    messages JSONB
+);
+
+CREATE INDEX IF NOT EXISTS idx_allocation_jobs_queued ON allocation_jobs(id) WHERE status = 'queued';
+-- Running jobs whose worker went quiet are requeued (or failed) by the next claim
+ALTER TABLE allocation_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+ALTER TABLE allocation_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+-- Office site dimension for multi-office deployments (NULL = single-site database)
+-- Site names match the keys of "sites" in rooms.json
+ALTER TABLE weekly_preferences ADD COLUMN IF NOT EXISTS site VARCHAR(100);
+ALTER TABLE oasis_preferences ADD COLUMN IF NOT EXISTS site VARCHAR(100);
+ALTER TABLE weekly_allocations ADD COLUMN IF NOT EXISTS site VARCHAR(100);
+ALTER TABLE allocation_runs ADD COLUMN IF NOT EXISTS site VARCHAR(100);
+CREATE INDEX IF NOT EXISTS idx_weekly_alloc_site_date ON weekly_allocations(site, date);
+
+-- Requested vs allocated days per team / Oasis person per week, as allocated by the last allocation run
+-- of that week (written in the same transaction; later edits in the app are not reflected).
+-- Read by the history-weighted lottery (--fairness-weeks); runs skip the write while the table is missing.
+CREATE TABLE IF NOT EXISTS allocation_history_rollup (
+    id SERIAL PRIMARY KEY,
+    week DATE NOT NULL,
+    site VARCHAR(100),
+    owner_kind VARCHAR(10) NOT NULL,     -- 'team' or 'oasis'
+    owner_name VARCHAR(255) NOT NULL,
+    requested_days INTEGER NOT NULL,
+    allocated_days INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_alloc_history_rollup_week ON allocation_history_rollup(week, owner_kind);
+
+-- Version counter for the app's cached room grid: bumped once per statement that writes
+-- weekly_allocations (or weekly_preferences, whose contacts the grid shows). The bump is part
+-- of the writing transaction, so a new version only becomes visible together with the new rows.
+CREATE TABLE IF NOT EXISTS allocation_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO allocation_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_allocation_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE allocation_version SET version = version + 1, updated_at = NOW() WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS weekly_allocations_bump_version ON weekly_allocations;
+CREATE TRIGGER weekly_allocations_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON weekly_allocations
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_allocation_version();
+
+DROP TRIGGER IF EXISTS weekly_preferences_bump_version ON weekly_preferences;
+CREATE TRIGGER weekly_preferences_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON weekly_preferences
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_allocation_version();
+
+-- Room grid query (app.py build_room_grid): the week's rows by date, then each team's latest contact
+CREATE INDEX IF NOT EXISTS idx_weekly_alloc_date ON weekly_allocations(date);
+CREATE INDEX IF NOT EXISTS idx_weekly_prefs_team_submitted ON weekly_preferences(team_name, submission_time DESC);
@@ -0,0 +1,104 @@
+from datetime import date, datetime
+
+from allocation_engine import diff_allocation_rows, split_existing_rows
+
+MONDAY = date(2025, 1, 6)
+TUESDAY = date(2025, 1, 7)
+
+
+def test_identical_rows_are_unchanged():
+    diff = diff_allocation_rows(
+        [("Team 1", "Room A", MONDAY, 1), ("Ann", "Oasis", MONDAY, 2)],
+        [("Team 1", "Room A", MONDAY), ("Ann", "Oasis", MONDAY)],
+    )
+
+    assert diff.unchanged == 2
+    assert diff.to_insert == diff.to_delete == diff.to_update == []
+
+
+def test_room_change_becomes_update_by_id():
+    diff = diff_allocation_rows([("Team 1", "Room A", MONDAY, 7)], [("Team 1", "Room B", MONDAY)])
+
+    assert diff.to_update == [(7, "Team 1", "Room A", MONDAY, "Room B")]
+    assert diff.to_insert == diff.to_delete == []
+
+
+def test_day_change_is_delete_and_insert():
+    diff = diff_allocation_rows([("Team 1", "Room A", MONDAY, 7)], [("Team 1", "Room A", TUESDAY)])
+
+    assert diff.to_delete == [(7, "Team 1", "Room A", MONDAY)]
+    assert diff.to_insert == [("Team 1", "Room A", TUESDAY)]
+    assert diff.to_update == []
+
+
+def test_project_room_and_oasis_are_matched_separately():
+    diff = diff_allocation_rows([("Ann", "Oasis", MONDAY, 3)], [("Ann", "Room A", MONDAY)])
+
+    assert diff.to_delete == [(3, "Ann", "Oasis", MONDAY)]
+    assert diff.to_insert == [("Ann", "Room A", MONDAY)]
+    assert diff.to_update == []
+
+
+def test_duplicate_stored_row_deletes_one_copy_by_id():
+    diff = diff_allocation_rows(
+        [("Team 1", "Room A", MONDAY, 4), ("Team 1", "Room A", MONDAY, 5)],
+        [("Team 1", "Room A", MONDAY)],
+    )
+
+    assert diff.unchanged == 1
+    assert len(diff.to_delete) == 1
+    assert diff.to_delete[0][0] in (4, 5)
+    assert diff.to_delete[0][1:] == ("Team 1", "Room A", MONDAY)
+    assert diff.to_insert == diff.to_update == []
+
+
+def test_duplicate_stored_rows_all_go_when_not_planned():
+    diff = diff_allocation_rows(
+        [("Team 1", "Room A", MONDAY, 4), ("Team 1", "Room A", MONDAY, 5)],
+        [],
+    )
+
+    assert sorted(row_id for row_id, *_ in diff.to_delete) == [4, 5]
+
+
+def test_rows_allocated_before_submission_go_stale():
+    allocated_at = datetime(2025, 1, 1, 12, 0)
+    existing_rows = [
+        ("Team 1", "Room A", MONDAY, allocated_at, 1),
+        ("Team 2", "Room B", MONDAY, allocated_at, 2),
+        ("Ann", "Oasis", MONDAY, allocated_at, 3),
+    ]
+
+    kept_rows, stale_rows = split_existing_rows(
+        existing_rows,
+        {"Team 1": datetime(2025, 1, 2, 9, 0), "Team 2": datetime(2024, 12, 30, 9, 0)},
+        {"Ann": datetime(2025, 1, 2, 9, 0)},
+    )
+
+    assert kept_rows == [("Team 2", "Room B", MONDAY)]
+    assert stale_rows == [("Team 1", "Room A", MONDAY, 1), ("Ann", "Oasis", MONDAY, 3)]
+
+
+def test_project_and_oasis_submissions_are_kept_apart():
+    allocated_at = datetime(2025, 1, 1, 12, 0)
+    existing_rows = [
+        ("Ann", "Room A", MONDAY, allocated_at, 1),
+        ("Ann", "Oasis", TUESDAY, allocated_at, 2),
+    ]
+
+    kept_rows, stale_rows = split_existing_rows(existing_rows, {}, {"Ann": datetime(2025, 1, 2, 9, 0)})
+
+    assert kept_rows == [("Ann", "Room A", MONDAY)]
+    assert stale_rows == [("Ann", "Oasis", TUESDAY, 2)]
+
+
+def test_rows_without_allocated_at_or_preferences_are_kept():
+    existing_rows = [
+        ("Team 1", "Room A", MONDAY, None, 1),
+        ("Manual booking", "Room B", MONDAY, datetime(2025, 1, 1, 12, 0), 2),
+    ]
+
+    kept_rows, stale_rows = split_existing_rows(existing_rows, {"Team 1": datetime(2025, 1, 2, 9, 0)}, {})
+
+    assert kept_rows == [("Team 1", "Room A", MONDAY), ("Manual booking", "Room B", MONDAY)]
+    assert stale_rows == []
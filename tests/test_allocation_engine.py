@@ -0,0 +1,148 @@
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+from allocation_engine import (
+    WEEKDAY_LABELS,
+    allocate_oasis,
+    allocate_oasis_vectorised,
+    allocate_project_rooms,
+    allocate_project_rooms_optimal,
+)
+
+MONDAY = date(2025, 1, 6)
+DAY_MAPPING = {day_label: MONDAY + timedelta(days=i) for i, day_label in enumerate(WEEKDAY_LABELS)}
+
+PROJECT_SOLVERS = [allocate_project_rooms, allocate_project_rooms_optimal]
+OASIS_SOLVERS = [allocate_oasis, allocate_oasis_vectorised]
+
+
+def make_rooms(count, seed=1):
+    rng = random.Random(seed)
+    return [{"name": f"Room {i}", "capacity": rng.choice([4, 6, 8, 12])} for i in range(count)]
+
+
+def make_teams(count, seed=2):
+    rng = random.Random(seed)
+    patterns = [["Monday", "Wednesday"], ["Tuesday", "Thursday"]]
+    return [(f"Team {i}", rng.randint(3, 12), rng.choice(patterns)) for i in range(count)]
+
+
+def make_people(count, seed=3):
+    rng = random.Random(seed)
+    return {f"Person {i}": rng.sample(WEEKDAY_LABELS, rng.randint(1, 5)) for i in range(count)}
+
+
+@pytest.mark.parametrize("solver", PROJECT_SOLVERS)
+def test_project_solver_never_double_books(solver):
+    rows, placed_teams, unplaced_teams = solver(make_rooms(10), make_teams(30), DAY_MAPPING,
+                                                rng=random.Random(7), verbose=False)
+
+    room_days = Counter((room_name, date_obj) for _, room_name, date_obj in rows)
+    assert rows
+    assert max(room_days.values()) == 1
+    assert len(placed_teams) + len(unplaced_teams) == 30
+    assert {team_name for team_name, _, _ in rows} == set(placed_teams)
+
+
+@pytest.mark.parametrize("solver", PROJECT_SOLVERS)
+def test_project_solver_respects_capacity(solver):
+    rooms = make_rooms(10)
+    teams = make_teams(30)
+    capacity = {room["name"]: room["capacity"] for room in rooms}
+    size = {team_name: team_size for team_name, team_size, _ in teams}
+
+    rows, placed_teams, _ = solver(rooms, teams, DAY_MAPPING, rng=random.Random(7), verbose=False)
+
+    for team_name, room_name, _ in rows:
+        assert size[team_name] <= capacity[room_name]
+    for team_name, (room_name, pattern) in placed_teams.items():
+        team_dates = sorted(date_obj for name, _, date_obj in rows if name == team_name)
+        assert team_dates == sorted(DAY_MAPPING[day_label] for day_label in pattern)
+
+
+@pytest.mark.parametrize("solver", PROJECT_SOLVERS)
+def test_project_solver_skips_occupied_room_days(solver):
+    rooms = [{"name": "Room A", "capacity": 8}, {"name": "Room B", "capacity": 8}]
+    teams = [("Team 1", 5, ["Monday", "Wednesday"])]
+    occupied = {("Room A", DAY_MAPPING["Monday"])}
+
+    rows, placed_teams, _ = solver(rooms, teams, DAY_MAPPING, occupied=occupied,
+                                   rng=random.Random(7), verbose=False)
+
+    assert placed_teams["Team 1"][0] == "Room B"
+    assert ("Team 1", "Room A", DAY_MAPPING["Monday"]) not in rows
+
+
+@pytest.mark.parametrize("solver", PROJECT_SOLVERS)
+def test_project_solver_leaves_oversized_team_unplaced(solver):
+    rooms = [{"name": "Room A", "capacity": 4}]
+    teams = [("Team 1", 9, ["Monday", "Wednesday"])]
+
+    rows, placed_teams, unplaced_teams = solver(rooms, teams, DAY_MAPPING, rng=random.Random(7), verbose=False)
+
+    assert rows == []
+    assert placed_teams == {}
+    assert [team_name for team_name, _, _ in unplaced_teams] == ["Team 1"]
+
+
+@pytest.mark.parametrize("solver", OASIS_SOLVERS)
+def test_oasis_solver_respects_capacity(solver):
+    people = make_people(60)
+
+    rows, assignments = solver({"name": "Oasis", "capacity": 16}, people, DAY_MAPPING,
+                               rng=random.Random(11), verbose=False)
+
+    seats_per_day = Counter(date_obj for _, _, date_obj in rows)
+    assert max(seats_per_day.values()) <= 16
+    assert len(set(rows)) == len(rows)
+    for person_name, days in assignments.items():
+        assert set(days) <= set(people[person_name])
+
+
+@pytest.mark.parametrize("solver", OASIS_SOLVERS)
+def test_oasis_solver_counts_seats_already_taken(solver):
+    people = {f"Person {i}": ["Monday"] for i in range(10)}
+
+    rows, _ = solver({"name": "Oasis", "capacity": 6}, people, DAY_MAPPING, seats_taken={"Monday": 4},
+                     rng=random.Random(11), verbose=False)
+
+    assert len(rows) == 2
+
+
+@pytest.mark.parametrize("solver", OASIS_SOLVERS)
+def test_oasis_solver_is_deterministic_under_a_seed(solver):
+    people = make_people(60)
+    config = {"name": "Oasis", "capacity": 16}
+
+    first = solver(config, people, DAY_MAPPING, rng=random.Random(42), verbose=False)
+    second = solver(config, people, DAY_MAPPING, rng=random.Random(42), verbose=False)
+
+    assert first == second
+
+
+@pytest.mark.parametrize("solver", OASIS_SOLVERS)
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_oasis_solver_gives_everyone_a_day_before_anyone_a_second(solver, seed):
+    # 10 seats over the week for 8 people who all want every day: 8 first days, then 2 second days
+    people = {f"Person {i}": list(WEEKDAY_LABELS) for i in range(8)}
+
+    rows, assignments = solver({"name": "Oasis", "capacity": 2}, people, DAY_MAPPING,
+                               rng=random.Random(seed), verbose=False)
+
+    assert len(rows) == 10
+    assert sorted(len(days) for days in assignments.values()) == [1] * 6 + [2] * 2
+
+
+@pytest.mark.parametrize("solver", OASIS_SOLVERS)
+def test_oasis_solver_spreads_short_days_over_everyone(solver):
+    # Monday and Tuesday have 4 seats for 4 people who want both: one day each
+    people = {f"Person {i}": ["Monday", "Tuesday"] for i in range(4)}
+    day_mapping = {day_label: DAY_MAPPING[day_label] for day_label in ("Monday", "Tuesday")}
+
+    _, assignments = solver({"name": "Oasis", "capacity": 2}, people, day_mapping,
+                            rng=random.Random(5), verbose=False)
+
+    assert all(len(days) == 1 for days in assignments.values())
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bulk_save import diff_frames, frame_rows
+
+COLUMNS = [
+    ("Team", "team_name", "text"),
+    ("Size", "team_size", "integer"),
+    ("Days", "preferred_days", "text"),
+]
+KEY_COLUMNS = ["Team"]
+
+
+def make_frame(rows):
+    return pd.DataFrame(rows, columns=[frame_column for frame_column, _, _ in COLUMNS])
+
+
+def test_frame_rows_indexes_by_key_and_unwraps_values():
+    frame = make_frame([["Team 1", 5, "Monday,Wednesday"], ["Team 2", 3, np.nan]])
+
+    rows, skipped = frame_rows(frame, COLUMNS, KEY_COLUMNS)
+
+    assert skipped == 0
+    assert rows == {
+        ("Team 1",): ("Team 1", 5, "Monday,Wednesday"),
+        ("Team 2",): ("Team 2", 3, None),
+    }
+    assert type(rows[("Team 1",)][1]) is int
+
+
+@pytest.mark.parametrize("blank", [None, np.nan, ""])
+def test_frame_rows_skips_blank_keys(blank):
+    frame = make_frame([["Team 1", 5, "Monday"], [blank, 4, "Tuesday"]])
+
+    rows, skipped = frame_rows(frame, COLUMNS, KEY_COLUMNS)
+
+    assert list(rows) == [("Team 1",)]
+    assert skipped == 1
+
+
+def test_frame_rows_rejects_duplicate_keys():
+    frame = make_frame([["Team 1", 5, "Monday"], ["Team 1", 6, "Tuesday"]])
+
+    with pytest.raises(ValueError, match="Duplicate Team rows: Team 1"):
+        frame_rows(frame, COLUMNS, KEY_COLUMNS)
+
+
+def test_diff_frames_sorts_rows_into_insert_update_delete():
+    original = make_frame([["Team 1", 5, "Monday"], ["Team 2", 3, "Tuesday"], ["Team 3", 4, "Friday"]])
+    edited = make_frame([["Team 1", 5, "Monday"], ["Team 2", 6, "Tuesday"], ["Team 4", 2, "Thursday"]])
+
+    diff = diff_frames(original, edited, COLUMNS, KEY_COLUMNS)
+
+    assert diff.unchanged == 1
+    assert diff.to_update == [("Team 2", 6, "Tuesday")]
+    assert diff.to_insert == [("Team 4", 2, "Thursday")]
+    assert diff.to_delete == [("Team 3",)]
+    assert not diff.is_empty
+
+
+def test_diff_frames_ignores_blank_rows_the_editor_adds():
+    original = make_frame([["Team 1", 5, "Monday"]])
+    edited = make_frame([["Team 1", 5, "Monday"], [None, None, None]])
+
+    diff = diff_frames(original, edited, COLUMNS, KEY_COLUMNS)
+
+    assert diff.is_empty
+    assert diff.unchanged == 1
+    assert diff.skipped == 1
+
+
+def test_diff_frames_treats_nan_and_none_alike():
+    original = make_frame([["Team 1", 5, None]])
+    edited = make_frame([["Team 1", 5, np.nan]])
+
+    diff = diff_frames(original, edited, COLUMNS, KEY_COLUMNS)
+
+    assert diff.is_empty
+
+
+def test_diff_frames_rejects_duplicate_keys_in_the_edit():
+    original = make_frame([["Team 1", 5, "Monday"]])
+    edited = make_frame([["Team 1", 5, "Monday"], ["Team 1", 7, "Friday"]])
+
+    with pytest.raises(ValueError):
+        diff_frames(original, edited, COLUMNS, KEY_COLUMNS)
+
+
+def test_diff_frames_matches_on_composite_keys():
+    columns = [("Team", "team_name", "text"), ("Date", "date", "date"), ("Room", "room_name", "text")]
+    original = pd.DataFrame([["Team 1", pd.Timestamp("2025-01-06"), "Room A"]], columns=["Team", "Date", "Room"])
+    edited = pd.DataFrame([["Team 1", pd.Timestamp("2025-01-06"), "Room B"],
+                           ["Team 1", pd.Timestamp("2025-01-07"), "Room A"]], columns=["Team", "Date", "Room"])
+
+    diff = diff_frames(original, edited, columns, ["Team", "Date"])
+
+    assert [row[2] for row in diff.to_update] == ["Room B"]
+    assert [row[2] for row in diff.to_insert] == ["Room A"]
+    assert diff.to_delete == []
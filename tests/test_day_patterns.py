@@ -0,0 +1,101 @@
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+from allocation_engine import (
+    DEFAULT_DAY_PATTERNS,
+    WEEKDAY_LABELS,
+    allocate_project_rooms,
+    allocate_project_rooms_optimal,
+    build_allocation_plan,
+    day_patterns_from_config,
+    patterns_are_disjoint,
+    split_rooms_config,
+)
+
+MONDAY = date(2025, 1, 6)
+DAY_MAPPING = {day_label: MONDAY + timedelta(days=i) for i, day_label in enumerate(WEEKDAY_LABELS)}
+
+ROOMS_CONFIG = {
+    "rooms": [
+        {"name": "Room A", "capacity": 6},
+        {"name": "Room B", "capacity": 8},
+        {"name": "Oasis", "capacity": 10},
+    ],
+    "day_patterns": [
+        ["Wednesday", "Monday"],
+        {"days": ["Tuesday", "Thursday"]},
+        ["Friday"],
+        ["Monday", "Wednesday"],
+    ],
+}
+
+
+def test_configured_patterns_are_read_in_weekday_order_without_duplicates():
+    project_rooms, oasis_config = split_rooms_config(ROOMS_CONFIG)
+
+    assert [room["name"] for room in project_rooms] == ["Room A", "Room B"]
+    assert oasis_config == {"name": "Oasis", "capacity": 10}
+    assert day_patterns_from_config(ROOMS_CONFIG) == [
+        ("Monday", "Wednesday"), ("Tuesday", "Thursday"), ("Friday",),
+    ]
+
+
+@pytest.mark.parametrize("rooms_config", [
+    [{"name": "Room A", "capacity": 6}],
+    {"rooms": [{"name": "Room A", "capacity": 6}]},
+    {"rooms": [], "day_patterns": []},
+])
+def test_missing_catalogue_falls_back_to_the_default_patterns(rooms_config):
+    assert day_patterns_from_config(rooms_config) == list(DEFAULT_DAY_PATTERNS)
+
+
+@pytest.mark.parametrize("entry", [["Monday", "Funday"], [], {"days": []}])
+def test_invalid_pattern_is_rejected(entry):
+    with pytest.raises(ValueError):
+        day_patterns_from_config({"rooms": [], "day_patterns": [entry]})
+
+
+@pytest.mark.parametrize("solver", [allocate_project_rooms, allocate_project_rooms_optimal])
+def test_friday_team_gets_the_friday_pattern(solver):
+    rooms, _ = split_rooms_config(ROOMS_CONFIG)
+    teams = [("Team Fri", 5, ["Friday"]), ("Team MW", 7, ["Monday", "Wednesday"]),
+             ("Team TT", 6, ["Tuesday", "Thursday"])]
+
+    rows, placed_teams, unplaced_teams = solver(rooms, teams, DAY_MAPPING,
+                                                day_patterns=day_patterns_from_config(ROOMS_CONFIG),
+                                                rng=random.Random(3), verbose=False)
+
+    assert unplaced_teams == []
+    assert placed_teams["Team Fri"][1] == ("Friday",)
+    assert [date_obj for team_name, _, date_obj in rows if team_name == "Team Fri"] == [DAY_MAPPING["Friday"]]
+    assert placed_teams["Team MW"][1] == ("Monday", "Wednesday")
+    assert placed_teams["Team TT"][1] == ("Tuesday", "Thursday")
+
+
+def test_plan_uses_the_configured_patterns():
+    team_rows = [("Team Fri", 5, "Friday"), ("Team MW", 7, "Monday,Wednesday")]
+
+    plan = build_allocation_plan(ROOMS_CONFIG, team_rows, [], DAY_MAPPING, only="project", seed=4, verbose=False)
+
+    assert plan.placed_teams["Team Fri"][1] == ("Friday",)
+    assert plan.preferences_honoured == 2
+
+
+def test_optimal_solver_falls_back_to_greedy_for_overlapping_patterns():
+    # Monday alone overlaps Monday/Wednesday, so no bipartite matching models the room days
+    day_patterns = [("Monday", "Wednesday"), ("Tuesday", "Thursday"), ("Monday",)]
+    rooms = [{"name": f"Room {i}", "capacity": 6 + 2 * (i % 3)} for i in range(4)]
+    teams = [(f"Team {i}", 3 + i % 6, list(day_patterns[i % 3])) for i in range(14)]
+
+    greedy = allocate_project_rooms(rooms, teams, DAY_MAPPING, day_patterns=day_patterns,
+                                    rng=random.Random(8), verbose=False)
+    optimal = allocate_project_rooms_optimal(rooms, teams, DAY_MAPPING, day_patterns=day_patterns,
+                                             rng=random.Random(8), verbose=False)
+
+    assert not patterns_are_disjoint(day_patterns)
+    assert optimal == greedy
+    room_days = Counter((room_name, date_obj) for _, room_name, date_obj in optimal[0])
+    assert max(room_days.values()) == 1
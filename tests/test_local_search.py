@@ -0,0 +1,136 @@
+import random
+import time
+from datetime import date, timedelta
+
+import allocation_engine
+from allocation_engine import (
+    WEEKDAY_LABELS,
+    allocate_project_rooms,
+    improve_project_placement,
+    parse_team_preferences,
+    split_rooms_config,
+)
+from benchmarks.workload import generate_workload
+
+MONDAY = date(2025, 1, 6)
+DAY_MAPPING = {day_label: MONDAY + timedelta(days=i) for i, day_label in enumerate(WEEKDAY_LABELS)}
+MON_WED = ("Monday", "Wednesday")
+TUE_THU = ("Tuesday", "Thursday")
+
+
+def greedy_start(scale, seed=1):
+    workload = generate_workload(scale=scale, demand=1.3, seed=seed)
+    project_rooms, _ = split_rooms_config(workload["rooms"])
+    teams = parse_team_preferences(workload["team_preferences"], verbose=False)
+    _, placed_teams, unplaced_teams = allocate_project_rooms(project_rooms, teams, DAY_MAPPING,
+                                                             rng=random.Random(seed), verbose=False)
+    return project_rooms, teams, placed_teams, unplaced_teams
+
+
+class SteppingClock:
+    """Stand-in for the time module whose perf_counter advances a fixed tick on every call."""
+
+    def __init__(self, tick):
+        self.now = 0.0
+        self.tick = tick
+
+    def perf_counter(self):
+        self.now += self.tick
+        return self.now
+
+
+def test_leftover_team_is_placed_by_moving_a_blocker():
+    # Only Room Big fits Team Large, and both of its slots are taken; Team Small can move to Room Tiny
+    rooms = [{"name": "Room Big", "capacity": 6}, {"name": "Room Tiny", "capacity": 4}]
+    teams = [
+        ("Team Small", 4, list(MON_WED)),
+        ("Team Other", 4, list(TUE_THU)),
+        ("Team Large", 6, list(MON_WED)),
+        ("Team Tiny", 3, list(TUE_THU)),
+    ]
+    placed_teams = {
+        "Team Small": ("Room Big", MON_WED),
+        "Team Other": ("Room Big", TUE_THU),
+        "Team Tiny": ("Room Tiny", TUE_THU),
+    }
+
+    rows, placed, unplaced, report = improve_project_placement(
+        rooms, teams, placed_teams, [("Team Large", 6, list(MON_WED))], DAY_MAPPING,
+        time_budget=1.0, rng=random.Random(0), verbose=False,
+    )
+
+    assert placed["Team Large"] == ("Room Big", MON_WED)
+    assert placed["Team Small"] == ("Room Tiny", MON_WED)
+    assert unplaced == []
+    assert report["placed_gain"] == 1
+    assert len(set((room_name, date_obj) for _, room_name, date_obj in rows)) == len(rows)
+
+
+def test_off_preference_team_swaps_into_its_pattern():
+    rooms = [{"name": "Room A", "capacity": 6}, {"name": "Room B", "capacity": 6}]
+    teams = [("Team 1", 4, list(MON_WED)), ("Team 2", 4, list(TUE_THU)),
+             ("Team 3", 4, list(TUE_THU)), ("Team 4", 4, list(MON_WED))]
+    placed_teams = {
+        "Team 1": ("Room A", TUE_THU),
+        "Team 2": ("Room A", MON_WED),
+        "Team 3": ("Room B", TUE_THU),
+        "Team 4": ("Room B", MON_WED),
+    }
+
+    _, placed, _, report = improve_project_placement(rooms, teams, placed_teams, [], DAY_MAPPING,
+                                                     rng=random.Random(0), verbose=False)
+
+    assert placed["Team 1"][1] == MON_WED
+    assert placed["Team 2"][1] == TUE_THU
+    assert report["honoured_gain"] == 2
+    assert report["stopped_by"] == "local_optimum"
+
+
+def test_search_stays_within_its_time_budget():
+    project_rooms, teams, placed_teams, unplaced_teams = greedy_start(scale=100)
+
+    start_time = time.perf_counter()
+    *_, report = improve_project_placement(project_rooms, teams, placed_teams, unplaced_teams, DAY_MAPPING,
+                                           time_budget=0.1, rng=random.Random(2), verbose=False)
+
+    assert time.perf_counter() - start_time < 0.1 + 0.05
+    assert report["elapsed_ms"] < 150
+
+
+def test_budget_cut_inside_a_step_replays_with_the_recorded_steps(monkeypatch):
+    # A step reads the clock once per swap partner it looks at; at 1 ms a read the 40 ms budget
+    # runs out inside a step, which must then be undone and left out of the step count
+    project_rooms, teams, placed_teams, unplaced_teams = greedy_start(scale=20)
+
+    monkeypatch.setattr(allocation_engine, "time", SteppingClock(tick=0.001))
+    budget_rows, budget_placed, _, report = improve_project_placement(
+        project_rooms, teams, placed_teams, unplaced_teams, DAY_MAPPING,
+        time_budget=0.04, rng=random.Random(2), verbose=False,
+    )
+    monkeypatch.undo()
+
+    assert report["stopped_by"] == "budget"
+    assert report["elapsed_ms"] <= 40 + 1 + 1e-6
+
+    replay_rows, replay_placed, _, replay_report = improve_project_placement(
+        project_rooms, teams, placed_teams, unplaced_teams, DAY_MAPPING,
+        max_steps=report["steps"], rng=random.Random(2), verbose=False,
+    )
+
+    assert replay_report["steps"] == report["steps"]
+    assert replay_placed == budget_placed
+    assert sorted(replay_rows) == sorted(budget_rows)
+
+
+def test_zero_budget_leaves_the_plan_unchanged():
+    project_rooms, teams, placed_teams, unplaced_teams = greedy_start(scale=5)
+
+    _, placed, unplaced, report = improve_project_placement(
+        project_rooms, teams, placed_teams, unplaced_teams, DAY_MAPPING,
+        time_budget=0, rng=random.Random(2), verbose=False,
+    )
+
+    assert report["steps"] == 0
+    assert report["stopped_by"] == "budget"
+    assert placed == placed_teams
+    assert unplaced == unplaced_teams
@@ -0,0 +1,76 @@
+import json
+from datetime import date
+
+import pytest
+
+import allocate_rooms
+from allocate_rooms import allocate_week, get_day_mapping, replay_run_snapshot
+from allocation_engine import plan_digest
+from benchmarks.workload import generate_workload
+
+MONDAY = date(2025, 1, 6)
+
+
+@pytest.fixture
+def stub_database(monkeypatch):
+    """Serve a synthetic workload in place of rooms.json and the database reads, and drop the writes."""
+    workload = generate_workload(scale=4, demand=1.4, seed=9)
+    written = {}
+
+    def record_diff(cur, diff, site=None):
+        written["diff"] = diff
+        return 0.0
+
+    monkeypatch.setattr(allocate_rooms, "load_rooms_config", lambda: workload["rooms"])
+    monkeypatch.setattr(allocate_rooms, "load_allocation_inputs",
+                        lambda cur, only=None, site=None: (workload["team_preferences"], workload["oasis_preferences"]))
+    monkeypatch.setattr(allocate_rooms, "load_existing_week", lambda cur, monday, only=None, site=None: [])
+    monkeypatch.setattr(allocate_rooms, "apply_allocation_diff", record_diff)
+    monkeypatch.setattr(allocate_rooms, "write_history_rollup", lambda *args, **kwargs: 0.0)
+    return written
+
+
+def run_week(tmp_path, **options):
+    stats = {"timings": {}}
+    run_options = dict(only=None, solver="greedy", seed=31, incremental=False, candidates=1, time_budget=None,
+                       snapshot_dir=str(tmp_path), stats=stats)
+    run_options.update(options)
+    success, _ = allocate_week(None, MONDAY, get_day_mapping(MONDAY), **run_options)
+    assert success
+    return stats
+
+
+@pytest.mark.parametrize("solver", ["greedy", "optimal"])
+def test_replayed_snapshot_reproduces_the_run(stub_database, tmp_path, solver):
+    stats = run_week(tmp_path, solver=solver)
+
+    plan, matches = replay_run_snapshot(stats["snapshot_path"])
+
+    assert matches
+    assert sorted(plan.rows) == sorted(stub_database["diff"].to_insert)
+
+
+def test_replayed_snapshot_reproduces_a_time_budgeted_local_search(stub_database, tmp_path):
+    stats = run_week(tmp_path, improve_budget=0.05)
+
+    plan, matches = replay_run_snapshot(stats["snapshot_path"])
+
+    with open(stats["snapshot_path"]) as f:
+        snapshot = json.load(f)
+    assert snapshot["improve_steps"] == stats["improvement"]["steps"]
+    assert plan.improvement["steps"] == stats["improvement"]["steps"]
+    assert matches
+
+
+def test_replayed_snapshot_reproduces_the_best_of_n_winner(stub_database, tmp_path):
+    stats = run_week(tmp_path, candidates=3, time_budget=2.0, improve_budget=0.05)
+
+    plan, matches = replay_run_snapshot(stats["snapshot_path"])
+
+    with open(stats["snapshot_path"]) as f:
+        snapshot = json.load(f)
+    assert stats["candidates_evaluated"] >= 1
+    assert snapshot["seed"] == stats["seed"]
+    assert plan.seed == stats["seed"]
+    assert plan_digest(plan) == snapshot["plan_digest"]
+    assert matches